@@ -12,6 +12,8 @@ import { formatDate, parseExifDate } from '@/app/utils/dateFormat';
 interface Photo {
   id: string;
   url: string;
+  placeholder?: string | null;
+  dominantColor?: string | null;
   exif: {
     camera_model?: string;
     lens_model?: string;
@@ -122,6 +124,8 @@ export default function AlbumPage() {
           return {
             id: matched?.id || `${albumId}_${index}`,
             url,
+            placeholder: matched?.placeholder || null,
+            dominantColor: matched?.dominant_color || null,
             exif: matched?.exif || {},
           };
         });
@@ -205,11 +209,13 @@ export default function AlbumPage() {
               (photo.exif?.orientation || '') && /90|270|Rotated 90|Rotated 270/i.test(photo.exif.orientation || '')
                 ? 'aspect-[3/4]'
                 : 'aspect-[4/3]'
-            }`}>
+            }`} style={photo.dominantColor ? { backgroundColor: photo.dominantColor } : undefined}>
               <Image
                 src={photo.url}
                 alt={`${album.title} - 照片 ${index + 1}`}
                 fill
+                placeholder={photo.placeholder ? 'blur' : 'empty'}
+                blurDataURL={photo.placeholder || undefined}
                 className="object-cover hover:scale-105 transition-transform duration-500"
                 sizes="(max-width: 768px) 100vw, (max-width: 1200px) 50vw, 33vw"
               />
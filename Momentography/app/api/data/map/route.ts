@@ -0,0 +1,57 @@
+import { NextRequest, NextResponse } from 'next/server';
+import {
+  getMapClusters,
+  getMapMaxClusterZoom,
+  getMapPhotosInBounds,
+  getMapPhotosNear,
+  MapBounds
+} from '@/app/utils/dbUtils';
+
+// 解析 bbox=west,south,east,north
+function parseBounds(value: string | null): MapBounds | null {
+  if (!value) {
+    return null;
+  }
+  const parts = value.split(',').map(Number);
+  if (parts.length !== 4 || parts.some(Number.isNaN)) {
+    return null;
+  }
+  const [west, south, east, north] = parts;
+  return { west, south, east, north };
+}
+
+export async function GET(request: NextRequest) {
+  try {
+    const searchParams = request.nextUrl.searchParams;
+
+    // 圆形区域选择：?lat=&lng=&radius=（米）
+    if (searchParams.has('radius')) {
+      const lat = Number(searchParams.get('lat'));
+      const lng = Number(searchParams.get('lng'));
+      const radius = Number(searchParams.get('radius'));
+      if ([lat, lng, radius].some(Number.isNaN) || radius <= 0) {
+        return NextResponse.json({ success: false, error: '无效的参数' }, { status: 400 });
+      }
+      return NextResponse.json({ success: true, photos: getMapPhotosNear(lat, lng, radius) });
+    }
+
+    // 视野查询：?zoom=&bbox=west,south,east,north
+    const bounds = parseBounds(searchParams.get('bbox'));
+    const zoom = Math.max(0, Math.floor(Number(searchParams.get('zoom') ?? 0)));
+    if (!bounds || Number.isNaN(zoom)) {
+      return NextResponse.json({ success: false, error: '无效的参数' }, { status: 400 });
+    }
+
+    // 超过聚合索引的最高级别后返回单张照片
+    const maxClusterZoom = getMapMaxClusterZoom();
+    if (maxClusterZoom === null || zoom > maxClusterZoom) {
+      return NextResponse.json({ success: true, zoom, clusters: [], photos: getMapPhotosInBounds(bounds) });
+    }
+    return NextResponse.json({ success: true, zoom, clusters: getMapClusters(zoom, bounds), photos: [] });
+  } catch (error) {
+    return NextResponse.json(
+      { success: false, error: '获取地图数据失败' },
+      { status: 500 }
+    );
+  }
+}
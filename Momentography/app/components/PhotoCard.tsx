@@ -12,6 +12,8 @@ interface PhotoCardProps {
     title?: string;
     star?: number;
     location?: string;
+    placeholder?: string | null;
+    dominant_color?: string | null;
   };
   isAdmin?: boolean;
   onStarUpdate?: (newStars: number) => void;
@@ -48,11 +50,16 @@ export default function PhotoCard({ photo, isAdmin, onStarUpdate }: PhotoCardPro
 
   return (
     <div className="relative group">
-      <div className="relative aspect-[4/3] overflow-hidden rounded-lg bg-gray-200 dark:bg-gray-700">
+      <div
+        className="relative aspect-[4/3] overflow-hidden rounded-lg bg-gray-200 dark:bg-gray-700"
+        style={photo.dominant_color ? { backgroundColor: photo.dominant_color } : undefined}
+      >
         <Image
           src={photo.url}
           alt={photo.title || ""}
           fill
+          placeholder={photo.placeholder ? 'blur' : 'empty'}
+          blurDataURL={photo.placeholder || undefined}
           className="object-cover transition-transform duration-700 group-hover:scale-105"
         />
         <div className="absolute inset-0 bg-gradient-to-b from-transparent to-black/60 opacity-0 group-hover:opacity-100 transition-opacity duration-300" />
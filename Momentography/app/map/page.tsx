@@ -1,6 +1,6 @@
 'use client';
 
-import { useState, useEffect, useRef } from 'react';
+import { useState, useEffect, useRef, useCallback } from 'react';
 import dynamic from 'next/dynamic';
 import Image from 'next/image';
 import { motion, AnimatePresence } from 'framer-motion';
@@ -68,6 +68,84 @@ interface Photo {
   };
 }
 
+// 预先聚合的地图聚合点（按瓦片），photo 为其中最新拍摄的一张
+interface Cluster {
+  id: string;
+  count: number;
+  latitude: number;
+  longitude: number;
+  photo: {
+    id: string;
+    url: string | null;
+  };
+}
+
+// 监听视野变化（拖动、缩放结束），把缩放级别和视野范围交给页面加载数据
+const ViewportWatcher = ({ onViewportChange }: { onViewportChange: (zoom: number, bbox: number[]) => void }) => {
+  const { useMap } = require('react-leaflet');
+  const map = useMap();
+
+  useEffect(() => {
+    if (!map) return;
+
+    const handleMoveEnd = () => {
+      const bounds = map.getBounds();
+      // 视野超过一圈经度时按全球范围查询，避免经度越界
+      const wide = bounds.getEast() - bounds.getWest() >= 360;
+      const wrap = (lng: number) => ((lng + 540) % 360) - 180;
+      onViewportChange(map.getZoom(), [
+        wide ? -180 : wrap(bounds.getWest()),
+        bounds.getSouth(),
+        wide ? 180 : wrap(bounds.getEast()),
+        bounds.getNorth()
+      ]);
+    };
+
+    handleMoveEnd();
+    map.on('moveend', handleMoveEnd);
+
+    return () => {
+      map.off('moveend', handleMoveEnd);
+    };
+  }, [map, onViewportChange]);
+
+  return null;
+};
+
+const DynamicViewportWatcher = dynamic(
+  () => Promise.resolve(ViewportWatcher),
+  { ssr: false }
+);
+
+// 聚合点标记：显示张数，点击后放大到该区域
+const ClusterMarker = ({ cluster }: { cluster: Cluster }) => {
+  const { useMap, Marker: LeafletMarker } = require('react-leaflet');
+  const L = require('leaflet');
+  const map = useMap();
+  const size = cluster.count < 10 ? 32 : cluster.count < 100 ? 40 : 48;
+  const icon = L.divIcon({
+    html: `<div class="flex items-center justify-center rounded-full bg-blue-600/85 text-white text-xs font-semibold shadow-lg border-2 border-white" style="width:${size}px;height:${size}px">${cluster.count}</div>`,
+    className: '',
+    iconSize: [size, size],
+    iconAnchor: [size / 2, size / 2]
+  });
+
+  return (
+    <LeafletMarker
+      position={[cluster.latitude, cluster.longitude]}
+      icon={icon}
+      eventHandlers={{
+        click: () => map.setView([cluster.latitude, cluster.longitude], Math.min(map.getZoom() + 2, map.getMaxZoom()))
+      }}
+    />
+  );
+};
+
+const DynamicClusterMarker = dynamic(
+  () => Promise.resolve(ClusterMarker),
+  { ssr: false }
+);
+
 // 自定义地图控制组件
 const MapController = ({ onCircleSelect }: { onCircleSelect: (center: [number, number], radius: number) => void }) => {
   // 在组件内部导入 useMap hook
@@ -359,151 +437,158 @@ const Gallery = ({ photos, onClose }: { photos: Photo[], onClose: () => void })
 
 export default function MapPage() {
   const [photos, setPhotos] = useState<Photo[]>([]);
-  const [isLoading, setIsLoading] = useState(true);
-  const [isLoaded, setIsLoaded] = useState(false);
+  const [clusters, setClusters] = useState<Cluster[]>([]);
   const [drawerOpen, setDrawerOpen] = useState(false);
   const [circlePhotos, setCirclePhotos] = useState<Photo[]>([]);
   const [selectedCircle, setSelectedCircle] = useState<{center: [number, number], radius: number} | null>(null);
+  const viewportRequestRef = useRef(0);
 
-  useEffect(() => {
-    async function loadPhotos() {
-      try {
-        // 使用新的API路由获取地图数据
-        const response = await fetch('/api/data/map');
-        if (!response.ok) {
-          throw new Error(`获取地图数据失败: ${response.status} ${response.statusText}`);
-        }
-        
-        const mapData = await response.json();
-        
-        // 直接使用API返回的数据
-        setPhotos(mapData);
-      } catch (error) {
-        setError('加载照片数据时出错');
-      } finally {
-        setIsLoading(false);
-        setIsLoaded(true);
+  // 按当前视野加载聚合点（放大到聚合索引最高级别之后为单张照片）
+  const handleViewportChange = useCallback(async (zoom: number, bbox: number[]) => {
+    const requestId = ++viewportRequestRef.current;
+    try {
+      const response = await fetch(`/api/data/map?zoom=${zoom}&bbox=${bbox.join(',')}`);
+      if (!response.ok) {
+        throw new Error(`获取地图数据失败: ${response.status} ${response.statusText}`);
       }
-    }
 
-    loadPhotos();
+      const mapData = await response.json();
+
+      // 期间视野又变化过时丢弃旧结果
+      if (requestId !== viewportRequestRef.current) return;
+      setClusters(mapData.clusters || []);
+      setPhotos(mapData.photos || []);
+    } catch (error) {
+      console.error('加载地图数据时出错:', error);
+    }
   }, []);
 
-  // 处理圆形区域选择
-  const handleCircleSelect = (center: [number, number], radius: number) => {
+  // 处理圆形区域选择：由服务端按索引查询区域内的照片
+  const handleCircleSelect = useCallback(async (center: [number, number], radius: number) => {
     setSelectedCircle({ center, radius });
-    
-    // 计算圆形区域内的照片
-    const photosInCircle = photos.filter(photo => {
-      const distance = calculateDistance(
-        center[0], center[1],
-        photo.latitude, photo.longitude
-      );
-      return distance <= radius / 1000; // 转换为公里
-    });
-    
-    setCirclePhotos(photosInCircle);
-    setDrawerOpen(true);
-  };
 
-  // 计算两点之间的距离（公里）
-  const calculateDistance = (lat1: number, lon1: number, lat2: number, lon2: number) => {
-    const R = 6371; // 地球半径（公里）
-    const dLat = (lat2 - lat1) * Math.PI / 180;
-    const dLon = (lon2 - lon1) * Math.PI / 180;
-    const a = 
-      Math.sin(dLat/2) * Math.sin(dLat/2) +
-      Math.cos(lat1 * Math.PI / 180) * Math.cos(lat2 * Math.PI / 180) * 
-      Math.sin(dLon/2) * Math.sin(dLon/2);
-    const c = 2 * Math.atan2(Math.sqrt(a), Math.sqrt(1-a));
-    return R * c;
-  };
+    try {
+      const response = await fetch(`/api/data/map?lat=${center[0]}&lng=${center[1]}&radius=${radius}`);
+      if (!response.ok) {
+        throw new Error(`获取区域内照片失败: ${response.status} ${response.statusText}`);
+      }
+      const result = await response.json();
+      setCirclePhotos(result.photos || []);
+    } catch (error) {
+      console.error('加载区域内照片时出错:', error);
+      setCirclePhotos([]);
+    }
+    setDrawerOpen(true);
+  }, []);
 
   return (
     <div className="min-h-screen relative">
-      {isLoaded ? (
-        <div className="h-[calc(100vh-4rem)] relative">
-          <Map
-            center={MAP_CONFIG.CHINA_CENTER}
-            zoom={MAP_CONFIG.DEFAULT_ZOOM}
-            className="h-full w-full z-0"
-            scrollWheelZoom={true}
-            zoomControl={true}
-          >
-            <TileLayer
-              url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
-              attribution='&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
-              maxZoom={19}
-            />
-            {photos.map((photo) => (
-              <Marker
-                key={photo.id}
-                position={[photo.latitude, photo.longitude]}
-              >
-                <Popup>
-                  <div className="p-2 max-w-xs">
-                    <div className="relative aspect-[4/3] w-full mb-2 rounded-lg overflow-hidden">
-                      <Image
-                        src={photo.url}
-                        alt={photo.title}
-                        fill
-                        className="object-cover"
-                        sizes="(max-width: 768px) 100vw, 300px"
-                      />
-                    </div>
-                    <h3 className="font-medium text-sm">{photo.title}</h3>
-                    <div className="flex items-center mt-1 text-xs text-gray-600">
-                      <MapPin size={12} className="mr-1" />
-                      <span className="truncate">{photo.location}</span>
-                    </div>
-                    <div className="flex items-center mt-1 text-xs text-gray-600">
-                      <Calendar size={12} className="mr-1" />
-                      <span>{photo.date}</span>
-                    </div>
-                    <button 
-                      onClick={() => window.open(`/albums/${photo.id.split('/')[0]}`, '_blank')}
-                      className="mt-2 text-xs text-blue-600 hover:underline"
-                    >
-                      查看相册
-                    </button>
+      <div className="h-[calc(100vh-4rem)] relative">
+        <Map
+          center={MAP_CONFIG.CHINA_CENTER}
+          zoom={MAP_CONFIG.DEFAULT_ZOOM}
+          className="h-full w-full z-0"
+          scrollWheelZoom={true}
+          zoomControl={true}
+        >
+          <TileLayer
+            url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
+            attribution='&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
+            maxZoom={19}
+          />
+          <DynamicViewportWatcher onViewportChange={handleViewportChange} />
+          {clusters.map((cluster) => cluster.count === 1 && cluster.photo.url ? (
+            <Marker
+              key={cluster.id}
+              position={[cluster.latitude, cluster.longitude]}
+            >
+              <Popup>
+                <div className="p-2 max-w-xs">
+                  <div className="relative aspect-[4/3] w-full mb-2 rounded-lg overflow-hidden">
+                    <Image
+                      src={cluster.photo.url}
+                      alt={cluster.photo.id}
+                      fill
+                      className="object-cover"
+                      sizes="(max-width: 768px) 100vw, 300px"
+                    />
                   </div>
-                </Popup>
-              </Marker>
-            ))}
-            
-            <DynamicMapController onCircleSelect={handleCircleSelect} />
-          </Map>
-          
-          {/* 悬浮式抽屉画廊 - 移到左侧 */}
-          <AnimatePresence>
-            {drawerOpen && (
-              <motion.div 
-                className="absolute top-4 left-4 h-[calc(100%-2rem)] w-80 bg-white/95 dark:bg-gray-800/95 backdrop-blur-sm shadow-[0_8px_30px_rgb(0,0,0,0.12)] dark:shadow-[0_8px_30px_rgba(0,0,0,0.3)] z-10 rounded-lg overflow-hidden border border-gray-100 dark:border-gray-700"
-                initial={{ x: -320, opacity: 0 }}
-                animate={{ x: 0, opacity: 1 }}
-                exit={{ x: -320, opacity: 0 }}
-                transition={{ 
-                  type: 'spring', 
-                  damping: 25, 
-                  stiffness: 250,
-                  mass: 0.8
-                }}
-              >
-                <div className="p-4 h-full">
-                  <Gallery 
-                    photos={circlePhotos} 
-                    onClose={() => setDrawerOpen(false)} 
-                  />
+                  <button 
+                    onClick={() => window.open(`/albums/${cluster.photo.id.split('/')[0]}`, '_blank')}
+                    className="mt-2 text-xs text-blue-600 hover:underline"
+                  >
+                    查看相册
+                  </button>
                 </div>
-              </motion.div>
-            )}
-          </AnimatePresence>
-        </div>
-      ) : (
-        <div className="flex items-center justify-center min-h-screen">
-          <div className="w-12 h-12 border-4 border-gray-300 border-t-gray-800 rounded-full animate-spin" />
-        </div>
-      )}
+              </Popup>
+            </Marker>
+          ) : (
+            <DynamicClusterMarker key={cluster.id} cluster={cluster} />
+          ))}
+          {photos.map((photo) => (
+            <Marker
+              key={photo.id}
+              position={[photo.latitude, photo.longitude]}
+            >
+              <Popup>
+                <div className="p-2 max-w-xs">
+                  <div className="relative aspect-[4/3] w-full mb-2 rounded-lg overflow-hidden">
+                    <Image
+                      src={photo.url}
+                      alt={photo.title}
+                      fill
+                      className="object-cover"
+                      sizes="(max-width: 768px) 100vw, 300px"
+                    />
+                  </div>
+                  <h3 className="font-medium text-sm">{photo.title}</h3>
+                  <div className="flex items-center mt-1 text-xs text-gray-600">
+                    <MapPin size={12} className="mr-1" />
+                    <span className="truncate">{photo.location}</span>
+                  </div>
+                  <div className="flex items-center mt-1 text-xs text-gray-600">
+                    <Calendar size={12} className="mr-1" />
+                    <span>{photo.date}</span>
+                  </div>
+                  <button 
+                    onClick={() => window.open(`/albums/${photo.id.split('/')[0]}`, '_blank')}
+                    className="mt-2 text-xs text-blue-600 hover:underline"
+                  >
+                    查看相册
+                  </button>
+                </div>
+              </Popup>
+            </Marker>
+          ))}
+          
+          <DynamicMapController onCircleSelect={handleCircleSelect} />
+        </Map>
+        
+        {/* 悬浮式抽屉画廊 - 移到左侧 */}
+        <AnimatePresence>
+          {drawerOpen && (
+            <motion.div 
+              className="absolute top-4 left-4 h-[calc(100%-2rem)] w-80 bg-white/95 dark:bg-gray-800/95 backdrop-blur-sm shadow-[0_8px_30px_rgb(0,0,0,0.12)] dark:shadow-[0_8px_30px_rgba(0,0,0,0.3)] z-10 rounded-lg overflow-hidden border border-gray-100 dark:border-gray-700"
+              initial={{ x: -320, opacity: 0 }}
+              animate={{ x: 0, opacity: 1 }}
+              exit={{ x: -320, opacity: 0 }}
+              transition={{ 
+                type: 'spring', 
+                damping: 25, 
+                stiffness: 250,
+                mass: 0.8
+              }}
+            >
+              <div className="p-4 h-full">
+                <Gallery 
+                  photos={circlePhotos} 
+                  onClose={() => setDrawerOpen(false)} 
+                />
+              </div>
+            </motion.div>
+          )}
+        </AnimatePresence>
+      </div>
     </div>
   );
 } 
\ No newline at end of file
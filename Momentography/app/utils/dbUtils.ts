@@ -108,10 +108,40 @@ export function initDb() {
     if (!hasPosition) {
       db.exec(`ALTER TABLE images ADD COLUMN position INTEGER`);
     }
+    // 占位图（base64 WebP）与主色，由导入脚本从 EXIF 记录写入
+    if (!tableInfo.some((column: any) => column.name === 'placeholder')) {
+      db.exec(`ALTER TABLE images ADD COLUMN placeholder TEXT`);
+    }
+    if (!tableInfo.some((column: any) => column.name === 'dominant_color')) {
+      db.exec(`ALTER TABLE images ADD COLUMN dominant_color TEXT`);
+    }
   } catch (error) {
     console.error('检查或更新 images 表结构时出错:', error);
   }
 
+  // 地图聚合索引，由导入脚本从 EXIF 存储复制
+  db.exec(`
+    CREATE TABLE IF NOT EXISTS geo_clusters (
+      zoom INTEGER NOT NULL,
+      x INTEGER NOT NULL,
+      y INTEGER NOT NULL,
+      count INTEGER NOT NULL,
+      latitude REAL NOT NULL,
+      longitude REAL NOT NULL,
+      photo_id TEXT NOT NULL,
+      PRIMARY KEY (zoom, x, y)
+    )
+  `);
+  db.exec('CREATE INDEX IF NOT EXISTS idx_geo_clusters_viewport ON geo_clusters(zoom, latitude, longitude)');
+  db.exec(`
+    CREATE TABLE IF NOT EXISTS geo_points (
+      photo_id TEXT PRIMARY KEY,
+      latitude REAL NOT NULL,
+      longitude REAL NOT NULL
+    )
+  `);
+  db.exec('CREATE INDEX IF NOT EXISTS idx_geo_points_position ON geo_points(latitude, longitude)');
+
   // 创建更新记录表
   db.exec(`
     CREATE TABLE IF NOT EXISTS updates (
@@ -240,6 +270,8 @@ interface ImageRecord {
   date: string | null;
   star: number;
   likes: number;
+  placeholder?: string | null;
+  dominant_color?: string | null;
   created_at: string;
   updated_at: string;
   [key: string]: any;
@@ -874,5 +906,122 @@ export function getPhotosWithLocation() {
   return mapData;
 }
 
+// 地图视野范围（经度可能跨越 180° 经线，此时 west > east）
+export interface MapBounds {
+  west: number;
+  south: number;
+  east: number;
+  north: number;
+}
+
+function boundsCondition(bounds: MapBounds, alias: string) {
+  const longitude = bounds.west <= bounds.east
+    ? `${alias}.longitude BETWEEN @west AND @east`
+    : `(${alias}.longitude >= @west OR ${alias}.longitude <= @east)`;
+  return `${alias}.latitude BETWEEN @south AND @north AND ${longitude}`;
+}
+
+const MAP_PHOTO_COLUMNS = `
+  p.photo_id AS id, p.latitude, p.longitude, i.url, a.title AS album_title,
+  e.location, e.date_time, e.camera_model, e.f_number, e.iso, e.focal_length, e.exposure_time, e.lens_model
+`;
+
+const MAP_PHOTO_JOINS = `
+  JOIN images i ON i.id = p.photo_id
+  LEFT JOIN albums a ON a.id = i.album_id
+  LEFT JOIN exif_data e ON e.image_id = p.photo_id
+`;
+
+function toMapPhoto(row: any) {
+  return {
+    id: row.id,
+    url: row.url,
+    title: row.album_title || '未知相册',
+    location: row.location || '未知地点',
+    latitude: row.latitude,
+    longitude: row.longitude,
+    date: row.date_time || '未知时间',
+    cameraModel: row.camera_model || '未知相机',
+    exif: {
+      FNumber: row.f_number,
+      ISO: row.iso,
+      FocalLength: row.focal_length,
+      ExposureTime: row.exposure_time,
+      LensModel: row.lens_model,
+    }
+  };
+}
+
+// 聚合索引的最高缩放级别，没有索引时为 null
+export function getMapMaxClusterZoom(): number | null {
+  const db = getDb();
+  const row = db.prepare('SELECT MAX(zoom) AS zoom FROM geo_clusters').get() as { zoom: number | null };
+  db.close();
+  return row.zoom;
+}
+
+// 视野内某一缩放级别的聚合点，附带代表照片
+export function getMapClusters(zoom: number, bounds: MapBounds, limit = 2000) {
+  const db = getDb();
+  const rows = db.prepare(`
+    SELECT c.x, c.y, c.count, c.latitude, c.longitude, c.photo_id, i.url
+    FROM geo_clusters c
+    LEFT JOIN images i ON i.id = c.photo_id
+    WHERE c.zoom = @zoom AND ${boundsCondition(bounds, 'c')}
+    ORDER BY c.count DESC
+    LIMIT @limit
+  `).all({ ...bounds, zoom, limit }) as any[];
+  db.close();
+  return rows.map(row => ({
+    id: `${zoom}/${row.x}/${row.y}`,
+    count: row.count,
+    latitude: row.latitude,
+    longitude: row.longitude,
+    photo: { id: row.photo_id, url: row.url },
+  }));
+}
+
+// 视野内的单张照片（放大到聚合索引最高级别之后使用）
+export function getMapPhotosInBounds(bounds: MapBounds, limit = 2000) {
+  const db = getDb();
+  const rows = db.prepare(`
+    SELECT ${MAP_PHOTO_COLUMNS}
+    FROM geo_points p
+    ${MAP_PHOTO_JOINS}
+    WHERE ${boundsCondition(bounds, 'p')}
+    ORDER BY e.date_time DESC
+    LIMIT @limit
+  `).all({ ...bounds, limit });
+  db.close();
+  return rows.map(toMapPhoto);
+}
+
+// 圆形区域内的照片：先用外接矩形走索引，再按球面距离精确过滤
+export function getMapPhotosNear(latitude: number, longitude: number, radiusMeters: number) {
+  const latDelta = radiusMeters / 111320;
+  const lonDelta = radiusMeters / (111320 * Math.max(Math.cos(latitude * Math.PI / 180), 1e-6));
+  const wrap = (value: number) => ((value + 540) % 360) - 180;
+  const bounds = lonDelta >= 180
+    ? { west: -180, east: 180 }
+    : { west: wrap(longitude - lonDelta), east: wrap(longitude + lonDelta) };
+  const candidates = getMapPhotosInBounds({
+    ...bounds,
+    south: latitude - latDelta,
+    north: latitude + latDelta,
+  }, 100000);
+  return candidates.filter(photo => distanceMeters(latitude, longitude, photo.latitude, photo.longitude) <= radiusMeters);
+}
+
+function distanceMeters(lat1: number, lon1: number, lat2: number, lon2: number) {
+  const R = 6371000; // 地球半径（米）
+  const dLat = (lat2 - lat1) * Math.PI / 180;
+  const dLon = (lon2 - lon1) * Math.PI / 180;
+  const a =
+    Math.sin(dLat / 2) * Math.sin(dLat / 2) +
+    Math.cos(lat1 * Math.PI / 180) * Math.cos(lat2 * Math.PI / 180) *
+    Math.sin(dLon / 2) * Math.sin(dLon / 2);
+  return R * 2 * Math.atan2(Math.sqrt(a), Math.sqrt(1 - a));
+}
+
 // 初始化数据库
 initDb(); 
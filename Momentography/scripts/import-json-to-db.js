@@ -11,6 +11,7 @@ const Database = require('better-sqlite3');
 const DB_PATH = path.join(process.cwd(), 'data', 'gallery.db');
 const ALBUMS_JSON_PATH = path.join(process.cwd(), 'public', 'data', 'albums.json');
 const EXIF_JSON_PATH = path.join(process.cwd(), 'public', 'data', 'exif_data.json');
+const EXIF_DB_PATH = process.env.EXIF_DB_PATH || path.join(process.cwd(), 'public', 'data', 'exif_data.db');
 const LIKES_JSON_PATH = path.join(process.cwd(), 'public', 'data', 'likes.json');
 
 // 确保数据库目录存在
@@ -58,6 +59,15 @@ function initDb() {
     )
   `);
 
+  // 占位图与主色（转换阶段生成，随 EXIF 记录导入），页面在原图加载前先行显示
+  const imageColumns = db.prepare('PRAGMA table_info(images)').all().map((column) => column.name);
+  if (!imageColumns.includes('placeholder')) {
+    db.exec('ALTER TABLE images ADD COLUMN placeholder TEXT');
+  }
+  if (!imageColumns.includes('dominant_color')) {
+    db.exec('ALTER TABLE images ADD COLUMN dominant_color TEXT');
+  }
+
   // 创建 EXIF 数据表
   db.exec(`
     CREATE TABLE IF NOT EXISTS exif_data (
@@ -77,6 +87,29 @@ function initDb() {
     )
   `);
 
+  // 地图聚合索引（由 geo_index.py 在 EXIF 存储中生成，整体复制过来）
+  db.exec(`
+    CREATE TABLE IF NOT EXISTS geo_clusters (
+      zoom INTEGER NOT NULL,
+      x INTEGER NOT NULL,
+      y INTEGER NOT NULL,
+      count INTEGER NOT NULL,
+      latitude REAL NOT NULL,
+      longitude REAL NOT NULL,
+      photo_id TEXT NOT NULL,
+      PRIMARY KEY (zoom, x, y)
+    )
+  `);
+  db.exec('CREATE INDEX IF NOT EXISTS idx_geo_clusters_viewport ON geo_clusters(zoom, latitude, longitude)');
+  db.exec(`
+    CREATE TABLE IF NOT EXISTS geo_points (
+      photo_id TEXT PRIMARY KEY,
+      latitude REAL NOT NULL,
+      longitude REAL NOT NULL
+    )
+  `);
+  db.exec('CREATE INDEX IF NOT EXISTS idx_geo_points_position ON geo_points(latitude, longitude)');
+
   // 创建更新记录表
   db.exec(`
     CREATE TABLE IF NOT EXISTS updates (
@@ -152,8 +185,24 @@ function importAlbums(db, albumsData) {
   console.log('相册数据导入完成');
 }
 
+// 从 EXIF 索引存储读取数据（光圈、ISO 已是数值列）
+function readExifStore(dbPath) {
+  const store = new Database(dbPath, { readonly: true, fileMustExist: true });
+  try {
+    const exifData = {};
+    const typedColumns = {};
+    for (const row of store.prepare('SELECT key, f_number, iso, raw FROM exif').iterate()) {
+      exifData[row.key] = JSON.parse(row.raw);
+      typedColumns[row.key] = { fNumber: row.f_number, iso: row.iso };
+    }
+    return { exifData, typedColumns };
+  } finally {
+    store.close();
+  }
+}
+
 // 导入 EXIF 数据
-function importExifData(db, exifData) {
+function importExifData(db, exifData, typedColumns = {}) {
   console.log('导入 EXIF 数据...');
   
   let processedCount = 0;
@@ -182,14 +231,15 @@ function importExifData(db, exifData) {
       if (image) {
         // 将完整数据序列化为 JSON
         const rawData = JSON.stringify(data);
+        const typed = typedColumns[originalId] || {};
         
         insertExifStmt.run(
           newId,
           data.CameraModel || null,
           data.LensModel || null,
-          data.FNumber || null,
+          typed.fNumber ?? (data.FNumber || null),
           data.ExposureTime || null,
-          data.ISO || null,
+          typed.iso ?? (data.ISO || null),
           data.FocalLength || null,
           data.Location || null,
           data.DateTime || null,
@@ -305,6 +355,83 @@ function importStarData(db, exifData) {
   console.log('星级数据导入完成');
 }
 
+// 导入占位图与主色数据
+function importPlaceholderData(db, exifData) {
+  console.log('导入占位图数据...');
+  
+  let processedCount = 0;
+  
+  try {
+    // 开始事务
+    db.prepare('BEGIN TRANSACTION').run();
+    
+    const updateStmt = db.prepare('UPDATE images SET placeholder = ?, dominant_color = ? WHERE id = ?');
+    
+    for (const [imageId, data] of Object.entries(exifData)) {
+      if (!data.Placeholder && !data.DominantColor) {
+        continue;
+      }
+      // 将文件扩展名转换为 .webp 以匹配数据库中的图片 ID
+      const newId = imageId.replace(/\.(jpeg|jpg|JPG|JPEG)$/i, '.webp');
+      const result = updateStmt.run(data.Placeholder || null, data.DominantColor || null, newId);
+      processedCount += result.changes;
+    }
+    
+    // 提交事务
+    db.prepare('COMMIT').run();
+    console.log(`处理了 ${processedCount} 条占位图数据`);
+  } catch (error) {
+    // 回滚事务
+    db.prepare('ROLLBACK').run();
+    console.error('导入占位图数据时出错:', error);
+  }
+}
+
+// 导入地图聚合索引
+function importGeoIndex(db, dbPath) {
+  console.log('导入地图聚合索引...');
+
+  const store = new Database(dbPath, { readonly: true, fileMustExist: true });
+  try {
+    const hasIndex = store
+      .prepare("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'geo_clusters'")
+      .get();
+    if (!hasIndex) {
+      console.warn('EXIF 存储中没有地图聚合索引');
+      return;
+    }
+
+    // 将文件扩展名转换为 .webp 以匹配数据库中的图片 ID
+    const toImageId = (key) => key.replace(/\.(jpeg|jpg|JPG|JPEG)$/i, '.webp');
+    const insertCluster = db.prepare(`
+      INSERT INTO geo_clusters (zoom, x, y, count, latitude, longitude, photo_id)
+      VALUES (?, ?, ?, ?, ?, ?, ?)
+    `);
+    const insertPoint = db.prepare('INSERT OR REPLACE INTO geo_points (photo_id, latitude, longitude) VALUES (?, ?, ?)');
+
+    let clusterCount = 0;
+    let pointCount = 0;
+    const transaction = db.transaction(() => {
+      db.prepare('DELETE FROM geo_clusters').run();
+      db.prepare('DELETE FROM geo_points').run();
+      for (const row of store.prepare('SELECT zoom, x, y, count, latitude, longitude, photo_key FROM geo_clusters').iterate()) {
+        insertCluster.run(row.zoom, row.x, row.y, row.count, row.latitude, row.longitude, toImageId(row.photo_key));
+        clusterCount++;
+      }
+      for (const row of store.prepare('SELECT key, latitude, longitude FROM geo_points').iterate()) {
+        insertPoint.run(toImageId(row.key), row.latitude, row.longitude);
+        pointCount++;
+      }
+    });
+    transaction();
+    console.log(`导入了 ${pointCount} 个照片坐标，${clusterCount} 个聚合点`);
+  } catch (error) {
+    console.error('导入地图聚合索引时出错:', error);
+  } finally {
+    store.close();
+  }
+}
+
 // 主函数
 async function main() {
   try {
@@ -315,6 +442,7 @@ async function main() {
     // 读取 JSON 文件
     let albumsData = {};
     let exifData = {};
+    let exifTypedColumns = {};
     let likesData = {};
     
     if (fs.existsSync(ALBUMS_JSON_PATH)) {
@@ -324,7 +452,10 @@ async function main() {
       console.warn('相册数据文件不存在');
     }
     
-    if (fs.existsSync(EXIF_JSON_PATH)) {
+    if (fs.existsSync(EXIF_DB_PATH)) {
+      ({ exifData, typedColumns: exifTypedColumns } = readExifStore(EXIF_DB_PATH));
+      console.log(`从 EXIF 存储读取到 ${Object.keys(exifData).length} 条 EXIF 数据`);
+    } else if (fs.existsSync(EXIF_JSON_PATH)) {
       exifData = JSON.parse(fs.readFileSync(EXIF_JSON_PATH, 'utf8'));
       console.log(`读取到 ${Object.keys(exifData).length} 条 EXIF 数据`);
     } else {
@@ -340,9 +471,13 @@ async function main() {
     
     // 导入数据
     importAlbums(db, albumsData);
-    importExifData(db, exifData);
+    importExifData(db, exifData, exifTypedColumns);
     importLikesData(db, likesData);
     importStarData(db, exifData);
+    importPlaceholderData(db, exifData);
+    if (fs.existsSync(EXIF_DB_PATH)) {
+      importGeoIndex(db, EXIF_DB_PATH);
+    }
     
     // 记录导入操作
     const logUpdate = db.prepare(`
@@ -3,4 +3,7 @@ LOGO_PATH="./assets/sy_dark.png"
 LOGO_PATH_LIGHT = "./assets/sy_light.png"
 albums_json_path = "./data/albums.json"
 exif_json_path = "./data/exif_data.json"
+exif_db_path = "./data/exif_data.db"
+# 同步后数据库导入尚未成功完成的标记
+import_pending_path = "./data/import_pending"
 
@@ -0,0 +1,157 @@
+"""
+EXIF 分面检索
+在 EXIF 存储的带类型列上筛选（相机、镜头、相册为多选，ISO / 焦距 / 光圈 / 快门 / 拍摄时间为范围），
+分页返回结果并附带分面计数；各列都有索引，几万张照片的筛选不需要扫描 raw JSON。
+某个分面的计数按「除该分面以外的全部条件」统计，已选中一个相机时仍能看到其他相机各有多少张。
+"""
+
+# 多选分面：查询参数 -> 列
+CATEGORY_FACETS = {'camera': 'camera_model', 'lens': 'lens_model', 'album': 'album'}
+# 范围条件：查询参数前缀（iso_min / iso_max）-> 列
+RANGE_FILTERS = {
+    'iso': 'iso',
+    'focal': 'focal_length',
+    'aperture': 'f_number',
+    'exposure': 'exposure_seconds',
+}
+SORTS = {
+    'date': 'date_time',
+    'iso': 'iso',
+    'focal': 'focal_length',
+    'aperture': 'f_number',
+    'exposure': 'exposure_seconds',
+    'key': 'key',
+}
+RESULT_COLUMNS = (
+    'key', 'album', 'camera_model', 'lens_model', 'exposure_time', 'f_number', 'iso',
+    'focal_length', 'date_time', 'location', 'star', 'likes',
+)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+FACET_LIMIT = 50
+
+
+def _exif_date(value: str) -> str:
+    """把 2024-05-01 / 2024-05-01T10:00:00 统一为 EXIF 的 2024:05:01 10:00:00 写法，便于按字符串比较"""
+    value = value.strip()
+    return value[:10].replace('-', ':') + value[10:].replace('T', ' ')
+
+
+class SearchQuery:
+    def __init__(self, categories: dict | None = None, ranges: dict | None = None,
+                 date_from: str | None = None, date_to: str | None = None,
+                 sort: str = 'date', descending: bool = True, page: int = 1, page_size: int = DEFAULT_PAGE_SIZE):
+        self.categories = categories or {}
+        self.ranges = ranges or {}
+        self.date_from = date_from
+        self.date_to = date_to
+        self.sort = sort
+        self.descending = descending
+        self.page = page
+        self.page_size = page_size
+
+    @classmethod
+    def from_args(cls, args) -> 'SearchQuery':
+        """从查询参数（Flask 的 request.args）解析；参数不合法时抛出 ValueError"""
+        categories = {}
+        for name in CATEGORY_FACETS:
+            values = [value for value in args.getlist(name) if value]
+            if values:
+                categories[name] = values
+        ranges = {}
+        for name in RANGE_FILTERS:
+            low, high = args.get(f'{name}_min'), args.get(f'{name}_max')
+            if low or high:
+                try:
+                    ranges[name] = (float(low) if low else None, float(high) if high else None)
+                except ValueError:
+                    raise ValueError(f"{name}_min / {name}_max 必须是数字")
+        sort = args.get('sort', 'date')
+        if sort not in SORTS:
+            raise ValueError(f"不支持的排序字段: {sort}")
+        try:
+            page = max(1, int(args.get('page', 1)))
+            page_size = min(MAX_PAGE_SIZE, max(1, int(args.get('page_size', DEFAULT_PAGE_SIZE))))
+        except ValueError:
+            raise ValueError("page / page_size 必须是整数")
+        return cls(
+            categories=categories,
+            ranges=ranges,
+            date_from=_exif_date(args['date_from']) if args.get('date_from') else None,
+            date_to=_exif_date(args['date_to']) if args.get('date_to') else None,
+            sort=sort,
+            descending=args.get('order', 'desc') != 'asc',
+            page=page,
+            page_size=page_size,
+        )
+
+    def where(self, skip: str | None = None) -> tuple[str, list]:
+        """WHERE 子句与参数；skip 为统计该分面计数时要排除的分面"""
+        clauses, params = [], []
+        for name, values in self.categories.items():
+            if name == skip:
+                continue
+            clauses.append(f"{CATEGORY_FACETS[name]} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+        for name, (low, high) in self.ranges.items():
+            column = RANGE_FILTERS[name]
+            if low is not None:
+                clauses.append(f"{column} >= ?")
+                params.append(low)
+            if high is not None:
+                clauses.append(f"{column} <= ?")
+                params.append(high)
+        if self.date_from:
+            clauses.append("date_time >= ?")
+            params.append(self.date_from)
+        if self.date_to:
+            # 只给了日期时包含当天全部时间
+            clauses.append("date_time <= ?")
+            params.append(self.date_to + '\uffff')
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+def search(store, query: SearchQuery) -> dict:
+    """返回 {total, page, page_size, items, facets, ranges}"""
+    conn = store.conn
+    where, params = query.where()
+    total = conn.execute(f"SELECT COUNT(*) FROM exif{where}", params).fetchone()[0]
+
+    column = SORTS[query.sort]
+    direction = 'DESC' if query.descending else 'ASC'
+    rows = conn.execute(
+        f"SELECT {', '.join(RESULT_COLUMNS)} FROM exif{where} "
+        f"ORDER BY {column} IS NULL, {column} {direction}, key LIMIT ? OFFSET ?",
+        params + [query.page_size, (query.page - 1) * query.page_size],
+    ).fetchall()
+
+    facets = {}
+    for name, facet_column in CATEGORY_FACETS.items():
+        facet_where, facet_params = query.where(skip=name)
+        condition = f"{facet_where} AND {facet_column} IS NOT NULL" if facet_where else f" WHERE {facet_column} IS NOT NULL"
+        facets[name] = [
+            {'value': value, 'count': count}
+            for value, count in conn.execute(
+                f"SELECT {facet_column}, COUNT(*) AS n FROM exif{condition} "
+                f"GROUP BY {facet_column} ORDER BY n DESC, {facet_column} LIMIT ?",
+                facet_params + [FACET_LIMIT],
+            )
+        ]
+
+    # 数值列在当前条件下的取值范围，用于范围滑块
+    stats = conn.execute(
+        "SELECT " + ', '.join(f"MIN({c}), MAX({c})" for c in RANGE_FILTERS.values())
+        + ", MIN(date_time), MAX(date_time) FROM exif" + where,
+        params,
+    ).fetchone()
+    ranges = {name: {'min': stats[2 * i], 'max': stats[2 * i + 1]} for i, name in enumerate(RANGE_FILTERS)}
+    ranges['date'] = {'min': stats[-2], 'max': stats[-1]}
+
+    return {
+        'total': total,
+        'page': query.page,
+        'page_size': query.page_size,
+        'items': [dict(zip(RESULT_COLUMNS, row)) for row in rows],
+        'facets': facets,
+        'ranges': ranges,
+    }
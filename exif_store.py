@@ -0,0 +1,212 @@
+"""
+EXIF 索引存储（SQLite）
+以带类型的列保存每张图片的 EXIF（经纬度/光圈为浮点、ISO 为整数），并对相册和拍摄时间建立索引；
+exif_data.json 仍作为导出格式保留，查询与导入优先走这里
+"""
+import json
+import os
+import sqlite3
+from fractions import Fraction
+from urllib.parse import quote
+
+from json_stream import JsonObjectWriter, dumps_compact, iter_json_object
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS exif (
+        key TEXT PRIMARY KEY,
+        album TEXT NOT NULL,
+        camera_model TEXT,
+        lens_model TEXT,
+        exposure_time TEXT,
+        exposure_seconds REAL,
+        f_number REAL,
+        iso INTEGER,
+        focal_length REAL,
+        orientation TEXT,
+        latitude REAL,
+        longitude REAL,
+        date_time TEXT,
+        location TEXT,
+        star INTEGER,
+        likes INTEGER,
+        raw TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_exif_album ON exif(album);
+    CREATE INDEX IF NOT EXISTS idx_exif_date_time ON exif(date_time);
+    -- 分面检索：相机、镜头为倒排索引，数值列为有序索引，支持范围查询
+    CREATE INDEX IF NOT EXISTS idx_exif_camera_model ON exif(camera_model);
+    CREATE INDEX IF NOT EXISTS idx_exif_lens_model ON exif(lens_model);
+    CREATE INDEX IF NOT EXISTS idx_exif_iso ON exif(iso);
+    CREATE INDEX IF NOT EXISTS idx_exif_focal_length ON exif(focal_length);
+    CREATE INDEX IF NOT EXISTS idx_exif_f_number ON exif(f_number);
+    CREATE INDEX IF NOT EXISTS idx_exif_exposure_seconds ON exif(exposure_seconds);
+"""
+
+_UNKNOWN = {'', 'unknown', '未知', 'none', 'null'}
+
+
+def _to_float(value):
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    if text.lower() in _UNKNOWN:
+        return None
+    try:
+        # 兼容 "1/160"、"28/10" 这类分数写法
+        return float(Fraction(text))
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _to_int(value):
+    number = _to_float(value)
+    return int(round(number)) if number is not None else None
+
+
+def _to_text(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    return None if text.lower() in _UNKNOWN else text
+
+
+def album_of(key: str) -> str:
+    """图片键形如 "相册/子相册/文件名.webp"，取文件名之前的部分作为相册"""
+    album, _, _ = key.rpartition('/')
+    return album
+
+
+def record_to_row(key: str, record: dict) -> tuple:
+    return (
+        key,
+        album_of(key),
+        _to_text(record.get('CameraModel')),
+        _to_text(record.get('LensModel')),
+        _to_text(record.get('ExposureTime')),
+        _to_float(record.get('ExposureTime')),
+        _to_float(record.get('FNumber')),
+        _to_int(record.get('ISO')),
+        _to_float(record.get('FocalLength')),
+        _to_text(record.get('Orientation')),
+        _to_float(record.get('Latitude')),
+        _to_float(record.get('Longitude')),
+        _to_text(record.get('DateTime')),
+        _to_text(record.get('Location')),
+        _to_int(record.get('star')),
+        _to_int(record.get('likes')),
+        dumps_compact(record),
+    )
+
+
+class ExifStore:
+    """SQLite 存储的 EXIF 记录，键与 exif_data.json 一致（album/name.webp）"""
+
+    def __init__(self, db_path: str, readonly: bool = False):
+        self.db_path = db_path
+        if readonly:
+            # 查询接口按请求打开：只读连接不设置 journal_mode、不执行建表，不会与同步进程的写入争锁
+            self.conn = sqlite3.connect(f"file:{quote(os.path.abspath(db_path))}?mode=ro", uri=True)
+            return
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        self.close()
+        return False
+
+    def close(self):
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+
+    def clear(self):
+        self.conn.execute("DELETE FROM exif")
+
+    def upsert(self, key: str, record: dict):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO exif VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            record_to_row(key, record),
+        )
+
+    def delete(self, key: str):
+        self.conn.execute("DELETE FROM exif WHERE key = ?", (key,))
+
+    def get(self, key: str) -> dict | None:
+        row = self.conn.execute("SELECT raw FROM exif WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find(self, position: str) -> tuple[str, dict] | tuple[None, None]:
+        """按 "相册/文件名"（不含扩展名）查找，优先精确匹配 .webp 键，其次前缀匹配"""
+        row = self.conn.execute("SELECT key, raw FROM exif WHERE key = ?", (f"{position}.webp",)).fetchone()
+        if not row:
+            # 前缀范围查询可以命中主键索引
+            row = self.conn.execute(
+                "SELECT key, raw FROM exif WHERE key >= ? AND key < ? ORDER BY key LIMIT 1",
+                (position, position + '\uffff'),
+            ).fetchone()
+        if not row:
+            return None, None
+        return row[0], json.loads(row[1])
+
+    def keys(self) -> set[str]:
+        return {row[0] for row in self.conn.execute("SELECT key FROM exif")}
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM exif").fetchone()[0]
+
+    def date_times(self) -> dict[str, str]:
+        """key -> 拍摄时间（EXIF 原始格式），只读索引列，不解析 raw"""
+        return dict(self.conn.execute("SELECT key, date_time FROM exif WHERE date_time IS NOT NULL"))
+
+    def iter_records(self, album: str | None = None):
+        if album is None:
+            cursor = self.conn.execute("SELECT key, raw FROM exif ORDER BY key")
+        else:
+            cursor = self.conn.execute("SELECT key, raw FROM exif WHERE album = ? ORDER BY key", (album,))
+        for key, raw in cursor:
+            yield key, json.loads(raw)
+
+    def iter_raw_by_album(self):
+        """按相册产出 (相册, [(key, raw JSON)])，用于生成分片时不重新序列化记录"""
+        current, rows = None, []
+        for album, key, raw in self.conn.execute("SELECT album, key, raw FROM exif ORDER BY album, key"):
+            if album != current and rows:
+                yield current, rows
+                rows = []
+            current = album
+            rows.append((key, raw))
+        if rows:
+            yield current, rows
+
+    def import_json(self, json_path: str) -> int:
+        """用 exif_data.json 整体重建存储，返回导入条数"""
+        count = 0
+        with self.conn:
+            self.clear()
+            for key, record in iter_json_object(json_path):
+                if isinstance(record, dict):
+                    self.upsert(key, record)
+                    count += 1
+        return count
+
+    def export_json(self, json_path: str) -> int:
+        """流式导出为 exif_data.json，返回导出条数"""
+        with JsonObjectWriter(json_path) as writer:
+            for key, raw in self.conn.execute("SELECT key, raw FROM exif ORDER BY key"):
+                writer.write_raw(key, raw)
+            return writer.count
@@ -0,0 +1,114 @@
+"""
+地图聚合索引
+按 Web 墨卡托瓦片（与地图底图同一套 z/x/y）为每个缩放级别预先聚合带坐标的照片：
+每个瓦片一个聚合点，记录张数、质心和代表照片（最新拍摄的一张）。全部坐标一次读入 NumPy，逐级分组求和，
+不逐张循环；结果写入 EXIF 存储的 geo_clusters / geo_points 两张表，由导入脚本复制到网站数据库，
+地图按当前视野和缩放级别只取聚合点，放大到最高级别后才取单张照片。
+
+环境变量：
+  GEO_MAX_ZOOM   聚合的最高缩放级别（默认 16，更高级别直接显示单张照片）
+"""
+import os
+import sqlite3
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS geo_clusters (
+        zoom INTEGER NOT NULL,
+        x INTEGER NOT NULL,
+        y INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        photo_key TEXT NOT NULL,
+        PRIMARY KEY (zoom, x, y)
+    );
+    CREATE INDEX IF NOT EXISTS idx_geo_clusters_viewport ON geo_clusters(zoom, latitude, longitude);
+    CREATE TABLE IF NOT EXISTS geo_points (
+        key TEXT PRIMARY KEY,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_geo_points_position ON geo_points(latitude, longitude);
+"""
+
+# Web 墨卡托能表示的纬度范围
+MAX_LATITUDE = 85.05112878
+
+
+def max_zoom() -> int:
+    return int(os.getenv('GEO_MAX_ZOOM', '16'))
+
+
+def tile_coordinates(latitudes, longitudes, zoom: int):
+    """经纬度数组 -> 该缩放级别的瓦片坐标 (x, y) 数组"""
+    import numpy as np
+
+    n = 1 << zoom
+    lat = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitudes) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    tile_x = np.clip(np.floor(x * n), 0, n - 1).astype(np.int64)
+    tile_y = np.clip(np.floor(y * n), 0, n - 1).astype(np.int64)
+    return tile_x, tile_y
+
+
+def build_clusters(keys: list[str], latitudes, longitudes, date_times: list[str | None], zooms: int | None = None):
+    """逐级聚合，产出 (zoom, x, y, 张数, 质心纬度, 质心经度, 代表照片键)"""
+    import numpy as np
+
+    if not keys:
+        return
+    zooms = max_zoom() if zooms is None else zooms
+    # 按拍摄时间从新到旧排好，每个瓦片中第一次出现的照片就是最新的一张
+    order = np.argsort(np.array([value or '' for value in date_times]), kind='stable')[::-1]
+    lat = np.asarray(latitudes, dtype=np.float64)[order]
+    lon = np.asarray(longitudes, dtype=np.float64)[order]
+    sorted_keys = [keys[i] for i in order]
+    for zoom in range(zooms + 1):
+        tile_x, tile_y = tile_coordinates(lat, lon, zoom)
+        cells = tile_x * (1 << zoom) + tile_y
+        unique_cells, first, inverse, counts = np.unique(
+            cells, return_index=True, return_inverse=True, return_counts=True
+        )
+        lat_mean = np.bincount(inverse, weights=lat) / counts
+        lon_mean = np.bincount(inverse, weights=lon) / counts
+        for cell, index, count, cluster_lat, cluster_lon in zip(
+            unique_cells.tolist(), first.tolist(), counts.tolist(), lat_mean.tolist(), lon_mean.tolist()
+        ):
+            yield zoom, cell >> zoom, cell & ((1 << zoom) - 1), count, cluster_lat, cluster_lon, sorted_keys[index]
+
+
+def rebuild(db_path: str, zooms: int | None = None) -> int:
+    """从 EXIF 存储重建聚合索引，返回带坐标的照片数"""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(_SCHEMA)
+        rows = conn.execute(
+            "SELECT key, latitude, longitude, date_time FROM exif "
+            "WHERE latitude BETWEEN -90 AND 90 AND longitude BETWEEN -180 AND 180"
+        ).fetchall()
+        keys = [row[0] for row in rows]
+        with conn:
+            conn.execute("DELETE FROM geo_clusters")
+            conn.execute("DELETE FROM geo_points")
+            conn.executemany("INSERT INTO geo_points VALUES (?, ?, ?)", [row[:3] for row in rows])
+            conn.executemany(
+                "INSERT INTO geo_clusters VALUES (?, ?, ?, ?, ?, ?, ?)",
+                build_clusters(keys, [row[1] for row in rows], [row[2] for row in rows],
+                               [row[3] for row in rows], zooms),
+            )
+        return len(keys)
+    finally:
+        conn.close()
+
+
+def is_built(db_path: str) -> bool:
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'geo_clusters'"
+        ).fetchone() is not None
+    finally:
+        conn.close()
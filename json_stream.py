@@ -0,0 +1,155 @@
+"""
+JSON 流式读写工具
+按条写入紧凑格式的 JSON 对象（exif_data.json / albums.json），按条读取，避免整份数据常驻内存
+"""
+import filecmp
+import json
+import os
+
+_CHUNK_SIZE = 64 * 1024
+_WHITESPACE = ' \t\n\r'
+
+
+def dumps_compact(value) -> str:
+    """紧凑序列化（无缩进、无多余空格）"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class JsonObjectWriter:
+    """逐条写入一个顶层 JSON 对象
+
+    先写入同目录的临时文件，正常退出时原子替换目标文件；出错时删除临时文件，
+    旧文件保持不变。写出的文件仍是普通 JSON，现有消费方可直接 JSON.parse / json.load。
+    skip_unchanged 为 True 时，若新内容与旧文件逐字节相同则不替换（保留旧文件的 mtime），
+    结果记录在 changed 属性中。
+    """
+
+    def __init__(self, path: str, skip_unchanged: bool = False):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.skip_unchanged = skip_unchanged
+        self.changed = True
+        self.count = 0
+        self._file = None
+
+    def __enter__(self):
+        target_dir = os.path.dirname(self.path)
+        if target_dir:
+            os.makedirs(target_dir, exist_ok=True)
+        self._file = open(self.tmp_path, 'w', encoding='utf-8')
+        self._file.write('{')
+        return self
+
+    def write(self, key: str, value):
+        if self.count:
+            self._file.write(',\n')
+        self._file.write(dumps_compact(str(key)))
+        self._file.write(':')
+        self._file.write(dumps_compact(value))
+        self.count += 1
+
+    def write_raw(self, key: str, raw_value: str):
+        """写入已序列化好的值，省去一次 loads/dumps"""
+        if self.count:
+            self._file.write(',\n')
+        self._file.write(dumps_compact(str(key)))
+        self._file.write(':')
+        self._file.write(raw_value)
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self._file.write('}\n')
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+        if exc_type is None:
+            if self.skip_unchanged and os.path.exists(self.path) and filecmp.cmp(self.tmp_path, self.path, shallow=False):
+                self.changed = False
+                os.remove(self.tmp_path)
+            else:
+                os.replace(self.tmp_path, self.path)
+        else:
+            try:
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+        return False
+
+
+def iter_json_object(path: str, chunk_size: int = _CHUNK_SIZE):
+    """逐条读取顶层 JSON 对象，产出 (key, value)
+
+    同时兼容旧版 indent=4 的文件和紧凑格式文件，内存占用只与单条记录大小相关。
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = ''
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in _WHITESPACE:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        def expect(chars: str) -> str:
+            nonlocal pos
+            skip_ws()
+            if pos >= len(buf) or buf[pos] not in chars:
+                found = buf[pos] if pos < len(buf) else 'EOF'
+                raise ValueError(f"{path}: 期望 {chars!r}，实际为 {found!r}")
+            pos += 1
+            return buf[pos - 1]
+
+        def decode():
+            nonlocal pos
+            skip_ws()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # 值恰好结束在缓冲区末尾时（如数字）可能被截断，需要再读一块确认
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        fill()
+        skip_ws()
+        if eof and pos >= len(buf):
+            return
+        expect('{')
+        skip_ws()
+        if pos < len(buf) and buf[pos] == '}':
+            return
+        while True:
+            key = decode()
+            expect(':')
+            value = decode()
+            yield key, value
+            if expect(',}') == '}':
+                return
+
+
+def load_raw_values(path: str) -> dict[str, str]:
+    """读取为 key -> 紧凑序列化字符串，比嵌套 dict 占用的内存小得多，适合做差异比对"""
+    if not os.path.exists(path):
+        return {}
+    return {key: dumps_compact(value) for key, value in iter_json_object(path)}
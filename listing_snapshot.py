@@ -0,0 +1,217 @@
+"""
+对象存储列举快照
+把前缀下的列举结果（key、hash、fsize、putTime）保存在本地 JSON 中，由本进程的上传和删除增量维护，
+只在快照过期（LISTING_MAX_AGE，默认一天）或显式要求（LISTING_REFRESH=1）时才做一次完整列举对账。
+上传端会把快照发布到存储的 _meta/listing.json，服务端同步相册时条件下载它，远程未变化时一次 304 即可
+"""
+import json
+import os
+import threading
+import time
+
+from storage import StorageBackend
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'listing_snapshot.json')
+# 服务端（webhook、gunicorn 各 worker）使用独立的本地副本，不与同机运行的上传端互相覆盖
+DEFAULT_SERVER_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'listing_snapshot.server.json')
+# 放在 gallery/ 之外，避免出现在相册列举结果里
+REMOTE_SNAPSHOT_KEY = '_meta/listing.json'
+DEFAULT_MAX_AGE = 24 * 3600
+
+
+def snapshot_path() -> str:
+    return os.getenv('LISTING_SNAPSHOT_PATH') or DEFAULT_SNAPSHOT_PATH
+
+
+def server_snapshot_path() -> str:
+    return os.getenv('SERVER_LISTING_SNAPSHOT_PATH') or DEFAULT_SERVER_SNAPSHOT_PATH
+
+
+def _tmp_path(path: str, suffix: str) -> str:
+    """每个进程 / 线程独占的临时文件名，并发保存或下载时互不覆盖"""
+    return f"{path}.{os.getpid()}-{threading.get_ident()}.{suffix}"
+
+
+class ListingSnapshot:
+    """key -> 条目；prefixes 记录每个前缀最近一次完整列举的时间"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.items: dict[str, dict] = {}
+        self.prefixes: dict[str, float] = {}
+        self.etag = None
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.prefixes = data.get('prefixes') or {}
+        self.etag = data.get('remote_etag')
+        self.items = {
+            key: {'key': key, 'hash': h, 'fsize': fsize, 'putTime': put_time}
+            for key, (h, fsize, put_time) in (data.get('items') or {}).items()
+        }
+
+    def save(self):
+        with self._lock:
+            data = {
+                'prefixes': self.prefixes,
+                'remote_etag': self.etag,
+                'items': {
+                    key: [item.get('hash'), item.get('fsize'), item.get('putTime')]
+                    for key, item in sorted(self.items.items())
+                },
+            }
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = _tmp_path(self.path, 'tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def covers(self, prefix: str, max_age: float) -> bool:
+        """快照中是否有该前缀且未过期（上级前缀的完整列举同样有效）"""
+        now = time.time()
+        return any(
+            prefix.startswith(listed) and now - listed_at <= max_age
+            for listed, listed_at in self.prefixes.items()
+        )
+
+    def replace(self, prefix: str, items):
+        with self._lock:
+            self.items = {k: v for k, v in self.items.items() if not k.startswith(prefix)}
+            for item in items:
+                self.items[item['key']] = item
+            self.prefixes[prefix] = time.time()
+
+    def put(self, item: dict):
+        with self._lock:
+            self.items[item['key']] = item
+
+    def remove(self, keys):
+        with self._lock:
+            for key in keys:
+                self.items.pop(key, None)
+
+    def rename(self, pairs):
+        with self._lock:
+            for src, dst in pairs:
+                item = self.items.pop(src, None)
+                if item is not None:
+                    self.items[dst] = dict(item, key=dst)
+
+    def keys(self, prefix: str) -> list[str]:
+        with self._lock:
+            return sorted(k for k in self.items if k.startswith(prefix))
+
+
+class SnapshotBackend(StorageBackend):
+    """在任意后端外包一层列举快照：列举读快照，上传/删除同时更新快照，其余操作直接转发"""
+
+    def __init__(self, inner: StorageBackend, path: str | None = None, max_age: float | None = None,
+                 refresh: bool | None = None):
+        self.inner = inner
+        self.snapshot = ListingSnapshot(path or snapshot_path())
+        self.max_age = max_age if max_age is not None else float(os.getenv('LISTING_MAX_AGE', DEFAULT_MAX_AGE))
+        self.refresh = refresh if refresh is not None else os.getenv('LISTING_REFRESH') == '1'
+        self.reconciled = set()
+
+    def reconcile(self, prefix: str):
+        """完整列举一次，以存储为准覆盖快照中该前缀的条目"""
+        items = list(self.inner.iter_items(prefix))
+        self.snapshot.replace(prefix, items)
+        self.snapshot.save()
+        self.reconciled.add(prefix)
+        print(f"列举快照已与存储对账：{prefix} 共 {len(items)} 个文件")
+
+    def _ensure(self, prefix: str):
+        if prefix in self.reconciled:
+            return
+        if self.refresh or not self.snapshot.covers(prefix, self.max_age):
+            self.reconcile(prefix)
+
+    def list_page(self, prefix, marker=None, limit=1000):
+        self._ensure(prefix)
+        keys = [k for k in self.snapshot.keys(prefix) if not marker or k > marker]
+        page = [dict(self.snapshot.items[k]) for k in keys[:limit]]
+        return page, (page[-1]['key'] if len(keys) > limit else None)
+
+    def put_file(self, key, local_path, mime_type=None):
+        ret = self.inner.put_file(key, local_path, mime_type=mime_type)
+        ret = ret if isinstance(ret, dict) else {}
+        self.snapshot.put({
+            'key': key,
+            'hash': ret.get('hash'),
+            'fsize': ret.get('fsize') or os.path.getsize(local_path),
+            'putTime': ret.get('putTime') or time.time_ns() // 100,
+        })
+        return ret
+
+    def put_files(self, items, workers=4, on_done=None):
+        try:
+            return super().put_files(items, workers=workers, on_done=on_done)
+        finally:
+            self.snapshot.save()
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        try:
+            return self.inner.delete_many(keys)
+        finally:
+            # 删除失败时无法确定哪些已删除，下次对账会纠正
+            self.snapshot.remove(keys)
+            self.snapshot.save()
+
+    def move_many(self, pairs):
+        moved = self.inner.move_many(pairs)
+        self.snapshot.rename(moved)
+        self.snapshot.save()
+        return moved
+
+    def get(self, key, version=None):
+        return self.inner.get(key, version=version)
+
+    def download(self, key, local_path, etag=None, last_modified=None):
+        return self.inner.download(key, local_path, etag=etag, last_modified=last_modified)
+
+    def stat(self, key):
+        return self.inner.stat(key)
+
+    def public_url(self, key):
+        return self.inner.public_url(key)
+
+    def publish(self):
+        """把本地快照上传到存储，供服务端同步相册时使用"""
+        self.snapshot.save()
+        self.inner.put_file(REMOTE_SNAPSHOT_KEY, self.snapshot.path, mime_type='application/json')
+
+    def pull(self) -> bool:
+        """条件下载上传端发布的快照，返回快照是否被更新"""
+        tmp_path = _tmp_path(self.snapshot.path, 'remote')
+        try:
+            try:
+                result = self.inner.download(REMOTE_SNAPSHOT_KEY, tmp_path, etag=self.snapshot.etag)
+            except Exception as e:
+                # 上传端没有发布快照时，本地快照可能落后于存储，退回完整列举
+                print(f"获取远程列举快照失败，改为完整列举: {e}")
+                self.refresh = True
+                return False
+            if result.not_modified:
+                return False
+            os.replace(tmp_path, self.snapshot.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.snapshot.load()
+        self.snapshot.etag = result.etag
+        self.snapshot.save()
+        return True
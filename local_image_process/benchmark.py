@@ -0,0 +1,284 @@
+"""
+端到端流水线基准测试
+在合成图库上依次运行 扫描 / EXIF / 转换 / 水印 / 上传（本地假对象存储）各阶段，
+输出每阶段吞吐、单文件耗时 p50/p99 与峰值内存（JSON），便于跨提交对比
+
+EXIF、转换、上传直接调用流水线本身（save_exif_to_json、convert_images、upload_folder），
+调度、子进程隔离、预读与并发上传的变化都会体现在结果里；这几个阶段的单文件耗时见 pipeline_stages
+
+用法：
+  python local_image_process/benchmark.py --albums 4 --per-album 10 --output bench.json
+  python local_image_process/benchmark.py --library /path/to/Some.library
+  python local_image_process/benchmark.py --profiles --target-bytes 300000   # 附带对比各 WebP 编码档位
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# 基准测试默认离线运行，不做逆地理编码
+os.environ.setdefault('GEOCODE', '0')
+
+# upload_oss 会把仓库根目录加入 sys.path，需先于 metrics 导入
+from PIL import Image, ImageOps
+
+from upload_oss import ImageProcessor, publish_metadata, upload_folder, watermark_image
+from encoder import compare_profiles
+from listing_snapshot import SnapshotBackend
+from metrics import build_run_summary, metrics
+from scanner import scan_library
+from storage import LocalStorage
+from synthetic_library import generate_library
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    if sys.platform == 'darwin':
+        return round(peak / 1024 / 1024, 1)
+    return round(peak / 1024, 1)
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    """最近秩百分位"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: list[float] = []
+        self.bytes = 0
+        self.files = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._started
+        return False
+
+    def record(self, seconds: float, size: int = 0):
+        self.latencies.append(seconds)
+        self.bytes += size
+        self.files += 1
+
+    def to_dict(self) -> dict:
+        p50 = percentile(self.latencies, 50)
+        p99 = percentile(self.latencies, 99)
+        return {
+            'files': self.files,
+            'errors': self.errors,
+            'seconds': round(self.seconds, 4),
+            'files_per_sec': round(self.files / self.seconds, 2) if self.seconds else None,
+            'mb_per_sec': round(self.bytes / 1024 / 1024 / self.seconds, 2) if self.seconds else None,
+            'p50_ms': round(p50 * 1000, 2) if p50 is not None else None,
+            'p99_ms': round(p99 * 1000, 2) if p99 is not None else None,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+
+class FakeObjectStore(LocalStorage):
+    """本地目录模拟的对象存储，可选模拟单次请求延迟与上行带宽"""
+
+    def __init__(self, root: str, latency_ms: float = 0.0, uplink_mbps: float = 0.0):
+        super().__init__(root)
+        self.latency_ms = latency_ms
+        self.uplink_mbps = uplink_mbps
+        # 每次上传的 (耗时, 字节数)，并发上传时由多个线程追加
+        self.puts: list[tuple[float, int]] = []
+
+    def put_file(self, key, local_path, mime_type=None):
+        started = time.perf_counter()
+        size = os.path.getsize(local_path)
+        delay = self.latency_ms / 1000
+        if self.uplink_mbps:
+            delay += size * 8 / (self.uplink_mbps * 1_000_000)
+        if delay:
+            time.sleep(delay)
+        ret = super().put_file(key, local_path, mime_type)
+        self.puts.append((time.perf_counter() - started, size))
+        return ret
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def profile_report(images: list[tuple[str, str]], target_bytes: int = 0, sample: int = 20) -> dict:
+    """解码一部分源图，对比各 WebP 编码档位的输出体积与编码耗时"""
+    decoded = []
+    for file_path, _ in images:
+        if len(decoded) >= sample:
+            break
+        try:
+            with Image.open(file_path) as img:
+                decoded.append(ImageOps.exif_transpose(img).convert('RGB'))
+        except Exception:
+            continue  # RAW 等 Pillow 不能直接打开的格式不参与对比
+    return {
+        'images': len(decoded),
+        'target_bytes': target_bytes or None,
+        'profiles': compare_profiles(decoded, target_bytes),
+    }
+
+
+def run_benchmark(library: str, work_dir: str, latency_ms: float = 0.0, uplink_mbps: float = 0.0,
+                  profiles: bool = False, target_bytes: int = 0) -> dict:
+    # 进度、隔离清单和列举快照都写到工作目录，不碰真实的图库数据库与 data/
+    os.environ['DB_PATH'] = os.path.join(work_dir, 'gallery.db')
+    os.environ['QUARANTINE_PATH'] = os.path.join(work_dir, 'quarantine.json')
+    os.environ['LISTING_SNAPSHOT_PATH'] = os.path.join(work_dir, 'listing_snapshot.json')
+    metrics.reset()
+    started_at = time.time()
+    cpu_started = time.process_time()
+    output_dir = os.path.join(work_dir, 'output')
+    processor = ImageProcessor(library, output_dir=output_dir)
+    stages = {}
+
+    with StageStats('scan') as scan:
+        result = scan_library(processor.scan_roots, processor.scan_rules)
+    scan.files = len(result.images) + sum(result.skipped.values())
+    processor._scan_result = result
+    stages['scan'] = dict(scan.to_dict(), images=len(result.images), skipped=dict(result.skipped))
+
+    images = processor.images()
+    source_bytes = sum(os.path.getsize(file_path) for file_path, _ in images)
+
+    with StageStats('exif') as exif:
+        processor.save_exif_to_json()
+    exif.files = processor.total_images
+    exif.errors = len(images) - exif.files
+    exif.bytes = source_bytes
+    stages['exif'] = exif.to_dict()
+
+    with StageStats('convert') as convert:
+        processor.convert_images()
+    convert.files = processor._converted
+    convert.errors = len(images) - convert.files
+    convert.bytes = source_bytes
+    stages['convert'] = convert.to_dict()
+
+    # 流水线在解码后的图像上叠加水印、与转换共用一次编码：只计 watermark_image，解码不计入
+    watermark = StageStats('watermark')
+    for root, _, files in os.walk(output_dir):
+        for filename in files:
+            if not filename.endswith('.webp'):
+                continue
+            output_file = os.path.join(root, filename)
+            try:
+                with Image.open(output_file) as img:
+                    img.load()
+                    started = time.perf_counter()
+                    watermark_image(img)
+            except Exception:
+                watermark.errors += 1
+                continue
+            watermark.record(time.perf_counter() - started, os.path.getsize(output_file))
+    watermark.seconds = sum(watermark.latencies)
+    stages['watermark'] = watermark.to_dict()
+
+    # 与 upload_output 相同：并发上传、发布元数据分片和列举快照（不发 webhook）
+    store = FakeObjectStore(os.path.join(work_dir, 'bucket'), latency_ms, uplink_mbps)
+    backend = SnapshotBackend(store, path=os.environ['LISTING_SNAPSHOT_PATH'])
+    with StageStats('upload') as upload:
+        upload_folder(output_dir, backend, prefix='gallery/', full_upload=True, report_progress=False)
+        publish_metadata(output_dir, backend)
+        backend.publish()
+    for seconds, size in store.puts:
+        upload.record(seconds, size)
+    stages['upload'] = upload.to_dict()
+
+    # 流水线内部计时（读取/解码/方向校正/编码等细分阶段）
+    summary = build_run_summary(metrics, started_at, time.time(), time.process_time() - cpu_started)
+    # 档位对比在汇总之后进行，不计入流水线阶段
+    encoder_profiles = profile_report(result.images, target_bytes) if profiles else None
+    return {
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'library': library,
+        'stages': stages,
+        'pipeline_stages': summary['stages'],
+        'bound_by': summary['bound_by'],
+        'encoder_profiles': encoder_profiles,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='图片处理流水线基准测试')
+    parser.add_argument('--library', help='使用已有图库，不生成合成图库')
+    parser.add_argument('--albums', type=int, default=4)
+    parser.add_argument('--per-album', type=int, default=10)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=1200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--gps-ratio', type=float, default=0.5)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='模拟每次上传请求延迟')
+    parser.add_argument('--uplink-mbps', type=float, default=0.0, help='模拟上行带宽（0 表示不限）')
+    parser.add_argument('--profiles', action='store_true', help='对比各 WebP 编码档位的体积与耗时')
+    parser.add_argument('--target-bytes', type=int, default=0, help='档位对比时使用的目标体积（字节）')
+    parser.add_argument('--work-dir', help='工作目录（默认临时目录，结束后删除）')
+    parser.add_argument('--keep', action='store_true', help='保留工作目录')
+    parser.add_argument('--output', help='结果 JSON 输出路径（默认打印到标准输出）')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='moment-bench-')
+    try:
+        library = args.library
+        params = None
+        if not library:
+            params = {
+                'albums': args.albums, 'per_album': args.per_album, 'width': args.width,
+                'height': args.height, 'seed': args.seed, 'gps_ratio': args.gps_ratio,
+            }
+            library = generate_library(
+                work_dir, args.albums, args.per_album, args.width, args.height,
+                args.seed, gps_ratio=args.gps_ratio,
+            )
+        report = run_benchmark(
+            library, work_dir, args.latency_ms, args.uplink_mbps,
+            profiles=args.profiles, target_bytes=args.target_bytes,
+        )
+        report['synthetic'] = params
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
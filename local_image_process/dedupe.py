@@ -0,0 +1,231 @@
+"""
+重复图片检测
+在扫描之后、解码之前运行，只在同一相册（同一输出目录）内去重：
+  same_name   同名不同格式（如 RAW+JPEG 成对），输出路径相同，按策略只保留一个；关闭去重时保留扫描顺序中的第一个
+  exact       字节完全相同（先按文件大小分组，大小相同的才计算内容哈希）
+  perceptual  近似重复（dHash，JPEG 利用 draft 直接按 1/8 尺寸解码，RAW、HEIF 只解内嵌缩略图）
+
+环境变量：
+  DEDUPE           off（默认，只合并输出路径相同的文件）| exact | perceptual
+  DEDUPE_PREFER    成对/重复时保留哪个：jpeg（默认，优先非 RAW，解码开销小）| raw | largest（文件最大）
+  DEDUPE_DISTANCE  感知哈希判定为重复的最大汉明距离（64 位中，默认 4）
+"""
+import hashlib
+import os
+from collections import defaultdict
+from io import BytesIO
+
+import heif
+
+RAW_EXTENSIONS = ('.arw', '.cr2', '.nef', '.dng', '.raf', '.orf', '.rw2')
+MODES = ('off', 'exact', 'perceptual')
+PREFERENCES = ('jpeg', 'raw', 'largest')
+
+# dHash 取 9x8 灰度图，相邻像素比较得到 64 位
+_HASH_SIZE = (9, 8)
+
+
+def is_raw(path: str) -> bool:
+    return path.lower().endswith(RAW_EXTENSIONS)
+
+
+class DedupePolicy:
+    def __init__(self, mode: str = 'off', prefer: str = 'jpeg', max_distance: int = 4):
+        if mode not in MODES:
+            raise ValueError(f"未知的去重模式: {mode}")
+        if prefer not in PREFERENCES:
+            raise ValueError(f"未知的保留策略: {prefer}")
+        self.mode = mode
+        self.prefer = prefer
+        self.max_distance = max_distance
+
+    @classmethod
+    def from_env(cls) -> 'DedupePolicy':
+        return cls(
+            mode=(os.getenv('DEDUPE') or 'off').lower(),
+            prefer=(os.getenv('DEDUPE_PREFER') or 'jpeg').lower(),
+            max_distance=int(os.getenv('DEDUPE_DISTANCE', '4')),
+        )
+
+    def rank(self, path: str) -> tuple:
+        """越小越优先保留"""
+        size = os.path.getsize(path)
+        if self.prefer == 'raw':
+            return (not is_raw(path), -size, path)
+        if self.prefer == 'jpeg':
+            return (is_raw(path), -size, path)
+        return (-size, path)
+
+
+def content_hash(path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _open_small(path: str):
+    """以尽量小的代价解码出低分辨率图像；RAW 没有内嵌缩略图时返回 None（不参与感知去重）"""
+    from PIL import Image
+
+    if is_raw(path):
+        import rawpy
+
+        try:
+            with rawpy.imread(path) as raw:
+                thumb = raw.extract_thumb()
+        except Exception:
+            return None
+        if thumb.format == rawpy.ThumbFormat.JPEG:
+            img = Image.open(BytesIO(thumb.data))
+        else:
+            return Image.fromarray(thumb.data)
+    else:
+        if heif.is_heif(path):
+            heif.register()
+        img = Image.open(path)
+    # JPEG 在 DCT 阶段直接缩小解码，HEIF 改为解码内嵌缩略图，其他格式无影响
+    img.draft('L', (_HASH_SIZE[0] * 8, _HASH_SIZE[1] * 8))
+    return img
+
+
+def perceptual_hash(path: str) -> int | None:
+    """dHash：不做方向校正，RAW 内嵌缩略图与机内 JPEG 同样是未旋转的原始方向"""
+    # NumPy、Pillow 只在感知去重模式下才需要
+    import numpy as np
+    from PIL import Image
+
+    try:
+        img = _open_small(path)
+        if img is None:
+            return None
+        gray = np.asarray(img.convert('L').resize(_HASH_SIZE, Image.BILINEAR), dtype=np.int16)
+    except Exception:
+        return None
+    bits = gray[:, 1:] > gray[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distances(value: int, others):
+    """一个哈希与一组 uint64 哈希的汉明距离"""
+    import numpy as np
+
+    xor = np.bitwise_xor(others, np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+class DedupeResult:
+    def __init__(self):
+        # [(file_path, root)]
+        self.kept: list[tuple[str, str]] = []
+        # [(被跳过的文件, 保留的文件, 原因)]
+        self.duplicates: list[tuple[str, str, str]] = []
+
+    def summary(self) -> str:
+        if not self.duplicates:
+            return f"去重完成：保留 {len(self.kept)} 张，无重复"
+        counts = defaultdict(int)
+        for _, _, reason in self.duplicates:
+            counts[reason] += 1
+        reasons = '，'.join(f"{reason} {count} 张" for reason, count in sorted(counts.items()))
+        return f"去重完成：保留 {len(self.kept)} 张，跳过重复 {len(self.duplicates)} 张（{reasons}）"
+
+
+class _Groups:
+    """并查集，合并时记录原因"""
+
+    def __init__(self, items):
+        self.parent = {item: item for item in items}
+        self.reason = {}
+
+    def find(self, item):
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a, b, reason: str):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[rb] = ra
+            self.reason.setdefault(b, reason)
+            self.reason.setdefault(a, reason)
+
+
+def find_duplicates(images: list[tuple[str, str]], output_file_for, policy: DedupePolicy) -> DedupeResult:
+    """images 为扫描结果 [(file_path, root)]，output_file_for 把原图映射到输出路径（用于确定相册）"""
+    result = DedupeResult()
+    if policy.mode == 'off':
+        # 关闭去重时同名不同格式的文件仍会写到同一个输出路径：按扫描顺序只保留第一个，
+        # EXIF 与转换都取自它（与原先 EXIF 记录的取法一致）
+        keepers = {}
+        for file_path, root in images:
+            output = output_file_for(file_path)
+            if output in keepers:
+                result.duplicates.append((file_path, keepers[output], 'same_name'))
+                continue
+            keepers[output] = file_path
+            result.kept.append((file_path, root))
+        return result
+    if not images:
+        return result
+
+    roots = dict(images)
+    albums = defaultdict(list)
+    outputs = {}
+    for file_path, _ in images:
+        outputs[file_path] = output_file_for(file_path)
+        albums[os.path.dirname(outputs[file_path])].append(file_path)
+
+    for paths in albums.values():
+        groups = _Groups(paths)
+
+        # 同名不同格式：输出路径相同，无需读文件
+        by_output = defaultdict(list)
+        for path in paths:
+            by_output[outputs[path]].append(path)
+        for same in by_output.values():
+            for other in same[1:]:
+                groups.union(same[0], other, 'same_name')
+
+        # 字节完全相同：只对大小相同的文件计算哈希
+        by_size = defaultdict(list)
+        for path in paths:
+            by_size[os.path.getsize(path)].append(path)
+        for same_size in by_size.values():
+            if len(same_size) < 2:
+                continue
+            by_hash = defaultdict(list)
+            for path in same_size:
+                by_hash[content_hash(path)].append(path)
+            for same in by_hash.values():
+                for other in same[1:]:
+                    groups.union(same[0], other, 'exact')
+
+        if policy.mode == 'perceptual':
+            import numpy as np
+
+            hashed = [(path, perceptual_hash(path)) for path in paths]
+            hashed = [(path, value) for path, value in hashed if value is not None]
+            if len(hashed) > 1:
+                values = np.array([value for _, value in hashed], dtype=np.uint64)
+                for i, (path, value) in enumerate(hashed[:-1]):
+                    close = np.nonzero(hamming_distances(value, values[i + 1:]) <= policy.max_distance)[0]
+                    for j in close:
+                        groups.union(path, hashed[i + 1 + j][0], 'perceptual')
+
+        members = defaultdict(list)
+        for path in paths:
+            members[groups.find(path)].append(path)
+        for group in members.values():
+            keeper = min(group, key=policy.rank)
+            result.kept.append((keeper, roots[keeper]))
+            for path in group:
+                if path != keeper:
+                    result.duplicates.append((path, keeper, groups.reason.get(path, 'exact')))
+
+    # 保持扫描顺序
+    order = {path: i for i, (path, _) in enumerate(images)}
+    result.kept.sort(key=lambda item: order[item[0]])
+    return result
@@ -0,0 +1,115 @@
+"""
+WebP 编码档位与目标体积
+档位决定质量和 method（libwebp 的压缩努力程度，越大越慢、文件越小）：
+  fast             quality 60, method 2   转换快，文件略大
+  balanced（默认）  quality 60, method 4
+  max-compression  quality 56, method 6   最慢，带宽最省
+
+设置目标体积时按图片内容选质量：先把图片缩小成小样，对小样二分查找质量，
+按像素比例估算全尺寸体积，取不超过目标的最高质量；画面繁杂的图降低质量，平坦的图保留较高质量。
+每次编码按档位记录输出字节数与耗时（encoded_bytes_total / encode_seconds），benchmark.py --profiles 对比各档位。
+
+环境变量：
+  WEBP_PROFILE       fast | balanced | max-compression
+  WEBP_TARGET_BYTES  单张图片的目标体积（字节，0 或不设置表示按档位的固定质量）
+"""
+import os
+import time
+from io import BytesIO
+
+from metrics import metrics
+
+PROFILES = {
+    'fast': {'quality': 60, 'method': 2},
+    'balanced': {'quality': 60, 'method': 4},
+    'max-compression': {'quality': 56, 'method': 6},
+}
+DEFAULT_PROFILE = 'balanced'
+# 目标体积模式下质量的搜索范围
+MIN_QUALITY = 30
+MAX_QUALITY = 90
+# 小样的最大像素数；小样的每像素字节数比全尺寸高，估算偏保守
+PROBE_PIXELS = 512 * 512
+
+
+class EncoderSettings:
+    def __init__(self, profile: str = DEFAULT_PROFILE, target_bytes: int = 0):
+        if profile not in PROFILES:
+            raise ValueError(f"未知的 WebP 编码档位: {profile}（可选 {', '.join(PROFILES)}）")
+        self.profile = profile
+        self.quality = PROFILES[profile]['quality']
+        self.method = PROFILES[profile]['method']
+        self.target_bytes = target_bytes
+
+    @classmethod
+    def from_env(cls) -> 'EncoderSettings':
+        return cls(
+            profile=os.getenv('WEBP_PROFILE') or DEFAULT_PROFILE,
+            target_bytes=int(os.getenv('WEBP_TARGET_BYTES') or 0),
+        )
+
+
+def _encoded_size(img, quality: int, method: int) -> int:
+    buffer = BytesIO()
+    img.save(buffer, 'webp', quality=quality, method=method)
+    return buffer.tell()
+
+
+def choose_quality(img, target_bytes: int, method: int) -> int:
+    """在缩小的小样上二分查找，返回估算全尺寸体积不超过 target_bytes 的最高质量"""
+    from PIL import Image
+
+    pixels = img.width * img.height
+    probe = img
+    if pixels > PROBE_PIXELS:
+        scale = (PROBE_PIXELS / pixels) ** 0.5
+        probe = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BILINEAR)
+    ratio = pixels / (probe.width * probe.height)
+    low, high = MIN_QUALITY, MAX_QUALITY
+    best = MIN_QUALITY
+    # 区间收敛为止：30..90 共 61 个取值，最多编码 6 次小样
+    while low <= high:
+        quality = (low + high) // 2
+        if _encoded_size(probe, quality, method) * ratio <= target_bytes:
+            best, low = quality, quality + 1
+        else:
+            high = quality - 1
+    return best
+
+
+def encode_webp(img, target, settings: EncoderSettings | None = None, exif: bytes | None = None) -> int:
+    """按档位（及目标体积）把图像编码为 WebP 写入 target（路径或文件对象），返回写入的字节数"""
+    settings = settings or EncoderSettings.from_env()
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+    started = time.perf_counter()
+    quality = settings.quality
+    if settings.target_bytes:
+        with metrics.timer(stage='quality_search'):
+            quality = choose_quality(img, settings.target_bytes, settings.method)
+    options = {'quality': quality, 'method': settings.method}
+    if exif:
+        options['exif'] = exif
+    img.save(target, 'webp', **options)
+    size = target.tell() if hasattr(target, 'tell') else os.path.getsize(target)
+    metrics.observe('encode_seconds', time.perf_counter() - started, profile=settings.profile)
+    metrics.inc('encoded_bytes_total', size, profile=settings.profile)
+    metrics.inc('encoded_images_total', profile=settings.profile)
+    return size
+
+
+def compare_profiles(images, target_bytes: int = 0, baseline: str = DEFAULT_PROFILE) -> dict:
+    """用同一批已解码的图像分别按各档位编码，返回各档位的总字节数、相对 baseline 节省的字节数和编码耗时"""
+    report = {}
+    for profile in PROFILES:
+        settings = EncoderSettings(profile, target_bytes)
+        total_bytes = 0
+        started = time.perf_counter()
+        for img in images:
+            total_bytes += encode_webp(img, BytesIO(), settings)
+        report[profile] = {'bytes': total_bytes, 'encode_seconds': round(time.perf_counter() - started, 4)}
+    base = report.get(baseline, {}).get('bytes')
+    for entry in report.values():
+        entry['bytes_saved'] = base - entry['bytes'] if base is not None else None
+        entry['saved_pct'] = round((base - entry['bytes']) * 100 / base, 2) if base else None
+    return report
@@ -0,0 +1,75 @@
+"""
+HEIC / HEIF 解码（iPhone 默认的拍照格式）
+Pillow 本身不能解码 HEIF，依赖可选的 pillow-heif：首次遇到 HEIF 文件时才导入并注册为 Pillow 插件，
+之后与 JPEG 走同一条流水线（解码 → 方向校正 → 占位图 → 水印 → 单次编码）。
+libheif 解码时已经按容器里的旋转 / 镜像（irot / imir）变换，插件同时把 EXIF 的方向标记改为 1，
+exif_transpose 不会重复旋转，输出的 WebP 也不会被浏览器再转一次。
+
+exifread 3.0 解析不了常见的 HEIC 容器结构（如 libheif 写出的文件），EXIF 改由 pillow-heif 从容器中取出，
+再交给 exifread 按 TIFF 解析。
+
+快速模式：设置 HEIF_MAX_EDGE 后 HEIF 输出的长边不超过该值；文件内嵌的缩略图 / 预览图足够大时
+（与 JPEG 的 draft 一样）直接解码它，不解码全尺寸主图。
+
+环境变量：
+  HEIF_MAX_EDGE  HEIF 输出长边上限（像素，默认 0 不限制，始终解码主图）
+"""
+import os
+
+HEIF_EXTENSIONS = ('.heic', '.heif')
+
+_registered = False
+
+
+def is_heif(path: str) -> bool:
+    return path.lower().endswith(HEIF_EXTENSIONS)
+
+
+def max_edge() -> int:
+    return int(os.getenv('HEIF_MAX_EDGE') or 0)
+
+
+def register():
+    """注册 pillow-heif 插件；未安装时抛出 RuntimeError"""
+    global _registered
+    if _registered:
+        return
+    try:
+        import pillow_heif
+    except ImportError:
+        raise RuntimeError("解码 HEIC/HEIF 需要安装 pillow-heif（pip install pillow-heif）")
+    pillow_heif.register_heif_opener()
+    _registered = True
+
+
+def request_size(img, edge: int):
+    """解码前调用：长边上限为 edge 时，让插件改为解码不小于目标尺寸的内嵌缩略图（没有合适的缩略图时不变）"""
+    if edge <= 0 or max(img.size) <= edge:
+        return
+    scale = edge / max(img.size)
+    img.draft(None, (max(1, round(img.width * scale)), max(1, round(img.height * scale))))
+
+
+def fit(img, edge: int):
+    """解码后调用：把图像缩小到长边不超过 edge，返回缩小后的图像"""
+    if edge <= 0 or max(img.size) <= edge:
+        return img
+    from PIL import Image
+
+    scale = edge / max(img.size)
+    resized = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    resized.info = img.info
+    return resized
+
+
+def read_exif(path: str) -> bytes | None:
+    """从 HEIF 容器中取出 EXIF，返回可直接交给 exifread 的 TIFF 数据；没有 EXIF 时返回 None"""
+    register()
+    import pillow_heif
+
+    # open_heif 只解析容器，不解码图像
+    exif = pillow_heif.open_heif(path).info.get('exif')
+    if not exif:
+        return None
+    # 去掉 Exif\0\0 前缀，剩下的以 II* / MM\0* 开头，exifread 按 TIFF 识别
+    return exif[6:] if exif.startswith(b'Exif\x00\x00') else exif
@@ -0,0 +1,244 @@
+"""
+单文件耗时 / 内存预算与隔离进程
+解码和转换在可回收的子进程中进行：单个文件超时、超内存或让子进程崩溃（如损坏的 RAW 卡在 rawpy.postprocess、
+超大全景 TIFF）时终止并重建子进程，该文件记入隔离清单，之后的运行在文件变化前直接跳过。
+
+环境变量：
+  ISOLATE_WORKERS   1（默认）在子进程中转换；0 在主进程中直接处理（不受预算限制，便于调试）
+  FILE_TIMEOUT      单个文件最长处理时间（秒，默认 300）
+  FILE_MAX_RSS_MB   子进程常驻内存上限（MB，默认 4096，0 表示不限制；Windows 上不生效）
+  WORKER_MAX_TASKS  子进程处理这么多文件后回收重建，释放解码留下的碎片内存（默认 200）
+  QUARANTINE_PATH   隔离清单（默认 data/quarantine.json）
+"""
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from metrics import metrics
+
+DEFAULT_QUARANTINE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'quarantine.json'
+)
+# 子进程因超内存主动退出时的退出码
+MEMORY_EXIT_CODE = 86
+_WATCHDOG_INTERVAL = 0.1
+
+
+def quarantine_path() -> str:
+    return os.getenv('QUARANTINE_PATH') or DEFAULT_QUARANTINE_PATH
+
+
+class FileBudget:
+    def __init__(self, timeout: float = 300.0, max_rss_mb: int = 4096, max_tasks: int = 200, isolate: bool = True):
+        self.timeout = timeout
+        self.max_rss_mb = max_rss_mb
+        self.max_tasks = max_tasks
+        self.isolate = isolate
+
+    @classmethod
+    def from_env(cls) -> 'FileBudget':
+        return cls(
+            timeout=float(os.getenv('FILE_TIMEOUT', '300')),
+            max_rss_mb=int(os.getenv('FILE_MAX_RSS_MB', '4096')),
+            max_tasks=int(os.getenv('WORKER_MAX_TASKS', '200')),
+            isolate=os.getenv('ISOLATE_WORKERS', '1') != '0',
+        )
+
+
+class BudgetExceeded(Exception):
+    """reason: timeout | memory | crashed"""
+
+    def __init__(self, reason: str, detail: str):
+        super().__init__(f"{reason}: {detail}")
+        self.reason = reason
+        self.detail = detail
+
+
+class WorkerError(Exception):
+    """任务在子进程中抛出的普通异常（子进程仍可继续使用）"""
+
+
+def _self_rss() -> int | None:
+    """当前进程常驻内存（字节）；没有 /proc 时退化为峰值"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 单位是字节，Linux 是 KB
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _watch_memory(limit_bytes: int):
+    # 解码库（LibRaw、Pillow）在 C 代码中释放 GIL，守护线程可以在解码过程中检查
+    while True:
+        rss = _self_rss()
+        if rss is None:
+            return
+        if rss > limit_bytes:
+            os._exit(MEMORY_EXIT_CODE)
+        time.sleep(_WATCHDOG_INTERVAL)
+
+
+def _worker_main(conn, factory, factory_args, max_rss_mb):
+    if max_rss_mb:
+        threading.Thread(target=_watch_memory, args=(max_rss_mb * 1024 * 1024,), daemon=True).start()
+    handler = factory(*factory_args)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        metrics.reset()
+        try:
+            result = handler(*task)
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}", metrics.snapshot()))
+        else:
+            conn.send(('ok', result, metrics.snapshot()))
+
+
+class IsolatedWorker:
+    """单个可回收的子进程；factory(*factory_args) 在子进程中构造处理函数，run() 把一个任务交给它
+
+    子进程用 spawn 启动（macOS 默认方式，也避免在带线程的主进程中 fork），指标在每个任务后合并回主进程
+    """
+
+    def __init__(self, factory, factory_args: tuple = (), budget: FileBudget | None = None):
+        self.factory = factory
+        self.factory_args = factory_args
+        self.budget = budget or FileBudget.from_env()
+        self._context = multiprocessing.get_context('spawn')
+        self._process = None
+        self._conn = None
+        self._tasks = 0
+
+    def _start(self):
+        parent_conn, child_conn = self._context.Pipe()
+        self._process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.factory, self.factory_args, self.budget.max_rss_mb),
+            daemon=True,
+        )
+        self._process.start()
+        # 关闭主进程持有的子端，子进程退出后 recv 才能收到 EOF
+        child_conn.close()
+        self._conn = parent_conn
+        self._tasks = 0
+
+    def _kill(self):
+        if self._process is not None:
+            if self._process.is_alive():
+                self._process.kill()
+            self._process.join()
+        if self._conn is not None:
+            self._conn.close()
+        self._process = None
+        self._conn = None
+
+    def run(self, *task):
+        """返回处理结果；超出预算时抛出 BudgetExceeded，任务本身出错时抛出 WorkerError"""
+        if self._process is None or self._tasks >= self.budget.max_tasks:
+            self.close()
+            self._start()
+        self._tasks += 1
+        self._conn.send(task)
+        deadline = time.monotonic() + self.budget.timeout if self.budget.timeout else None
+        while True:
+            wait = 0.5 if deadline is None else min(0.5, max(0.0, deadline - time.monotonic()))
+            try:
+                if self._conn.poll(wait):
+                    status, payload, snapshot = self._conn.recv()
+                    break
+            except (EOFError, OSError):
+                pass
+            if not self._process.is_alive() or self._conn.closed:
+                self._process.join()
+                code = self._process.exitcode
+                self._kill()
+                if code == MEMORY_EXIT_CODE:
+                    raise BudgetExceeded('memory', f"常驻内存超过 {self.budget.max_rss_mb} MB")
+                raise BudgetExceeded('crashed', f"子进程异常退出（退出码 {code}）")
+            if deadline is not None and time.monotonic() >= deadline:
+                self._kill()
+                raise BudgetExceeded('timeout', f"处理超过 {self.budget.timeout:g} 秒")
+        metrics.merge(snapshot)
+        if status == 'error':
+            raise WorkerError(payload)
+        return payload
+
+    def close(self):
+        if self._process is not None and self._process.is_alive():
+            try:
+                self._conn.send(None)
+                self._process.join(timeout=5)
+            except (OSError, ValueError):
+                pass
+        self._kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class Quarantine:
+    """超出预算的文件清单；记录文件签名，文件变化（重新导出、修复）后自动解除"""
+
+    def __init__(self, path: str | None = None):
+        self.path = path or quarantine_path()
+        # 原图路径 -> {sig, reason, detail, quarantined_at}
+        self.entries: dict[str, dict] = {}
+        self._dirty = False
+
+    def load(self) -> 'Quarantine':
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = {item['path']: item for item in data.get('files') or []}
+        except (OSError, ValueError, KeyError):
+            self.entries = {}
+        return self
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        data = {'files': [self.entries[path] for path in sorted(self.entries)]}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+    def blocks(self, path: str, sig: str) -> dict | None:
+        """文件仍在清单中且未变化时返回隔离记录；已变化的文件移出清单，重新尝试"""
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        if entry.get('sig') != sig:
+            del self.entries[path]
+            self._dirty = True
+            return None
+        return entry
+
+    def add(self, path: str, sig: str, reason: str, detail: str):
+        self.entries[path] = {
+            'path': path,
+            'sig': sig,
+            'reason': reason,
+            'detail': detail,
+            'quarantined_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        self._dirty = True
@@ -0,0 +1,101 @@
+"""
+任务日志（追加写入的 JSON Lines）
+记录每个文件各阶段的完成情况（exif / converted / uploaded / deleted），进程中途退出后可带 --resume 从断点继续：
+已解析 EXIF、已转换且源文件未变化的图片不再解析、转换，已上传、已删除的 key 不再重复操作
+"""
+import json
+import os
+import threading
+import time
+
+JOURNAL_NAME = 'job_journal.jsonl'
+# 每写入这么多条强制落盘一次，兼顾崩溃时丢失的条数和写入开销
+FSYNC_EVERY = 50
+
+
+def file_signature(path: str) -> str:
+    st = os.stat(path)
+    return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+class JobJournal:
+    def __init__(self, path: str):
+        self.path = path
+        # (stage, key) -> 最后一条记录
+        self.entries: dict[tuple[str, str], dict] = {}
+        self.finished = False
+        self.run_id = None
+        self._file = None
+        self._pending = 0
+        # 转换结果在主线程记录，分相册发布的上传结果在后台线程记录
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self.entries.clear()
+        self.finished = False
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 崩溃时最后一行可能只写了一半
+                    continue
+                stage = entry.get('stage')
+                if stage == 'start':
+                    self.run_id = entry.get('run')
+                elif stage == 'finish':
+                    self.finished = True
+                else:
+                    self.entries[(stage, entry.get('key'))] = entry
+
+    def open(self, resume: bool = False) -> bool:
+        """打开日志；resume 且上次运行未完成时沿用已有记录并返回 True，否则重新开始"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._load()
+        resuming = resume and bool(self.entries) and not self.finished
+        if not resuming:
+            self.entries.clear()
+            self.finished = False
+            self.run_id = time.strftime('%Y%m%d-%H%M%S')
+        self._file = open(self.path, 'a' if resuming else 'w', encoding='utf-8')
+        if not resuming:
+            self._append({'stage': 'start', 'run': self.run_id})
+        return resuming
+
+    def _append(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._file.flush()
+            self._pending += 1
+            if self._pending >= FSYNC_EVERY:
+                os.fsync(self._file.fileno())
+                self._pending = 0
+
+    def record(self, stage: str, key: str, **fields):
+        entry = {'stage': stage, 'key': key, **fields}
+        self.entries[(stage, key)] = entry
+        self._append(entry)
+
+    def get(self, stage: str, key: str, sig: str | None = None) -> dict | None:
+        """已完成的记录；给出 sig 时只有签名一致才算完成"""
+        entry = self.entries.get((stage, key))
+        if entry is None or (sig is not None and entry.get('sig') != sig):
+            return None
+        return entry
+
+    def count(self, stage: str) -> int:
+        return sum(1 for s, _ in self.entries if s == stage)
+
+    def finish(self):
+        self._append({'stage': 'finish', 'run': self.run_id})
+        self.finished = True
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
@@ -0,0 +1,128 @@
+"""
+原图预读
+图库在 SMB / NFS 上时，读取一张几十 MB 的 RAW 要等网络，期间 CPU 空闲。
+预读线程按计划的处理顺序提前把接下来的 N 个原图读入内存，转换时直接使用这些数据，不再从磁盘读取；
+预读的文件数和总字节数都有上限，转换取走一个才继续往后读。
+
+调度器为了填满内存预算可能跳过队首先处理后面的小图：还没开始预读的文件直接由转换进程自己读取，
+预读线程随后跳过它。
+
+环境变量：
+  PREFETCH_FILES    预读的文件数（默认 4，0 表示关闭预读）
+  PREFETCH_MB       缓冲的数据达到该大小（MB，默认 512）后暂停预读，直到转换取走数据；该值从并发解码的内存预算中扣除
+  PREFETCH_THREADS  并发读取的线程数（默认 2，网络存储延迟高时可以调大）
+"""
+import os
+import threading
+from collections import deque
+
+from metrics import metrics
+
+MB = 1024 * 1024
+# 读取失败的标记，转换时回退为自己读取并报告真实的错误
+_FAILED = object()
+
+
+def default_depth() -> int:
+    return int(os.getenv('PREFETCH_FILES') or 4)
+
+
+def default_max_bytes() -> int:
+    return int(os.getenv('PREFETCH_MB') or 512) * MB
+
+
+def reserved_bytes() -> int:
+    """预读缓冲最多占用的内存，调度并发解码时从预算中扣除"""
+    return default_max_bytes() if default_depth() > 0 else 0
+
+
+class Prefetcher:
+    def __init__(self, paths, depth: int | None = None, max_bytes: int | None = None, threads: int | None = None):
+        self.depth = depth if depth is not None else default_depth()
+        self.max_bytes = max_bytes if max_bytes is not None else default_max_bytes()
+        threads = threads or int(os.getenv('PREFETCH_THREADS') or 2)
+        self._order = deque(paths)
+        # 路径 -> 数据；None 表示正在读取
+        self._buffers: dict = {}
+        self._buffered_bytes = 0
+        self._skipped = set()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._threads = [
+            threading.Thread(target=self._run, daemon=True) for _ in range(threads if self.depth > 0 else 0)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def enabled(self) -> bool:
+        return self.depth > 0
+
+    def _next_path(self) -> str | None:
+        """在锁内调用：等到缓冲有空位时返回下一个要预读的路径，全部读完或已关闭时返回 None"""
+        while not self._closed:
+            while self._order and self._order[0] in self._skipped:
+                self._skipped.discard(self._order.popleft())
+            if not self._order:
+                return None
+            if len(self._buffers) < self.depth and (not self._buffers or self._buffered_bytes < self.max_bytes):
+                path = self._order.popleft()
+                self._buffers[path] = None
+                return path
+            self._cond.wait()
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                path = self._next_path()
+            if path is None:
+                return
+            try:
+                with metrics.timer(stage='read'):
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                metrics.inc('source_bytes_total', len(data))
+            except OSError:
+                data = _FAILED
+            with self._cond:
+                self._buffers[path] = data
+                if data is not _FAILED:
+                    self._buffered_bytes += len(data)
+                self._cond.notify_all()
+
+    def take(self, path: str) -> bytes | None:
+        """取走 path 的预读数据；没有预读（或读取失败）时返回 None，由调用方自己读取"""
+        if not self.enabled:
+            return None
+        with self._cond:
+            if path not in self._buffers:
+                # 被调度器提前取用：预读线程不再读它
+                self._skipped.add(path)
+                data = _FAILED
+            else:
+                if self._buffers[path] is None:
+                    # 预读还没完成，等待时间即没能被计算掩盖的读取耗时
+                    with metrics.timer(stage='prefetch_wait'):
+                        while self._buffers[path] is None:
+                            self._cond.wait()
+                data = self._buffers.pop(path)
+                if data is not _FAILED:
+                    self._buffered_bytes -= len(data)
+                self._cond.notify_all()
+        metrics.inc('prefetch_total', result='miss' if data is _FAILED else 'hit')
+        return None if data is _FAILED else data
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._buffers.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
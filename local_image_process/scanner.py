@@ -0,0 +1,117 @@
+"""
+图库扫描规则
+统一的包含/排除规则（glob + 附属文件模式），在扫描阶段一次性应用：
+被排除的文件不会被打开，后续 EXIF、转换、上传阶段只处理扫描结果中的文件
+"""
+import os
+from collections import Counter
+from fnmatch import fnmatchcase
+
+# 支持常见图片格式和 RAW 格式
+IMAGE_PATTERNS = (
+    '*.png', '*.jpg', '*.jpeg', '*.heic', '*.heif', '*.tif', '*.tiff',
+    '*.arw', '*.cr2', '*.nef', '*.dng', '*.raf', '*.orf', '*.rw2',
+)
+
+# 相册描述文件，原样复制到输出目录
+ALBUM_INFO_PATTERNS = ('*.yaml',)
+
+# (模式, 原因)，按顺序匹配，命中第一条即排除
+DEFAULT_EXCLUDE_RULES = (
+    ('.*', 'hidden'),
+    ('*_thumbnail.*', 'thumbnail'),
+    ('*_thumbnail', 'thumbnail'),
+    ('metadata.json', 'sidecar'),
+    ('*.xmp', 'sidecar'),
+    ('*.aae', 'sidecar'),
+    ('*.pp3', 'sidecar'),
+    ('*.dop', 'sidecar'),
+    ('*.thm', 'sidecar'),
+)
+
+# 跳过系统/隐藏目录，避免扫描照片库内部数据库和缓存
+DEFAULT_EXCLUDE_DIRS = (
+    'resources', 'private', 'database', 'caches', 'cache', 'thumbs', 'thumbnails', 'previews',
+)
+
+
+def _split_env_list(name: str) -> list[str]:
+    value = os.getenv(name) or ''
+    return [item.strip().lower() for item in value.split(',') if item.strip()]
+
+
+class ScanRules:
+    """文件名 glob 规则（大小写不敏感）
+
+    环境变量：
+      SCAN_INCLUDE       覆盖默认的图片格式模式，如 "*.jpg,*.arw"
+      SCAN_EXCLUDE       追加排除模式，原因记为 custom
+      SCAN_EXCLUDE_DIRS  追加排除的目录名
+    """
+
+    def __init__(self, include=IMAGE_PATTERNS, album_info=ALBUM_INFO_PATTERNS,
+                 exclude_rules=DEFAULT_EXCLUDE_RULES, exclude_dirs=DEFAULT_EXCLUDE_DIRS):
+        self.include = tuple(p.lower() for p in include)
+        self.album_info = tuple(p.lower() for p in album_info)
+        self.exclude_rules = tuple((p.lower(), reason) for p, reason in exclude_rules)
+        self.exclude_dirs = {d.lower() for d in exclude_dirs}
+
+    @classmethod
+    def from_env(cls) -> 'ScanRules':
+        include = _split_env_list('SCAN_INCLUDE') or IMAGE_PATTERNS
+        exclude_rules = DEFAULT_EXCLUDE_RULES + tuple((p, 'custom') for p in _split_env_list('SCAN_EXCLUDE'))
+        exclude_dirs = DEFAULT_EXCLUDE_DIRS + tuple(_split_env_list('SCAN_EXCLUDE_DIRS'))
+        return cls(include=include, exclude_rules=exclude_rules, exclude_dirs=exclude_dirs)
+
+    def skip_dir(self, dirname: str) -> bool:
+        return dirname.startswith('.') or dirname.lower() in self.exclude_dirs
+
+    def classify(self, filename: str) -> tuple[str | None, str | None]:
+        """返回 (类别, 排除原因)；类别为 image / album_info，被排除时类别为 None"""
+        lower = filename.lower()
+        for pattern, reason in self.exclude_rules:
+            if fnmatchcase(lower, pattern):
+                return None, reason
+        if any(fnmatchcase(lower, p) for p in self.include):
+            return 'image', None
+        if any(fnmatchcase(lower, p) for p in self.album_info):
+            return 'album_info', None
+        return None, 'unsupported'
+
+
+class ScanResult:
+    def __init__(self):
+        # [(file_path, root)]
+        self.images: list[tuple[str, str]] = []
+        self.album_info: list[tuple[str, str]] = []
+        self.skipped = Counter()
+        self.skipped_dirs = 0
+
+    def summary(self) -> str:
+        reasons = '，'.join(f"{reason} {count} 个" for reason, count in self.skipped.most_common())
+        text = f"扫描完成：图片 {len(self.images)} 个，相册描述 {len(self.album_info)} 个，跳过文件 {sum(self.skipped.values())} 个"
+        if reasons:
+            text += f"（{reasons}）"
+        if self.skipped_dirs:
+            text += f"，跳过目录 {self.skipped_dirs} 个"
+        return text
+
+
+def scan_library(scan_roots, rules: ScanRules | None = None) -> ScanResult:
+    """遍历扫描根目录，只按文件名分类，不打开任何文件"""
+    rules = rules or ScanRules.from_env()
+    result = ScanResult()
+    for scan_root in scan_roots:
+        for root, dirnames, files in os.walk(scan_root):
+            kept = [d for d in dirnames if not rules.skip_dir(d)]
+            result.skipped_dirs += len(dirnames) - len(kept)
+            dirnames[:] = kept
+            for file in files:
+                kind, reason = rules.classify(file)
+                if kind == 'image':
+                    result.images.append((os.path.join(root, file), root))
+                elif kind == 'album_info':
+                    result.album_info.append((os.path.join(root, file), root))
+                else:
+                    result.skipped[reason] += 1
+    return result
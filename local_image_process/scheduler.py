@@ -0,0 +1,158 @@
+"""
+按内存预算调度并发转换
+转换前只读文件头估算每个文件解码时的内存峰值（尺寸 × 格式），在总预算内尽量多地并发：
+大图（RAW、全景 TIFF）占满预算时，后面能放得下的小图先补进空闲的子进程，不会让机器 OOM，也不会让 CPU 闲着。
+执行顺序由优先级决定：新增或有变化的图片先处理，其次拍摄时间越新越早，新拍的相册不必排在全部旧图之后。
+
+环境变量：
+  CONVERT_WORKERS    并发转换子进程数（默认 CPU 核数，最多 8）
+  MEMORY_BUDGET_MB   并发解码的总内存预算（MB，默认物理内存的一半，无法获取时 4096）
+  WORK_ORDER         priority（默认）按优先级 | scan 按扫描顺序
+  PRIORITY_BY_ALBUM  1 时整本相册一起排（相册按其中最优先的图片排序），相册能更早全部完成并发布
+"""
+import os
+import queue
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import heif
+from dedupe import is_raw
+from isolation import IsolatedWorker
+
+MB = 1024 * 1024
+# 每个子进程本身（解释器 + Pillow/rawpy）的常驻内存，启动时就从预算中扣除
+WORKER_BASE_BYTES = 100 * MB
+# RAW：raw_image 每像素 2 字节，LibRaw 内部 4 通道 16 位 8 字节，
+# 8 位 RGB 输出、PIL 副本、方向校正副本各 3 字节，另留一份给水印 / 编码
+RAW_BYTES_PER_RAW_PIXEL = 2
+RAW_BYTES_PER_PIXEL = 8 + 3 * 4
+# 普通图片：解码结果、方向校正副本、编码缓冲，按每像素字节数的 3 倍估算
+DECODED_COPIES = 3
+# 读不出尺寸时按文件大小的倍数估算
+UNKNOWN_SIZE_FACTOR = 20
+# 队首放不下时，最多往后看这么多个文件找能补进来的小图
+BACKFILL_WINDOW = 64
+
+
+def physical_memory() -> int | None:
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_workers() -> int:
+    return int(os.getenv('CONVERT_WORKERS') or min(8, os.cpu_count() or 1))
+
+
+def default_budget() -> int:
+    if os.getenv('MEMORY_BUDGET_MB'):
+        return int(os.getenv('MEMORY_BUDGET_MB')) * MB
+    total = physical_memory()
+    return total // 2 if total else 4096 * MB
+
+
+def estimate_decode_bytes(path: str) -> int:
+    """只读文件头估算解码转换一个文件的内存峰值（字节）"""
+    try:
+        if is_raw(path):
+            import rawpy
+
+            # imread 只解析文件头，真正解包在 postprocess 时才发生
+            with rawpy.imread(path) as raw:
+                sizes = raw.sizes
+                return (sizes.raw_width * sizes.raw_height * RAW_BYTES_PER_RAW_PIXEL
+                        + sizes.width * sizes.height * RAW_BYTES_PER_PIXEL)
+        from PIL import Image
+
+        if heif.is_heif(path):
+            heif.register()
+        with Image.open(path) as img:
+            width, height = img.size
+            bytes_per_pixel = max(3, len(img.getbands()) * (2 if '16' in img.mode else 1))
+            return width * height * bytes_per_pixel * DECODED_COPIES
+    except Exception:
+        try:
+            return os.path.getsize(path) * UNKNOWN_SIZE_FACTOR
+        except OSError:
+            return 0
+
+
+def order_by_priority(tasks: list[tuple], ranks: dict, album_of, by_album: bool = False) -> list[tuple]:
+    """按 ranks[task]（越小越优先）稳定排序；by_album 时先按相册内最优先的一张给相册排序"""
+    if not by_album:
+        return sorted(tasks, key=lambda task: ranks[task])
+    album_rank = {}
+    for task in tasks:
+        album = album_of(task)
+        if album not in album_rank or ranks[task] < album_rank[album]:
+            album_rank[album] = ranks[task]
+    return sorted(tasks, key=lambda task: (album_rank[album_of(task)], album_of(task), ranks[task]))
+
+
+class AdmissionScheduler:
+    """在内存预算内把任务分给一组隔离子进程
+
+    任务按给定顺序执行；队首放得下就先执行队首，放不下时在窗口内找能放下的小任务补位；
+    一个都没在跑时即使超出预算也执行队首（单个文件本身超过预算时只能独占运行）
+    """
+
+    def __init__(self, factory, factory_args: tuple = (), budget=None, workers: int | None = None,
+                 memory_budget: int | None = None):
+        self.workers = max(1, workers or default_workers())
+        total = memory_budget or default_budget()
+        self.capacity = max(0, total - self.workers * WORKER_BASE_BYTES)
+        self._pool = [IsolatedWorker(factory, factory_args, budget) for _ in range(self.workers)]
+        self._idle = queue.SimpleQueue()
+        for worker in self._pool:
+            self._idle.put(worker)
+        self.peak_admitted = 0
+
+    def _pick(self, pending: list, in_use: int, running: bool) -> int | None:
+        for i, (cost, _) in enumerate(pending[:BACKFILL_WINDOW]):
+            if in_use + cost <= self.capacity:
+                return i
+        return None if running else 0
+
+    def _run_one(self, task, prepare=None):
+        if prepare is not None:
+            task = prepare(task)
+        worker = self._idle.get()
+        try:
+            return worker.run(*task)
+        finally:
+            self._idle.put(worker)
+
+    def run(self, tasks: list[tuple[int, tuple]], on_done, prepare=None):
+        """tasks 为 [(估算字节数, 任务参数)]；on_done(任务参数, 结果, 异常) 在调用线程中逐个回调
+
+        prepare(任务参数) 在派发前于后台线程中调用，返回实际传给子进程的参数（如附上预读的原图数据）
+        """
+        pending = list(tasks)
+        in_use = 0
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                while pending and len(running) < self.workers:
+                    index = self._pick(pending, in_use, bool(running))
+                    if index is None:
+                        break
+                    cost, task = pending.pop(index)
+                    in_use += cost
+                    self.peak_admitted = max(self.peak_admitted, in_use)
+                    running[pool.submit(self._run_one, task, prepare)] = (cost, task)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    cost, task = running.pop(future)
+                    in_use -= cost
+                    error = future.exception()
+                    on_done(task, None if error else future.result(), error)
+
+    def close(self):
+        for worker in self._pool:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
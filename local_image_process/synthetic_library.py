@@ -0,0 +1,169 @@
+"""
+合成测试图库生成器
+按固定随机种子生成可复现的 Eagle 风格图库：根目录 metadata.json（含嵌套文件夹）、
+images/<id>.info/ 下的原图 + metadata.json + 缩略图，原图为 JPEG / PNG / DNG 混合，部分带 GPS
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational, ImageFileDirectory_v2
+
+FORMATS = ('jpg', 'png', 'dng')
+
+# EXIF 标签
+_TAG_MAKE = 0x010F
+_TAG_MODEL = 0x0110
+_TAG_ORIENTATION = 0x0112
+_TAG_DATETIME = 0x0132
+_TAG_EXIF_IFD = 0x8769
+_TAG_GPS_IFD = 0x8825
+_TAG_EXPOSURE_TIME = 0x829A
+_TAG_FNUMBER = 0x829D
+_TAG_ISO = 0x8827
+_TAG_DATETIME_ORIGINAL = 0x9003
+_TAG_FOCAL_LENGTH = 0x920A
+_TAG_LENS_MODEL = 0xA434
+
+
+def _dms(value: float) -> tuple:
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600, 2)
+    return IFDRational(degrees, 1), IFDRational(minutes, 1), IFDRational(int(seconds * 100), 100)
+
+
+def _render_pixels(rng, width: int, height: int) -> np.ndarray:
+    """平滑渐变叠加噪声和色块，编码开销接近真实照片而不是纯色图"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = rng.uniform(0, 255, size=3).astype(np.float32)
+    slope = rng.uniform(-0.25, 0.25, size=(3, 2)).astype(np.float32)
+    rgb = np.stack([base[c] + slope[c, 0] * x + slope[c, 1] * y for c in range(3)], axis=-1)
+    for _ in range(6):
+        cx, cy = rng.integers(0, width), rng.integers(0, height)
+        radius = rng.integers(max(width, height) // 20, max(width, height) // 5)
+        mask = (x - cx) ** 2 + (y - cy) ** 2 < radius ** 2
+        rgb[mask] = rng.uniform(0, 255, size=3)
+    rgb += rng.normal(0, 12, size=rgb.shape).astype(np.float32)
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+def _build_exif(rng, index: int, with_gps: bool) -> Image.Exif:
+    exif = Image.Exif()
+    exif[_TAG_MAKE] = 'Synthetic'
+    exif[_TAG_MODEL] = f"SYN-{index % 3 + 1}"
+    exif[_TAG_ORIENTATION] = 6 if index % 5 == 0 else 1
+    taken = f"2024:{index % 12 + 1:02d}:{index % 28 + 1:02d} {index % 24:02d}:{index % 60:02d}:00"
+    exif[_TAG_DATETIME] = taken
+    exif_ifd = exif.get_ifd(_TAG_EXIF_IFD)
+    exif_ifd[_TAG_EXPOSURE_TIME] = IFDRational(1, int(rng.choice([60, 125, 250, 500, 1000])))
+    exif_ifd[_TAG_FNUMBER] = IFDRational(int(rng.choice([18, 28, 40, 56, 80])), 10)
+    exif_ifd[_TAG_ISO] = int(rng.choice([100, 200, 400, 800, 3200]))
+    exif_ifd[_TAG_DATETIME_ORIGINAL] = taken
+    exif_ifd[_TAG_FOCAL_LENGTH] = IFDRational(int(rng.choice([24, 35, 50, 85, 200])), 1)
+    exif_ifd[_TAG_LENS_MODEL] = 'Synthetic 24-200mm'
+    if with_gps:
+        lat = float(rng.uniform(18, 45))
+        lon = float(rng.uniform(100, 122))
+        gps_ifd = exif.get_ifd(_TAG_GPS_IFD)
+        gps_ifd[1] = 'N'
+        gps_ifd[2] = _dms(lat)
+        gps_ifd[3] = 'E'
+        gps_ifd[4] = _dms(lon)
+    return exif
+
+
+def _write_dng(path: str, rng, width: int, height: int, index: int):
+    """写一个最小可解码的 DNG（16 位 RGGB 拜耳阵列）"""
+    rgb = _render_pixels(rng, width, height).astype(np.uint16) * 16
+    bayer = np.empty((height, width), dtype='<u2')
+    bayer[0::2, 0::2] = rgb[0::2, 0::2, 0]
+    bayer[0::2, 1::2] = rgb[0::2, 1::2, 1]
+    bayer[1::2, 0::2] = rgb[1::2, 0::2, 1]
+    bayer[1::2, 1::2] = rgb[1::2, 1::2, 2]
+    info = ImageFileDirectory_v2()
+    info[262] = 32803  # PhotometricInterpretation = CFA
+    info[_TAG_MAKE] = 'Synthetic'
+    info[_TAG_MODEL] = f"SYN-RAW-{index % 2 + 1}"
+    info[_TAG_ORIENTATION] = 1
+    info[_TAG_DATETIME] = f"2024:{index % 12 + 1:02d}:{index % 28 + 1:02d} 12:00:00"
+    info[33421] = (2, 2)  # CFARepeatPatternDim
+    info.tagtype[33421] = 3
+    info[33422] = b'\x00\x01\x01\x02'  # CFAPattern RGGB
+    info.tagtype[33422] = 1
+    info[50706] = b'\x01\x04\x00\x00'  # DNGVersion
+    info.tagtype[50706] = 1
+    info[50708] = 'Synthetic RAW'  # UniqueCameraModel
+    info[50717] = 4095  # WhiteLevel
+    info.tagtype[50717] = 3
+    info[50721] = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0)  # ColorMatrix1
+    info.tagtype[50721] = 10
+    Image.fromarray(bayer).save(path, format='TIFF', tiffinfo=info)
+
+
+def generate_library(root: str, albums: int = 4, per_album: int = 10, width: int = 1600, height: int = 1200,
+                     seed: int = 42, formats=FORMATS, gps_ratio: float = 0.5, with_thumbnails: bool = True) -> str:
+    """生成合成图库，返回图库路径（<root>/Synthetic.library）"""
+    rng = np.random.default_rng(seed)
+    library = os.path.join(root, 'Synthetic.library')
+    images_dir = os.path.join(library, 'images')
+    os.makedirs(images_dir, exist_ok=True)
+
+    # 一半相册挂在父文件夹下，覆盖嵌套相册路径
+    folders = []
+    folder_ids = []
+    parent = {'id': 'SYNPARENT', 'name': '合成父相册', 'children': []}
+    for a in range(albums):
+        folder = {'id': f"SYNF{a:04d}", 'name': f"相册{a:03d}", 'children': []}
+        folder_ids.append(folder['id'])
+        if a % 2:
+            parent['children'].append(folder)
+        else:
+            folders.append(folder)
+    if parent['children']:
+        folders.append(parent)
+    with open(os.path.join(library, 'metadata.json'), 'w', encoding='utf-8') as f:
+        json.dump({'folders': folders}, f, ensure_ascii=False)
+
+    index = 0
+    for folder_id in folder_ids:
+        for _ in range(per_album):
+            ext = formats[index % len(formats)]
+            item_id = f"SYN{index:08d}"
+            name = f"DSC{index:05d}"
+            item_dir = os.path.join(images_dir, f"{item_id}.info")
+            os.makedirs(item_dir, exist_ok=True)
+            image_path = os.path.join(item_dir, f"{name}.{ext}")
+            if ext == 'dng':
+                _write_dng(image_path, rng, width, height, index)
+            else:
+                img = Image.fromarray(_render_pixels(rng, width, height))
+                exif = _build_exif(rng, index, with_gps=rng.random() < gps_ratio)
+                if ext == 'jpg':
+                    img.save(image_path, 'JPEG', quality=92, exif=exif.tobytes())
+                else:
+                    img.save(image_path, 'PNG', exif=exif.tobytes())
+            if with_thumbnails:
+                Image.new('RGB', (64, 48), (128, 128, 128)).save(os.path.join(item_dir, f"{name}_thumbnail.png"))
+            with open(os.path.join(item_dir, 'metadata.json'), 'w', encoding='utf-8') as f:
+                json.dump({'id': item_id, 'name': name, 'ext': ext, 'folders': [folder_id]}, f)
+            index += 1
+    return library
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='生成可复现的合成图库')
+    parser.add_argument('root', help='输出目录')
+    parser.add_argument('--albums', type=int, default=4)
+    parser.add_argument('--per-album', type=int, default=10)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=1200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--gps-ratio', type=float, default=0.5)
+    args = parser.parse_args()
+    path = generate_library(args.root, args.albums, args.per_album, args.width, args.height,
+                            args.seed, gps_ratio=args.gps_ratio)
+    print(path)
@@ -1,21 +1,54 @@
+import argparse
 import time
 import os
-import mimetypes
 import sqlite3
-from PIL import Image, ExifTags, ImageOps
+from PIL import Image, ImageOps
 import shutil
+from io import BytesIO
 from dotenv import load_dotenv
-import exifread
 import json
-from fractions import Fraction
-from loguru import logger
-from qiniu import Auth, put_file, Region
-import qiniu.config as qiniu_config
-import rawpy
-import imageio
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from exif_store import ExifStore
+from metadata_shards import build_shards, load_remote_index, publish_shards
+from metrics import build_run_summary, metrics, write_run_summary
+from listing_snapshot import ListingSnapshot, SnapshotBackend, snapshot_path
+from storage import QiniuStorage, StorageBackend, storage_from_env
+from scanner import ScanResult, ScanRules, scan_library
+from dedupe import DedupePolicy, DedupeResult, find_duplicates
+from journal import JOURNAL_NAME, JobJournal, file_signature
+from isolation import BudgetExceeded, FileBudget, Quarantine, WorkerError
+from scheduler import AdmissionScheduler, default_budget, default_workers, estimate_decode_bytes, order_by_priority
+from prefetch import Prefetcher, reserved_bytes
+from encoder import EncoderSettings, encode_webp
+import heif
+from work_queue import LeaseKeeper, WorkQueue, default_worker_id, queue_path
+# rawpy、exifread、七牛 SDK、NumPy 等较重的依赖都在首次用到时才导入，
+# 只做扫描、上传或本地同步时不必为它们付出启动时间
+
+
+class _LazyLogger:
+    """首次输出日志时才导入 loguru"""
+
+    def __getattr__(self, name):
+        from loguru import logger as _logger
+        return getattr(_logger, name)
+
+
+logger = _LazyLogger()
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+
+# 输出目录中需要上传到 OSS 的文件类型（图片、exif_data.json、相册描述）
+UPLOAD_SUFFIXES = ('.webp', '.json', '.yaml')
+# 输出目录中存放元数据分片的子目录，不随相册文件一起上传到 gallery/
+META_DIR_NAME = '_meta'
+
 def log_update_sqlite(update_type: str, status: str, message: str, progress: float | None = None):
     db_path = os.getenv('DB_PATH')
     if not db_path:
@@ -70,19 +103,50 @@ def log_update_sqlite(update_type: str, status: str, message: str, progress: flo
             pass
 
 class ImageProcessor:
-    def __init__(self, directory_path):
+    def __init__(self, directory_path, output_dir: str | None = None, apply_watermark: bool = True,
+                 clean_output: bool = True, journal: JobJournal | None = None, on_album_done=None,
+                 work_queue: WorkQueue | None = None, tmp_tag: str | None = None):
         self.directory_path = directory_path
-        self.output_dir = os.path.join(os.path.dirname(__file__), "output")
+        self.output_dir = output_dir or DEFAULT_OUTPUT_DIR
+        self.apply_watermark = apply_watermark
+        self.encoder = EncoderSettings.from_env()
+        self.heif_max_edge = heif.max_edge()
+        self.journal = journal
+        # 相册内本次需要转换的图片全部结束时回调 on_album_done(相册)，用于分相册发布
+        self.on_album_done = on_album_done
+        # 设置时转换任务经共享队列分发给多个节点
+        self.work_queue = work_queue
+        # 临时输出文件名的后缀：接手过期租约的节点与原节点可能同时转换同一张图，各写各的临时文件
+        self.tmp_tag = tmp_tag or default_worker_id()
         self.scan_roots = self._resolve_scan_roots(directory_path)
-        self.folder_name_map = self._load_root_folder_map()
+        # 文件夹 id -> 完整相册路径，只在初始化时解析一次根 metadata.json
+        self.folder_path_map = self._build_folder_path_map()
         self._dir_metadata_cache: dict[str, dict] = {}
-        # 清空 output 文件夹（更安全的方式）
+        self.exif_db_path = os.path.join(self.output_dir, 'exif_data.db')
+        self.scan_rules = ScanRules.from_env()
+        self._scan_result: ScanResult | None = None
+        self.dedupe_policy = DedupePolicy.from_env()
+        self._dedupe_result: DedupeResult | None = None
+        self.budget = FileBudget.from_env()
+        self._quarantine: Quarantine | None = None
+        self._images: list[tuple[str, str]] | None = None
+        # 输出 key -> 占位图字段，转换结束后合并进 EXIF 记录
+        self.placeholders: dict[str, dict] = {}
+        if clean_output:
+            self.reset_output()
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+
+    def reset_output(self, images_only: bool = False):
+        """清空 output 文件夹；images_only 时只删除相册目录，保留 exif_data.json 等顶层文件"""
         if os.path.exists(self.output_dir):
             try:
                 # 只删除图片和 JSON 文件，保留日志文件
                 for item in os.listdir(self.output_dir):
                     item_path = os.path.join(self.output_dir, item)
-                    if os.path.isfile(item_path) and not item.endswith('.txt'):
+                    if item == JOURNAL_NAME:
+                        continue
+                    if os.path.isfile(item_path) and not item.endswith('.txt') and not images_only:
                         try:
                             os.remove(item_path)
                         except:
@@ -95,9 +159,6 @@ class ImageProcessor:
             except Exception as e:
                 logger.warning(f"清理 output 目录时出错: {e}")
 
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
-
     @staticmethod
     def _resolve_scan_roots(directory_path: str):
         # 优先扫描图片目录（含 metadata.json），便于对应相册文件夹名称
@@ -116,19 +177,34 @@ class ImageProcessor:
                 return scan_roots
         return [directory_path]
 
-    def _load_root_folder_map(self) -> dict:
-        # 从图库根目录 metadata.json 读取文件夹 id -> name 映射
+    def _build_folder_path_map(self) -> dict[str, str]:
+        # 从图库根目录 metadata.json 构建文件夹 id -> 完整相册路径（含父文件夹）映射
         metadata_path = os.path.join(self.directory_path, 'metadata.json')
         if not os.path.exists(metadata_path):
             return {}
         try:
             with open(metadata_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-            folders = data.get('folders') or []
-            return {f.get('id'): f.get('name') for f in folders if f.get('id') and f.get('name')}
-        except Exception:
+        except Exception as e:
+            logger.warning(f"读取根 metadata.json 失败: {e}")
             return {}
 
+        folder_path_map = {}
+        # 迭代遍历文件夹树，避免深层嵌套时递归过深
+        stack = [(folder, []) for folder in reversed(data.get('folders') or [])]
+        while stack:
+            folder, parent_names = stack.pop()
+            if not isinstance(folder, dict):
+                continue
+            folder_id = folder.get('id')
+            folder_name = folder.get('name')
+            path_parts = parent_names + [folder_name] if folder_name else parent_names
+            if folder_id and folder_name and folder_id not in folder_path_map:
+                folder_path_map[folder_id] = '/'.join(path_parts)
+            for child in reversed(folder.get('children') or []):
+                stack.append((child, path_parts))
+        return folder_path_map
+
     def _load_dir_metadata(self, dir_path: str) -> dict | None:
         if dir_path in self._dir_metadata_cache:
             return self._dir_metadata_cache[dir_path]
@@ -145,50 +221,219 @@ class ImageProcessor:
             self._dir_metadata_cache[dir_path] = None
             return None
 
+    def scan(self) -> ScanResult:
+        """按统一规则扫描一次图库，后续各阶段复用扫描结果"""
+        if self._scan_result is None:
+            self._scan_result = scan_library(self.scan_roots, self.scan_rules)
+            summary = self._scan_result.summary()
+            logger.info(summary)
+            self._log_progress(summary, 5)
+        return self._scan_result
+
+    def dedupe(self) -> DedupeResult:
+        """在扫描结果上去重，后续 EXIF、转换只处理保留下来的图片"""
+        if self._dedupe_result is None:
+            with metrics.timer(stage='dedupe'):
+                self._dedupe_result = find_duplicates(self.scan().images, self.output_file_for, self.dedupe_policy)
+            for path, kept, reason in self._dedupe_result.duplicates:
+                metrics.inc('duplicates_skipped_total', reason=reason)
+                logger.info(f"跳过重复图片（{reason}）: {path} -> 保留 {kept}")
+            summary = self._dedupe_result.summary()
+            logger.info(summary)
+            self._log_progress(summary, 6)
+        return self._dedupe_result
+
+    @property
+    def quarantine(self) -> Quarantine:
+        if self._quarantine is None:
+            self._quarantine = Quarantine().load()
+        return self._quarantine
+
+    def images(self) -> list[tuple[str, str]]:
+        """去重后再排除隔离清单中未变化的文件，EXIF 和转换都只处理这些图片"""
+        if self._images is None:
+            self._images = []
+            for file_path, root in self.dedupe().kept:
+                entry = self.quarantine.blocks(file_path, file_signature(file_path))
+                if entry:
+                    metrics.inc('images_total', result='quarantined')
+                    logger.warning(f"跳过已隔离的图片（{entry['reason']}）: {file_path}")
+                    continue
+                self._images.append((file_path, root))
+            self.quarantine.save()
+        return self._images
+
     def process_images(self):
         logger.info("开始parse exif信息")
         self.save_exif_to_json()
         logger.info("保存EXIF信息到JSON文件")
-        processed = 0
-        for scan_root in self.scan_roots:
-            for root, dirnames, files in os.walk(scan_root):
-                # 跳过系统/隐藏目录，避免扫描照片库内部数据库和缓存
-                dirnames[:] = [d for d in dirnames if not d.startswith('.') and d.lower() not in {
-                    'resources', 'private', 'database', 'caches', 'cache', 'thumbs', 'thumbnails', 'previews'
-                }]
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if '_thumbnail' in file_path.lower():
-                        continue
-                    if self._is_image_file(file):
-                        try:
-                            logger.info(f"开始处理图片: {file}")
-                            rel_path = os.path.relpath(file_path, self.directory_path)
-                            album_id = self._infer_album_id(rel_path, file_path)
-                            filename = os.path.basename(file_path).rsplit('.', 1)[0] + '.webp'
-                            output_file = os.path.join(self.output_dir, album_id, filename)
-                            output_file_dir = os.path.dirname(output_file)
-
-                            if not os.path.exists(output_file_dir):
-                                os.makedirs(output_file_dir)
-
-                            self.process_image(file_path, output_file)
-                            processed += 1
-                            if processed % 20 == 0:
-                                total = getattr(self, 'total_images', 0) or 0
-                                if total:
-                                    progress = min(90, round(processed * 80 / total, 2))
-                                    self._log_progress(f"已处理 {processed}/{total}", progress)
-                        except Exception as e:
-                            logger.error(f"处理图片失败 {file_path}: {e}")
-                            # 跳过有问题的文件，继续处理下一张
-                            continue
-                    elif file.endswith('.yaml'):
-                        self.copy_yaml_file(root, file, self.output_dir)
+        self.convert_images()
+
+    def convert_images(self):
+        """转换全部图片并复制相册描述；占位图合并进已有的 EXIF 存储"""
+        self._converted = 0
+        quarantined = set()
+        tasks = []
+        for file_path, root in self.images():
+            try:
+                output_file = self.output_file_for(file_path)
+                os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+                key = os.path.relpath(output_file, self.output_dir).replace(os.sep, '/')
+                sig = file_signature(file_path)
+                done = self.journal.get('converted', key, sig) if self.journal else None
+                if done and os.path.exists(output_file):
+                    # 断点续跑：上次已转换且原图未变化，沿用输出文件和占位图
+                    if done.get('placeholder'):
+                        self.placeholders[key] = done['placeholder']
+                    metrics.inc('images_total', result='resumed')
+                    self._converted += 1
+                    continue
+                tasks.append((file_path, output_file, key, sig))
+            except Exception as e:
+                metrics.inc('images_total', result='failed')
+                logger.error(f"处理图片失败 {file_path}: {e}")
+        tasks = self.plan_work(tasks)
+        album_remaining = Counter(os.path.dirname(task[2]) for task in tasks)
+
+        def on_done(task, placeholder, error):
+            file_path, output_file, key, sig = task
+            album = os.path.dirname(key)
+            album_remaining[album] -= 1
+            try:
+                self._on_image_done(task, placeholder, error, quarantined)
+            finally:
+                if album_remaining[album] == 0 and self.on_album_done:
+                    self.on_album_done(album)
+
+        if self.work_queue is not None:
+            self._convert_via_queue(tasks, on_done)
+        elif self.budget.isolate:
+            # 子进程并发转换，按估算的解码内存在预算内调度
+            # 按源文件对应结果，源文件在任务中唯一
+            by_source = {task[0]: task for task in tasks}
+            with metrics.timer(stage='estimate'):
+                planned = [(estimate_decode_bytes(task[0]), task[:2]) for task in tasks]
+            # 预读缓冲在主进程中，从内存预算里扣除
+            with Prefetcher([task[0] for task in tasks]) as prefetcher, \
+                    AdmissionScheduler(_image_converter, (self.directory_path, self.output_dir,
+                                                          self.conversion_settings(), self.tmp_tag),
+                                       self.budget, memory_budget=_convert_budget()) as scheduler:
+                logger.info(f"并发转换 {len(planned)} 张：{scheduler.workers} 个子进程，"
+                            f"内存预算 {scheduler.capacity // (1024 * 1024)} MB")
+                scheduler.run(planned, lambda args, result, error: on_done(by_source[args[0]], result, error),
+                              prepare=lambda args: args + (prefetcher.take(args[0]),))
+                logger.info(f"并发解码估算内存峰值 {scheduler.peak_admitted // (1024 * 1024)} MB")
+        else:
+            with Prefetcher([task[0] for task in tasks]) as prefetcher:
+                for task in tasks:
+                    try:
+                        logger.info(f"开始处理图片: {os.path.basename(task[0])}")
+                        self.process_image(task[0], task[1], prefetcher.take(task[0]))
+                        on_done(task, self.placeholders.get(task[2]), None)
+                    except Exception as e:
+                        on_done(task, None, e)
+
+        self.quarantine.save()
+        if quarantined:
+            logger.warning(f"本次隔离 {len(quarantined)} 个文件，详见 {self.quarantine.path}")
+        self.save_placeholders(drop=quarantined)
+        for file_path, root in self.scan().album_info:
+            self.copy_yaml_file(root, os.path.basename(file_path), self.output_dir)
         total = getattr(self, 'total_images', 0) or 0
         if total:
-            self._log_progress(f"处理完成 {processed}/{total}", 90)
-                    
+            self._log_progress(f"处理完成 {self._converted}/{total}", 90)
+
+    def _convert_via_queue(self, tasks: list[tuple], on_done):
+        """把任务按顺序写入共享队列，本机也参与转换，直到收齐所有节点的结果"""
+        queue = self.work_queue
+        # 按源文件对应结果：不同源文件可能映射到同一个输出 key（如同名的 jpg 与 png）
+        by_source = {os.path.relpath(task[0], self.directory_path): task for task in tasks}
+        with metrics.timer(stage='estimate'):
+            queue.start_job(
+                [(os.path.relpath(task[0], self.directory_path), task[2], task[3], estimate_decode_bytes(task[0]))
+                 for task in tasks],
+                self.conversion_settings(),
+            )
+        logger.info(f"已写入 {len(tasks)} 个转换任务到共享队列 {queue.path}")
+        last_seq = 0
+        remaining = len(by_source)
+
+        def collect():
+            nonlocal last_seq, remaining
+            for seq, source, state, result, error in queue.finished_since(last_seq):
+                last_seq = seq
+                task = by_source.pop(source, None)
+                if task is None:
+                    continue
+                remaining -= 1
+                if state == 'done':
+                    on_done(task, result, None)
+                elif error['reason'] in ('timeout', 'memory', 'crashed'):
+                    on_done(task, None, BudgetExceeded(error['reason'], error['detail']))
+                else:
+                    on_done(task, None, WorkerError(error['detail']))
+            return remaining == 0
+
+        # 队列中没有可领取的任务后继续等待其他节点，其他节点失联时由本机接手过期的租约
+        work_from_queue(queue, self.directory_path, self.output_dir, until=collect)
+
+    def _on_image_done(self, task, placeholder, error, quarantined: set):
+        file_path, output_file, key, sig = task
+        if isinstance(error, BudgetExceeded):
+            self._quarantine_file(file_path, output_file, sig, error)
+            quarantined.add(key)
+        elif error is not None:
+            # 跳过有问题的文件，继续处理下一张
+            metrics.inc('images_total', result='failed')
+            logger.error(f"处理图片失败 {file_path}: {error}")
+        else:
+            self._finish_image(key, output_file, sig, placeholder)
+
+    def plan_work(self, tasks: list[tuple]) -> list[tuple]:
+        """新增或有变化（不在列举快照中，或原图比云端文件新）的图片优先，其次拍摄时间越新越优先，
+        没有 EXIF 时间时用文件修改时间"""
+        if (os.getenv('WORK_ORDER') or 'priority').lower() == 'scan':
+            return tasks
+        published = ListingSnapshot(snapshot_path()).items
+        date_times = {}
+        if os.path.exists(self.exif_db_path):
+            with ExifStore(self.exif_db_path, readonly=True) as store:
+                date_times = store.date_times()
+        ranks = {}
+        for task in tasks:
+            file_path, _, key, _ = task
+            mtime = os.path.getmtime(file_path)
+            item = published.get(f"gallery/{key}")
+            # putTime 单位为 100 纳秒
+            fresh = item is None or mtime > (item.get('putTime') or 0) / 1e7
+            ranks[task] = (not fresh, -(_parse_exif_time(date_times.get(key)) or mtime))
+        fresh_count = sum(1 for rank in ranks.values() if not rank[0])
+        logger.info(f"按优先级排序：新增或有变化 {fresh_count} 张，其余 {len(tasks) - fresh_count} 张")
+        return order_by_priority(tasks, ranks, lambda task: os.path.dirname(task[2]),
+                                 by_album=os.getenv('PRIORITY_BY_ALBUM') == '1')
+
+    def _finish_image(self, key, output_file, sig, placeholder):
+        """单张图片转换成功：记录占位图、任务日志和进度"""
+        if placeholder:
+            self.placeholders[key] = placeholder
+        if self.journal and os.path.exists(output_file):
+            self.journal.record('converted', key, sig=sig, placeholder=placeholder)
+        metrics.inc('images_total', result='processed')
+        self._converted += 1
+        if self._converted % 20 == 0:
+            total = getattr(self, 'total_images', 0) or 0
+            if total:
+                progress = min(90, round(self._converted * 80 / total, 2))
+                self._log_progress(f"已处理 {self._converted}/{total}", progress)
+
+    def output_file_for(self, file_path: str) -> str:
+        """原图对应的输出 WebP 路径：output/<相册>/<文件名>.webp"""
+        rel_path = os.path.relpath(file_path, self.directory_path)
+        album_id = self._infer_album_id(rel_path, file_path)
+        filename = os.path.basename(file_path).rsplit('.', 1)[0] + '.webp'
+        return os.path.join(self.output_dir, album_id, filename)
+
     def copy_yaml_file(self, root, file, output_dir):
         file_path = os.path.join(root, file)
         output_file = os.path.join(output_dir, os.path.relpath(file_path, self.directory_path))
@@ -199,74 +444,124 @@ class ImageProcessor:
         shutil.copy2(file_path, output_file)
         
 
-    def process_image(self, file_path, output_file):
+    def _quarantine_file(self, file_path, output_file, sig, error: BudgetExceeded):
+        """超出预算的文件记入隔离清单，并清理子进程被终止时留下的临时文件"""
+        metrics.inc('images_total', result='quarantined')
+        logger.error(f"隔离图片（{error.reason}）{file_path}: {error.detail}")
+        self.quarantine.add(file_path, sig, error.reason, error.detail)
+        leftover = _tmp_output_file(output_file, self.tmp_tag, file_path)
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+    def conversion_settings(self) -> dict:
+        """决定输出内容的转换参数；多节点转换时随任务批次下发，各节点按同一参数输出"""
+        return {
+            'apply_watermark': self.apply_watermark,
+            'webp_profile': self.encoder.profile,
+            'webp_target_bytes': self.encoder.target_bytes,
+            'heif_max_edge': self.heif_max_edge,
+        }
+
+    def apply_conversion_settings(self, settings: dict):
+        self.apply_watermark = settings.get('apply_watermark', self.apply_watermark)
+        self.encoder = EncoderSettings(
+            settings.get('webp_profile', self.encoder.profile),
+            settings.get('webp_target_bytes', self.encoder.target_bytes),
+        )
+        self.heif_max_edge = settings.get('heif_max_edge', self.heif_max_edge)
+
+    def process_image(self, file_path, output_file, data: bytes | None = None):
+        """data 为预读的原图内容，为 None 时从磁盘读取"""
+        # 先写临时文件，编码和水印都完成后再原子替换，中途退出不会留下不完整的 WebP
+        tmp_file = _tmp_output_file(output_file, self.tmp_tag, file_path)
+        try:
+            self._convert_image(file_path, output_file, tmp_file, data)
+            if os.path.exists(tmp_file):
+                os.replace(tmp_file, output_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def _convert_image(self, file_path, output_file, target, data: bytes | None = None):
+        if data is None:
+            # 单独计时读取原图，区分 NAS/磁盘读取与解码耗时（预读的数据已在预读线程中计时）
+            with metrics.timer(stage='read'):
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+            metrics.inc('source_bytes_total', len(data))
+
         # 检查是否是 RAW 格式
         if file_path.lower().endswith(('.arw', '.cr2', '.nef', '.dng', '.raf', '.orf', '.rw2')):
             # 处理 RAW 文件
-            self._process_raw_image(file_path, output_file)
+            self._process_raw_image(file_path, output_file, data, target)
         else:
-            # 处理普通图片文件
-            with Image.open(file_path) as img:
+            # 处理普通图片文件；HEIC/HEIF 通过 pillow-heif 插件解码
+            is_heif = heif.is_heif(file_path)
+            if is_heif:
+                heif.register()
+            with Image.open(BytesIO(data)) as img:
+                with metrics.timer(stage='decode'):
+                    if is_heif:
+                        # 快速模式：输出尺寸较小时解码内嵌缩略图
+                        heif.request_size(img, self.heif_max_edge)
+                    img.load()
                 # 应用 EXIF 方向，确保竖图不被横向显示
-                try:
-                    img = ImageOps.exif_transpose(img)
-                except Exception:
-                    pass
+                with metrics.timer(stage='transpose'):
+                    try:
+                        img = ImageOps.exif_transpose(img)
+                    except Exception:
+                        pass
+                if is_heif:
+                    img = heif.fit(img, self.heif_max_edge)
                 # ImageOps.exif_transpose 已处理方向，这里不再重复旋转
+                self._record_placeholder(img, output_file)
 
                 exif_bytes = img.info.get('exif')
-                if exif_bytes:
-                    img.save(output_file, 'webp', quality=60, exif=exif_bytes)
-                else:
-                    img.save(output_file, 'webp', quality=60)
-                add_watermark(output_file, output_file)
-
-    def _process_raw_image(self, file_path, output_file):
-        """处理 RAW 格式图片，转换为 WebP 并保留 EXIF"""
+                # 水印直接叠加在解码后的图像上，只编码一次
+                if self.apply_watermark:
+                    with metrics.timer(stage='watermark'):
+                        img = watermark_image(img)
+                with metrics.timer(stage='encode'):
+                    encode_webp(img, target, self.encoder, exif_bytes)
+
+    def _process_raw_image(self, file_path, output_file, data: bytes | None = None, target: str | None = None):
+        """处理 RAW 格式图片，转换为 WebP 并保留 EXIF；target 为实际写入路径（默认即 output_file）"""
+        target = target or output_file
         try:
+            import rawpy
+
             logger.info(f"处理 RAW 文件: {file_path}")
 
             # 使用 rawpy 读取 RAW 文件
-            with rawpy.imread(file_path) as raw:
-                # 转换为 RGB 图像，使用高质量参数
-                rgb = raw.postprocess(
-                    use_camera_wb=True,  # 使用相机白平衡
-                    half_size=False,     # 不降低分辨率
-                    no_auto_bright=False, # 自动亮度
-                    output_bps=8         # 8位输出（PIL 兼容）
-                )
-
-            # 转换为 PIL Image
-            img = Image.fromarray(rgb)
-
-            # 读取原始 RAW 文件的 EXIF 信息
-            with open(file_path, 'rb') as f:
-                tags = exifread.process_file(f, details=False)
+            with metrics.timer(stage='decode'):
+                with rawpy.imread(BytesIO(data) if data is not None else file_path) as raw:
+                    # 转换为 RGB 图像，使用高质量参数
+                    rgb = raw.postprocess(
+                        use_camera_wb=True,  # 使用相机白平衡
+                        half_size=False,     # 不降低分辨率
+                        no_auto_bright=False, # 自动亮度
+                        output_bps=8         # 8位输出（PIL 兼容）
+                    )
+
+                # 转换为 PIL Image
+                img = Image.fromarray(rgb)
 
             # 应用方向信息
-            try:
-                img = ImageOps.exif_transpose(img)
-            except Exception:
-                pass
-
-            # 先保存为临时 JPEG 以便提取 EXIF
-            temp_jpg = output_file.replace('.webp', '_temp.jpg')
-            img.save(temp_jpg, 'JPEG', quality=90)
-
-            # 从临时文件读取并转换为 WebP，保留 EXIF，使用中等质量
-            with Image.open(temp_jpg) as temp_img:
-                exif_bytes = temp_img.info.get('exif')
-                if exif_bytes:
-                    temp_img.save(output_file, 'webp', quality=60, method=4, exif=exif_bytes)
-                else:
-                    temp_img.save(output_file, 'webp', quality=60, method=4)
-
-            # 删除临时文件
-            if os.path.exists(temp_jpg):
-                os.remove(temp_jpg)
+            with metrics.timer(stage='transpose'):
+                try:
+                    img = ImageOps.exif_transpose(img)
+                except Exception:
+                    pass
+            self._record_placeholder(img, output_file)
 
             # 添加水印
-            add_watermark(output_file, output_file)
+            if self.apply_watermark:
+                with metrics.timer(stage='watermark'):
+                    img = watermark_image(img)
+
+            # rawpy 输出的数组不带 EXIF，直接编码为 WebP
+            with metrics.timer(stage='encode'):
+                encode_webp(img, target, self.encoder)
 
             logger.info(f"RAW 文件处理完成: {file_path} -> {output_file}")
 
@@ -276,93 +571,119 @@ class ImageProcessor:
             try:
                 with Image.open(file_path) as img:
                     img = ImageOps.exif_transpose(img)
-                    img.save(output_file, 'webp', quality=60)
-                    add_watermark(output_file, output_file)
+                    if self.apply_watermark:
+                        img = watermark_image(img)
+                    encode_webp(img, target, self.encoder)
                     logger.info(f"使用备用方法处理成功: {file_path}")
             except Exception as e2:
                 logger.error(f"备用处理也失败，跳过此文件: {e2}")
                 # 不再抛出异常，而是跳过这个文件
                 pass
 
+    def _record_placeholder(self, img, output_file):
+        """用已解码的图像计算占位图和主色，失败不影响转换"""
+        from placeholder import compute_placeholder
+
+        key = os.path.relpath(output_file, self.output_dir).replace(os.sep, '/')
+        try:
+            with metrics.timer(stage='placeholder'):
+                self.placeholders[key] = compute_placeholder(img)
+        except Exception as e:
+            logger.warning(f"生成占位图失败 {output_file}: {e}")
+
+    def save_placeholders(self, drop: set[str] | None = None):
+        """把占位图字段合并进 EXIF 记录并重新导出 exif_data.json；drop 中的记录（本次被隔离的图片）一并删除"""
+        if not self.placeholders and not drop:
+            return
+        if not os.path.exists(self.exif_db_path):
+            logger.warning("EXIF 存储不存在，跳过写入占位图（请先运行 exif 阶段）")
+            return
+        json_file_path = os.path.join(self.output_dir, 'exif_data.json')
+        with ExifStore(self.exif_db_path) as store:
+            for key, fields in self.placeholders.items():
+                record = store.get(key)
+                if record is None:
+                    continue
+                record.update(fields)
+                store.upsert(key, record)
+            for key in drop or ():
+                store.delete(key)
+            store.commit()
+            store.export_json(json_file_path)
+        logger.info(f"占位图已写入 {len(self.placeholders)} 条 EXIF 记录")
+
     def save_exif_to_json(self):
-        exif_data_dict = {}
+        # EXIF 直接写入带索引的 SQLite 存储，exif_data.json 由存储流式导出
+        import exifread
+
         seen_keys = set()
-        for scan_root in self.scan_roots:
-            for root, dirnames, files in os.walk(scan_root):
-                # 跳过系统/隐藏目录，避免扫描照片库内部数据库和缓存
-                dirnames[:] = [d for d in dirnames if not d.startswith('.') and d.lower() not in {
-                    'resources', 'private', 'database', 'caches', 'cache', 'thumbs', 'thumbnails', 'previews'
-                }]
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if '_thumbnail' in file_path.lower():
+        resumed = 0
+        json_file_path = os.path.join(self.output_dir, 'exif_data.json')
+        with ExifStore(self.exif_db_path) as store:
+            # --resume 时输出目录（含 EXIF 存储）被保留：已解析且源文件未变化的图片沿用已有记录，
+            # 结束后只删除本次不再存在的 key，不再整表清空
+            existing_keys = store.keys()
+            for file_path, root in self.images():
+                try:
+                    relative_path = os.path.relpath(file_path, self.directory_path)
+                    album_id = self._infer_album_id(relative_path, file_path)
+                    # 使用 .webp 扩展名作为键，因为上传的文件是 webp 格式
+                    base_name = os.path.basename(file_path)
+                    name_without_ext = os.path.splitext(base_name)[0]
+                    image_key = f"{album_id}/{name_without_ext}.webp"
+                    if image_key in seen_keys:
+                        logger.warning(f"重复的图片键，跳过: {image_key} ({file_path})")
                         continue
-                    if self._is_image_file(file):
-                        try:
+                    sig = file_signature(file_path) if self.journal else None
+                    if sig and image_key in existing_keys and self.journal.get('exif', image_key, sig):
+                        seen_keys.add(image_key)
+                        resumed += 1
+                        continue
+                    with metrics.timer(stage='exif_parse'):
+                        if heif.is_heif(file_path):
+                            # exifread 不能可靠地解析 HEIC 容器，由 pillow-heif 取出 EXIF 后按 TIFF 解析
+                            tiff = heif.read_exif(file_path)
+                            tags = exifread.process_file(BytesIO(tiff)) if tiff else {}
+                        else:
                             with open(file_path, 'rb') as img:
                                 tags = exifread.process_file(img)
-                                readable_exif = convert_exif_to_dict(tags)
-                                relative_path = os.path.relpath(file_path, self.directory_path)
-                                album_id = self._infer_album_id(relative_path, file_path)
-                                # 使用 .webp 扩展名作为键，因为上传的文件是 webp 格式
-                                base_name = os.path.basename(file_path)
-                                name_without_ext = os.path.splitext(base_name)[0]
-                                image_key = f"{album_id}/{name_without_ext}.webp"
-                                exif_data_dict[image_key] = readable_exif
-                                seen_keys.add(image_key)
-                                logger.info(f"处理 {file_path} EXIF信息成功")
-                        except Exception as e:
-                            print(f"无法处理文件 {file_path}: {e}")
-
-        # 保险起见再过滤一次缩略图
-        exif_data_dict = {k: v for k, v in exif_data_dict.items() if '_thumbnail' not in k.lower()}
-
-        json_file_path = os.path.join(self.output_dir, 'exif_data.json')
-        with open(json_file_path, 'w', encoding='utf-8') as json_file:
-            json.dump(exif_data_dict, json_file, ensure_ascii=False, indent=4)
-            print("JSON 文件已保存。")
+                        readable_exif = convert_exif_to_dict(tags)
+                    store.upsert(image_key, readable_exif)
+                    seen_keys.add(image_key)
+                    if sig:
+                        self.journal.record('exif', image_key, sig=sig)
+                    logger.info(f"处理 {file_path} EXIF信息成功")
+                except Exception as e:
+                    print(f"无法处理文件 {file_path}: {e}")
+            for key in existing_keys - seen_keys:
+                store.delete(key)
+            store.commit()
+            store.export_json(json_file_path)
+        if resumed:
+            print(f"沿用上次解析的 EXIF {resumed} 条")
+        print("JSON 文件已保存。")
         total_images = len(seen_keys)
         self.total_images = total_images
         self._log_progress(f"发现图片数量 {total_images}", 10)
 
-    @staticmethod
-    def _is_image_file(filename: str) -> bool:
-        if filename.startswith('.'):
-            return False
-        lower = filename.lower()
-        if '_thumbnail' in lower or lower.endswith('_thumbnail.png') or lower.endswith('_thumbnail.jpg') or lower.endswith('_thumbnail.jpeg'):
-            return False
-        # 支持常见图片格式和 RAW 格式
-        return lower.endswith(('.png', '.jpg', '.jpeg', '.heic', '.heif', '.tif', '.tiff', '.arw', '.cr2', '.nef', '.dng', '.raf', '.orf', '.rw2'))
-
     def _infer_album_id(self, relative_path: str, file_path: str | None = None) -> str:
         # 优先使用图库的 metadata.json 中的文件夹映射
         dir_path = os.path.dirname(file_path) if file_path else ''
         dir_meta = self._load_dir_metadata(dir_path) if dir_path else None
 
         # 构建完整的相册路径（支持嵌套）
-        album_path_parts = []
+        album_name = None
 
         if dir_meta:
             folder_ids = dir_meta.get('folders') or []
             if isinstance(folder_ids, list) and folder_ids:
-                # 获取当前文件夹的名称
                 for folder_id in folder_ids:
-                    folder_name = self.folder_name_map.get(folder_id)
-                    if folder_name:
-                        # 查找父文件夹
-                        parent_names = self._get_parent_folder_names(folder_id)
-                        if parent_names:
-                            album_path_parts = parent_names + [folder_name]
-                        else:
-                            album_path_parts = [folder_name]
+                    album_name = self.folder_path_map.get(folder_id)
+                    if album_name:
                         break
 
-        # 如果通过 metadata 找到了完整路径，使用它
-        if album_path_parts:
-            album_name = '/'.join(album_path_parts)
-        else:
-            # 回退到路径推断
+        # 如果通过 metadata 没有找到路径，回退到路径推断
+        if not album_name:
             parts = relative_path.replace('\\', '/').split('/')
             if len(parts) >= 2 and parts[0] == 'images':
                 album_name = parts[1]
@@ -382,44 +703,126 @@ class ImageProcessor:
 
         return album_name
 
-    def _get_parent_folder_names(self, folder_id: str) -> list:
-        """递归获取父文件夹名称列表"""
-        parent_names = []
-
-        # 在根 metadata.json 中查找文件夹层级关系
-        root_metadata_path = os.path.join(self.directory_path, 'metadata.json')
-        if not os.path.exists(root_metadata_path):
-            return parent_names
+    def _log_progress(self, message: str, progress: float | None = None):
+        log_update_sqlite('upload', 'info', message, progress)
 
-        try:
-            with open(root_metadata_path, 'r', encoding='utf-8') as f:
-                root_meta = json.load(f)
-                folders = root_meta.get('folders', [])
-
-                # 递归查找父文件夹
-                def find_parent_path(folders_list, target_id, current_path=[]):
-                    for folder in folders_list:
-                        if folder.get('id') == target_id:
-                            return current_path
-
-                        # 检查子文件夹
-                        children = folder.get('children', [])
-                        if children:
-                            result = find_parent_path(children, target_id, current_path + [folder.get('name')])
-                            if result is not None:
-                                return result
-                    return None
-
-                parent_names = find_parent_path(folders, folder_id) or []
-        except Exception as e:
-            logger.warning(f"读取根 metadata.json 失败: {e}")
 
-        return parent_names
 
-    def _log_progress(self, message: str, progress: float | None = None):
-        log_update_sqlite('upload', 'info', message, progress)
 
+def _parse_exif_time(value: str | None) -> float | None:
+    """EXIF 时间（YYYY:MM:DD HH:MM:SS）转为时间戳"""
+    if not value:
+        return None
+    try:
+        return time.mktime(time.strptime(value[:19], '%Y:%m:%d %H:%M:%S'))
+    except (ValueError, OverflowError):
+        return None
+
+
+def _tmp_output_file(output_file: str, tmp_tag: str, file_path: str) -> str:
+    """临时输出文件名带上节点标记和源文件名，不同节点、不同源文件各写各的临时文件"""
+    return f"{output_file}.{tmp_tag}.{os.path.basename(file_path)}.tmp"
+
+
+def _image_converter(directory_path, output_dir, settings: dict, tmp_tag=None):
+    """在转换子进程中构造一次 ImageProcessor，返回逐个文件的转换函数（结果为占位图字段）
+
+    settings 为 ImageProcessor.conversion_settings()；tmp_tag 为临时输出文件的后缀，
+    由父进程给定，子进程被终止后父进程据此清理残留的临时文件
+    """
+    processor = ImageProcessor(directory_path, output_dir=output_dir, clean_output=False, tmp_tag=tmp_tag)
+    processor.apply_conversion_settings(settings)
+
+    def convert(file_path, output_file, data=None):
+        logger.info(f"开始处理图片: {os.path.basename(file_path)}")
+        processor.process_image(file_path, output_file, data)
+        key = os.path.relpath(output_file, output_dir).replace(os.sep, '/')
+        return processor.placeholders.pop(key, None)
+
+    return convert
+
+
+def _convert_budget() -> int:
+    """并发解码可用的内存预算：总预算扣除预读缓冲"""
+    return max(1, default_budget() - reserved_bytes())
+
+
+def work_from_queue(queue: WorkQueue, directory_path: str, output_dir: str, until=None, poll: float = 2.0) -> int:
+    """从共享队列领取转换任务并处理，返回本节点完成的任务数
+
+    until() 在每批任务之后和空闲时调用，返回 True 且队列中暂无可领取的任务时退出；为 None 时一直运行
+    """
+    worker_id = default_worker_id()
+    budget = FileBudget.from_env()
+    batch = int(os.getenv('QUEUE_BATCH') or 2 * (default_workers() if budget.isolate else 1))
+    # 转换参数随任务批次下发：每批领取时比较，协调端换了设置就按新设置重建转换进程
+    settings = None
+    scheduler = convert = None
+    keeper = LeaseKeeper(queue, worker_id)
+    completed = 0
+    logger.info(f"队列 worker {worker_id} 开始领取任务：{queue.path}")
+
+    def finish(task, placeholder, error):
+        nonlocal completed
+        keeper.release(task.id)
+        if error is None:
+            if queue.complete(worker_id, task.id, placeholder):
+                completed += 1
+        elif isinstance(error, BudgetExceeded):
+            # 子进程被终止时留下的临时文件只有本节点知道名字，由本节点清理
+            leftover = _tmp_output_file(os.path.join(output_dir, task.key), worker_id, task.source)
+            if os.path.exists(leftover):
+                os.remove(leftover)
+            queue.fail(worker_id, task.id, error.reason, error.detail)
+        else:
+            logger.error(f"处理图片失败 {task.source}: {error}")
+            queue.fail(worker_id, task.id, 'error', str(error))
 
+    try:
+        while True:
+            tasks, job_settings = queue.claim(worker_id, batch)
+            if not tasks:
+                if until is not None and until():
+                    break
+                time.sleep(poll)
+                continue
+            keeper.hold(task.id for task in tasks)
+            if job_settings != settings:
+                settings = job_settings
+                if scheduler:
+                    scheduler.close()
+                factory_args = (directory_path, output_dir, settings, worker_id)
+                if budget.isolate:
+                    scheduler = AdmissionScheduler(_image_converter, factory_args, budget,
+                                                   memory_budget=_convert_budget())
+                else:
+                    convert = _image_converter(*factory_args)
+            for task in tasks:
+                os.makedirs(os.path.dirname(os.path.join(output_dir, task.key)), exist_ok=True)
+            by_args = {
+                (os.path.join(directory_path, task.source), os.path.join(output_dir, task.key)): task
+                for task in tasks
+            }
+            with Prefetcher([args[0] for args in by_args]) as prefetcher:
+                if scheduler:
+                    scheduler.run([(task.cost, args) for args, task in by_args.items()],
+                                  lambda args, result, error: finish(by_args[args], result, error),
+                                  prepare=lambda args: args + (prefetcher.take(args[0]),))
+                else:
+                    for args, task in by_args.items():
+                        try:
+                            finish(task, convert(*args, prefetcher.take(args[0])), None)
+                        except Exception as e:
+                            finish(task, None, e)
+            if until is not None:
+                until()
+    finally:
+        keeper.close()
+        if scheduler:
+            scheduler.close()
+        queue.close()
+    logger.info(f"队列 worker {worker_id} 退出，本节点完成 {completed} 个任务")
+    return completed
 
 
 def convert_exif_to_dict(exif_data):   
@@ -482,13 +885,32 @@ def convert_exif_to_dict(exif_data):
     else:
         exif_dict["DateTime"] = "未知"  # 添加默认值
     
-    # print(exif_dict)
-    address = parse_location_rg(exif_data=exif_dict)
-    if address == "未知":
-        address = parse_location_gaode(exif_data=exif_dict)
+    # 没有经纬度时不做逆地理编码；GEOCODE=0 可关闭逆地理编码（离线运行/基准测试）
+    address = "未知"
+    if exif_dict["Latitude"] is not None and exif_dict["Longitude"] is not None and os.getenv('GEOCODE', '1') != '0':
+        address = reverse_geocode(exif_dict)
       
     exif_dict["Location"] = address
     return exif_dict
+
+
+# 逆地理编码缓存：坐标保留 3 位小数（约 100 米），同一地点连拍只请求一次
+_geocode_cache: dict[tuple[float, float], str] = {}
+
+
+def reverse_geocode(exif_data):
+    cache_key = (round(exif_data["Latitude"], 3), round(exif_data["Longitude"], 3))
+    cached = _geocode_cache.get(cache_key)
+    if cached is not None:
+        metrics.inc('geocode_requests_total', result='hit')
+        return cached
+    metrics.inc('geocode_requests_total', result='miss')
+    with metrics.timer(stage='geocode'):
+        address = parse_location_rg(exif_data=exif_data)
+        if address == "未知":
+            address = parse_location_gaode(exif_data=exif_data)
+    _geocode_cache[cache_key] = address
+    return address
            
 
 def parse_location_gaode(exif_data):
@@ -544,122 +966,183 @@ def parse_location_rg(exif_data):
         return "未知"
     
 
+_watermark_cache: dict[tuple[str, float], Image.Image] = {}
+
+
+def _load_watermark(watermark_path: str, opacity: float) -> Image.Image:
+    """读取水印并设置不透明度，同一进程内只处理一次"""
+    cache_key = (watermark_path, opacity)
+    watermark = _watermark_cache.get(cache_key)
+    if watermark is None:
+        with Image.open(watermark_path) as source:
+            watermark = source.convert("RGBA")
+        alpha = watermark.split()[3]
+        alpha = alpha.point(lambda p: p * opacity)  # 设置不透明度
+        watermark.putalpha(alpha)
+        _watermark_cache[cache_key] = watermark
+    return watermark
+
+
+def watermark_image(img: Image.Image, watermark_path='sy.png', opacity=0.8) -> Image.Image:
+    """在图像左下角叠加水印，返回叠加后的图像（RGB / RGBA）"""
+    if not os.path.isabs(watermark_path):
+        watermark_path = os.path.join(os.path.dirname(__file__), watermark_path)
+    watermark = _load_watermark(watermark_path, opacity)
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+    # 计算水印的位置（左下角）
+    position = (15, img.height - watermark.height - 20)
+    img.paste(watermark, position, watermark)
+    return img
+
+
 def add_watermark(input_image_path, output_image_path, watermark_path='sy.png', opacity=0.8):
-    # 打开输入图片和水印图片
+    """给已生成的图片文件加水印；WebP 按当前编码档位重新编码"""
     with Image.open(input_image_path) as base_image:
         # 读取EXIF信息
         exif_data = base_image.info.get('exif')
-        if not os.path.isabs(watermark_path):
-            watermark_path = os.path.join(os.path.dirname(__file__), watermark_path)
-        with Image.open(watermark_path) as watermark:
-            watermark = watermark.convert("RGBA")
-            alpha = watermark.split()[3]
-            alpha = alpha.point(lambda p: p * opacity)  # 设置不透明度
-            watermark.putalpha(alpha)
-            # 获取水印的尺寸
-            watermark_width, watermark_height = watermark.size
-            # watermark = watermark.resize((int(watermark_width*1.3), int(watermark_height*1.3)), Image.ANTIALIAS)
-            
-            # 计算水印的位置（左下角）
-            position = (15, base_image.height - watermark_height-20)
-            
-            # 创建一个可以在上面绘制的图像
-            base_image.paste(watermark, position, watermark)
-            
-            # 保存叠加后的图片
-            if exif_data:
-                base_image.save(output_image_path, exif=exif_data)
-            else:
-                base_image.save(output_image_path)
-            
+        image_format = base_image.format
+        base_image.load()
+        img = watermark_image(base_image, watermark_path, opacity)
+    # 显式指定格式，输出路径可以是 .tmp 临时文件
+    if image_format == 'WEBP':
+        encode_webp(img, output_image_path, exif=exif_data)
+    elif exif_data:
+        img.save(output_image_path, format=image_format, exif=exif_data)
+    else:
+        img.save(output_image_path, format=image_format)
+
             
 
-def upload_folder_to_qiniu(src_folder, bucket_name, access_key, secret_key, domain, prefix="gallery/", full_upload: bool = False, sync_delete: bool = True):
-    log_update_sqlite('upload', 'info', '开始上传到七牛', 90)
-    configure_qiniu_region()
-    q = Auth(access_key, secret_key)
+def is_upload_file(filename: str) -> bool:
+    return filename.endswith(UPLOAD_SUFFIXES)
+
+
+def upload_folder(src_folder, backend: StorageBackend, prefix="gallery/", full_upload: bool = False, sync_delete: bool = True,
+                  workers: int | None = None, journal: JobJournal | None = None, report_progress: bool = True):
+    """report_progress 为 False 时（分相册发布）不更新前端的上传进度"""
+    if report_progress:
+        log_update_sqlite('upload', 'info', '开始上传', 90)
+    workers = workers or int(os.getenv('UPLOAD_CONCURRENCY', '4'))
     uploaded = 0
     failed = 0
     skipped = 0
     deleted = 0
     existing_keys = set()
-    local_files = set()
+    local_files = {}
 
-    # 收集本地所有文件
+    # 收集本地所有文件（_meta 下的元数据分片由 publish_metadata 单独上传）
     for root, dirs, files in os.walk(src_folder):
+        dirs[:] = [d for d in dirs if d != META_DIR_NAME]
         for file in files:
-            if file.endswith('.webp') or file.endswith('.json'):
-                rel_path = os.path.relpath(os.path.join(root, file), src_folder)
+            if is_upload_file(file):
+                local_path = os.path.join(root, file)
+                rel_path = os.path.relpath(local_path, src_folder)
                 # 转换为云端路径格式
                 cloud_key = prefix + rel_path.replace('\\', '/')
-                local_files.add(cloud_key)
+                local_files[cloud_key] = local_path
 
-    # 清理七牛上历史缩略图，并收集现有文件
+    # 分页列举云端文件，收集现有文件和需要清理的文件（历史缩略图、本地已不存在的文件）
+    to_delete = []
     try:
-        from qiniu import BucketManager
-        bm = BucketManager(q)
-        marker = None
-        eof = False
-        while not eof:
-            ret, eof, _ = bm.list(bucket_name, prefix=prefix, marker=marker, limit=1000)
-            items = ret.get('items') or []
-            for item in items:
-                key = item.get('key') or ''
-                if '_thumbnail' in key:
-                    try:
-                        bm.delete(bucket_name, key)
-                        deleted += 1
-                    except Exception:
-                        pass
-                elif key:
-                    existing_keys.add(key)
-                    # 如果启用删除同步，且云端文件不在本地文件列表中，则删除
-                    if sync_delete and key not in local_files and not key.endswith('exif_data.json'):
-                        try:
-                            bm.delete(bucket_name, key)
-                            deleted += 1
-                            print(f"删除云端文件: {key}")
-                        except Exception as e:
-                            print(f"删除失败 {key}: {e}")
-            marker = ret.get('marker')
+        for item in backend.iter_items(prefix):
+            key = item.get('key') or ''
+            if '_thumbnail' in key:
+                to_delete.append(key)
+            elif key:
+                existing_keys.add(key)
+                # 如果启用删除同步，且云端文件不在本地文件列表中，则删除
+                if sync_delete and key not in local_files and not key.endswith('exif_data.json'):
+                    to_delete.append(key)
     except Exception as e:
         print(f"列举文件失败: {e}")
 
-    for root, _, files in os.walk(src_folder):
-        for filename in files:
-            local_path = os.path.join(root, filename)
-            rel_path = os.path.relpath(local_path, src_folder).replace(os.sep, "/")
-            if '_thumbnail' in rel_path:
-                skipped += 1
-                continue
-            key = f"{prefix}{rel_path}"
-            if not full_upload and key in existing_keys:
+    if journal:
+        to_delete = [key for key in to_delete if not journal.get('deleted', key)]
+    if to_delete:
+        try:
+            deleted = backend.delete_many(to_delete)
+            for key in to_delete:
+                print(f"删除云端文件: {key}")
+                if journal:
+                    journal.record('deleted', key)
+        except Exception as e:
+            print(f"批量删除失败: {e}")
+
+    pending = []
+    # 上传前记下签名，上传过程中文件被替换（如 exif_data.json 重新导出）时不会误记为已上传
+    signatures = {}
+    for key, local_path in sorted(local_files.items()):
+        # exif_data.json 每次运行都会重新导出，增量模式下也要上传
+        if not full_upload and key in existing_keys and not key.endswith('exif_data.json'):
+            skipped += 1
+            continue
+        if journal:
+            signatures[key] = file_signature(local_path)
+            # 断点续跑：本次任务中已上传且本地文件未变化的不再上传
+            if journal.get('uploaded', key, signatures[key]):
                 skipped += 1
                 continue
-            token = q.upload_token(bucket_name, key)
+        pending.append((key, local_path))
 
-            mime_type, _ = mimetypes.guess_type(local_path)
-            ret, info = put_file(token, key, local_path, mime_type=mime_type)
-            if info.status_code == 200:
-                uploaded += 1
-            else:
-                failed += 1
-                print(f"上传失败: {local_path} -> {key} ({info})")
+    def on_done(key, local_path, error):
+        if error is None and journal:
+            journal.record('uploaded', key, sig=signatures[key])
+
+    # 并发上传
+    failures = backend.put_files(pending, workers=workers, on_done=on_done)
+    for key, local_path, error in failures:
+        print(f"上传失败: {local_path} -> {key} ({error})")
+    failed = len(failures)
+    uploaded = len(pending) - failed
 
     mode_label = '全量' if full_upload else '增量'
     print(f"上传完成（{mode_label}）：成功 {uploaded} 个，失败 {failed} 个，跳过 {skipped} 个，删除 {deleted} 个")
-    if failed == 0 and domain:
+    if not report_progress:
+        return
+    if failed == 0:
         log_update_sqlite('upload', 'success', f"上传完成（{mode_label}）：成功 {uploaded} 个，跳过 {skipped} 个，删除 {deleted} 个", 100)
-        print(f"示例访问地址: https://{domain}/{prefix}")
-    elif failed > 0:
+        print(f"示例访问地址: {backend.public_url(prefix)}")
+    else:
         log_update_sqlite('upload', 'error', f"上传完成（{mode_label}）：成功 {uploaded} 个，失败 {failed} 个，跳过 {skipped} 个，删除 {deleted} 个", 100)
+
+
+def publish_metadata(output_dir: str, backend: StorageBackend, albums=None, base_index: dict | None = None):
+    """从 EXIF 存储生成按相册分片、预压缩的元数据并上传，消费方按索引只下载变化的相册
+
+    albums 为已发布的相册时（分相册发布）只更新这些相册的分片，其余相册保持 base_index 中的条目
+    """
+    db_path = os.path.join(output_dir, 'exif_data.db')
+    if not os.path.exists(db_path):
+        return
+    shard_dir = os.path.join(output_dir, META_DIR_NAME, 'exif')
+    try:
+        with ExifStore(db_path, readonly=True) as store:
+            index = build_shards(store, shard_dir, only=albums, base=base_index)
+        uploaded = publish_shards(backend, shard_dir, index)
+        print(f"元数据分片已发布：{len(index['albums'])} 个相册，新上传 {uploaded} 个分片")
+    except Exception as e:
+        print(f"发布元数据分片失败: {e}")
+
+
+def upload_folder_to_qiniu(src_folder, bucket_name, access_key, secret_key, domain, prefix="gallery/", full_upload: bool = False, sync_delete: bool = True):
+    configure_qiniu_region()
+    backend = QiniuStorage(access_key, secret_key, bucket_name, domain)
+    upload_folder(src_folder, backend, prefix=prefix, full_upload=full_upload, sync_delete=sync_delete)
               
             
-def send_webhook():
+def send_webhook(albums: list[str] | None = None):
+    """albums 不为空时表示分相册发布的部分更新，随请求带上已发布的相册"""
     import requests
     webhook_url = os.getenv('WEBHOOK_URL')  # 替换为您的前端应用地址
+    if not webhook_url:
+        print("未配置 WEBHOOK_URL，跳过 webhook 请求。")
+        return
     try:
-        response = requests.post(webhook_url)
+        if albums:
+            response = requests.post(webhook_url, json={'partial': True, 'albums': albums}, timeout=60)
+        else:
+            response = requests.post(webhook_url)
         if response.status_code == 200:
             print("Webhook 请求成功，前端应用已更新。")
         else:
@@ -670,6 +1153,8 @@ def send_webhook():
 
 def configure_qiniu_region():
     # 支持通过环境变量配置七牛上传区域/域名，默认华南(广东)
+    if (os.getenv('STORAGE_BACKEND') or 'qiniu').lower() != 'qiniu':
+        return
     region = (os.getenv('QINIU_REGION') or '').lower()
     up_host = os.getenv('QINIU_UP_HOST') or ''
     up_host_backup = os.getenv('QINIU_UP_HOST_BACKUP') or ''
@@ -677,84 +1162,271 @@ def configure_qiniu_region():
         up_host = 'https://up-z2.qbox.me'
         up_host_backup = 'https://upload-z2.qbox.me'
     if up_host:
+        from qiniu import Region
+        import qiniu.config as qiniu_config
+
         qiniu_config.set_default(default_zone=Region(up_host, up_host_backup or None))
 
 
-if __name__ == '__main__':
-    directory_to_process = os.getenv('watch_dir') or ''
-    run_once = os.getenv('RUN_ONCE') == '1'
-    if len(os.sys.argv) > 1 and os.sys.argv[1].strip():
-        directory_to_process = os.sys.argv[1].strip()
-        run_once = True
+def sync_local():
+    """把前端记录的删除、移动同步到本地图库（移动同时在存储上做服务端移动）"""
+    # 移动同步会在存储上做服务端移动并改写 exif_data.json，需先配置上传区域
+    configure_qiniu_region()
 
-    if not directory_to_process:
-        print("缺少目录路径：请设置 watch_dir 或传入目录参数")
-        os.sys.exit(1)
+    # 在处理前先删除本地已在云端删除的文件
+    try:
+        from delete_local_files import delete_local_files
+        print("开始同步删除本地文件...")
+        delete_local_files()
+    except Exception as e:
+        print(f"本地文件删除同步失败: {e}")
 
-    def run_job():
-        print(f"开始处理目录: {directory_to_process}")
+    # 在处理前先移动本地文件到新相册
+    try:
+        from move_local_files import move_local_files
+        print("开始同步移动本地文件...")
+        move_local_files()
+    except Exception as e:
+        print(f"本地文件移动同步失败: {e}")
 
-        # 在处理前先删除本地已在云端删除的文件
-        try:
-            import sys
-            sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
-            from delete_local_files import delete_local_files
-            print("开始同步删除本地文件...")
-            delete_local_files()
-        except Exception as e:
-            print(f"本地文件删除同步失败: {e}")
 
-        # 在处理前先移动本地文件到新相册
+def upload_output(output_dir: str = DEFAULT_OUTPUT_DIR, full_upload: bool = False, webhook: bool = True,
+                  journal: JobJournal | None = None):
+    configure_qiniu_region()
+    # STORAGE_BACKEND=local 时上传到本地目录，默认上传到七牛
+    # 列举走本地快照，全量上传时顺带与存储完整对账
+    backend = SnapshotBackend(storage_from_env(), refresh=full_upload or None)
+    upload_folder(
+        src_folder=output_dir,
+        backend=backend,
+        prefix='gallery/',
+        full_upload=full_upload,
+        journal=journal,
+    )
+    publish_metadata(output_dir, backend)
+    try:
+        backend.publish()
+    except Exception as e:
+        print(f"发布列举快照失败: {e}")
+    if webhook:
+        send_webhook()
+
+
+class AlbumPublisher:
+    """相册转换完成后立即上传该相册、发布列举快照并触发部分 webhook
+
+    在后台单线程中依次进行，不阻塞转换；一次发布进行中又完成的相册合并到下一次发布
+    """
+
+    def __init__(self, output_dir: str, full_upload: bool = False, journal: JobJournal | None = None,
+                 webhook: bool = True):
+        self.output_dir = output_dir
+        self.full_upload = full_upload
+        self.journal = journal
+        self.webhook = webhook
+        self.backend: SnapshotBackend | None = None
+        self.published: list[str] = []
+        self._pending: list[str] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        # 本次运行开始前存储中的分片索引，未发布的相册沿用其中的条目
+        self._base_index: dict | None = None
+
+    def __call__(self, album: str):
+        with self._lock:
+            self._pending.append(album)
+        self._executor.submit(self._publish)
+
+    def _publish(self):
+        with self._lock:
+            albums, self._pending = self._pending, []
+        if not albums:
+            # 已合并进前一次发布
+            return
         try:
-            import sys
-            sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
-            from move_local_files import move_local_files
-            print("开始同步移动本地文件...")
-            move_local_files()
+            if self.backend is None:
+                configure_qiniu_region()
+                self.backend = SnapshotBackend(storage_from_env())
+            for album in albums:
+                upload_folder(
+                    src_folder=os.path.join(self.output_dir, album),
+                    backend=self.backend,
+                    prefix=f"gallery/{album}/",
+                    full_upload=self.full_upload,
+                    sync_delete=False,
+                    journal=self.journal,
+                    report_progress=False,
+                )
+            # 转换前导出的 exif_data.json 含全部图片（包括还没上传的相册），只在最终上传时发布；
+            # 这里只把已发布相册的 EXIF 分片加入索引，占位图同样在最终上传时补上
+            if self._base_index is None:
+                self._base_index = load_remote_index(self.backend) or {}
+            publish_metadata(self.output_dir, self.backend, albums=self.published + albums, base_index=self._base_index)
+            self.backend.publish()
         except Exception as e:
-            print(f"本地文件移动同步失败: {e}")
+            print(f"分相册发布失败 {albums}: {e}")
+            return
+        self.published.extend(albums)
+        logger.info(f"已发布相册: {', '.join(albums)}")
+        if self.webhook:
+            send_webhook(albums)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def _cpu_seconds() -> float:
+    # 包含已回收的转换子进程的 CPU 时间
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def run_job(directory_to_process: str, full_upload: bool = False, resume: bool = False, queue: str | None = None):
+    print(f"开始处理目录: {directory_to_process}")
+    metrics.reset()
+    started_at = time.time()
+    cpu_started = _cpu_seconds()
+
+    sync_local()
+
+    # loguru 日志文件（写入项目内 output，避免库目录权限问题）
+    safe_log_dir = DEFAULT_OUTPUT_DIR
+    os.makedirs(safe_log_dir, exist_ok=True)
+    running_log_path = os.path.join(safe_log_dir, 'running_log.txt')
+    logger.add(running_log_path, level='INFO')
+
+    # 任务日志：resume 且上次未完成时保留输出目录，跳过已转换、已上传的文件
+    journal = JobJournal(os.path.join(safe_log_dir, JOURNAL_NAME))
+    resuming = journal.open(resume)
+    if resuming:
+        print(f"从上次中断处继续：已转换 {journal.count('converted')} 张，已上传 {journal.count('uploaded')} 个")
+
+    # 分相册发布：相册一转换完就上传并触发部分 webhook，新相册不必等整次运行结束
+    publisher = AlbumPublisher(DEFAULT_OUTPUT_DIR, full_upload, journal) if os.getenv('ALBUM_CHECKPOINTS', '1') != '0' else None
+    processor = ImageProcessor(directory_to_process, clean_output=not resuming, journal=journal,
+                               on_album_done=publisher, work_queue=WorkQueue(queue) if queue else None)
+    try:
+        processor.process_images()
+    finally:
+        if publisher:
+            publisher.close()
+
+    # 删除 running_log 日志 表示图片处理完（若已不存在或无权限则忽略）
+    try:
+        os.remove(running_log_path)
+    except Exception:
+        pass
+    upload_output(processor.output_dir, full_upload=full_upload, journal=journal)
+    journal.finish()
 
-        full_upload = os.getenv('FULL_UPLOAD') == '1'
-        # loguru 日志文件（写入项目内 output，避免库目录权限问题）
-        safe_log_dir = os.path.join(os.path.dirname(__file__), 'output')
-        os.makedirs(safe_log_dir, exist_ok=True)
-        running_log_path = os.path.join(safe_log_dir, 'running_log.txt')
-        logger.add(running_log_path, level='INFO')
+    # 写出本次运行的计时汇总，server.py 的 /metrics 读取它
+    summary = build_run_summary(metrics, started_at, time.time(), _cpu_seconds() - cpu_started)
+    try:
+        summary_file = write_run_summary(summary)
+        print(f"运行指标已写入: {summary_file}（瓶颈: {summary['bound_by']}）")
+    except Exception as e:
+        print(f"写入运行指标失败: {e}")
 
-        processor = ImageProcessor(directory_to_process)
-        processor.process_images()
 
-        # 删除 running_log 日志 表示图片处理完（若已不存在或无权限则忽略）
+def watch(directory_to_process: str, full_upload: bool = False, resume: bool = False, queue: str | None = None):
+    """轮询目录，出现 run.txt 时执行一次完整流程"""
+    while True:
         try:
-            os.remove(running_log_path)
+            if 'run.txt' in os.listdir(directory_to_process):
+                run_job(directory_to_process, full_upload, resume, queue)
+                # 删除 run.txt 表示上传完（若已不存在或无权限则忽略）
+                try:
+                    os.remove(os.path.join(directory_to_process, 'run.txt'))
+                except Exception:
+                    pass
+                break
         except Exception:
             pass
-        upload_folder_to_qiniu(
-            src_folder=processor.output_dir,
-            bucket_name=os.getenv('QINIU_BUCKET'),
-            access_key=os.getenv('QINIU_ACCESS_KEY'),
-            secret_key=os.getenv('QINIU_SECRET_KEY'),
-            domain=os.getenv('QINIU_DOMAIN'),
-            prefix='gallery/',
-            full_upload=full_upload,
-        )
-        send_webhook()
+        time.sleep(1)
+        print('.', end='', flush=True)
+
+
+COMMANDS = ('run', 'watch', 'scan', 'exif', 'convert', 'upload', 'sync-local', 'worker')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description='图片处理与上传；不带子命令时兼容旧用法：upload_oss.py [目录]（未传目录时按 watch_dir 轮询 run.txt）',
+    )
+    sub = parser.add_subparsers(dest='command')
+
+    def add(name, help_text, directory=True):
+        cmd = sub.add_parser(name, help=help_text)
+        if directory:
+            cmd.add_argument('directory', nargs='?', default=os.getenv('watch_dir') or '', help='图库目录（默认 watch_dir）')
+        cmd.add_argument('--output', default=DEFAULT_OUTPUT_DIR, help='输出目录')
+        return cmd
+
+    run = add('run', '完整流程：本地同步、EXIF、转换、上传')
+    run.add_argument('--full', action='store_true', help='全量上传')
+    run.add_argument('--resume', action='store_true', help='从上次中断的任务继续')
+    run.add_argument('--queue', default=queue_path(), help='共享任务队列文件，转换任务分发给多个节点（默认 WORK_QUEUE）')
+    watch_cmd = add('watch', '轮询 run.txt，出现时执行完整流程')
+    watch_cmd.add_argument('--full', action='store_true', help='全量上传')
+    watch_cmd.add_argument('--resume', action='store_true', help='从上次中断的任务继续')
+    watch_cmd.add_argument('--queue', default=queue_path(), help='共享任务队列文件（默认 WORK_QUEUE）')
+    add('scan', '只扫描并去重，输出统计')
+    add('exif', '只解析 EXIF，写入 EXIF 存储与 exif_data.json')
+    convert = add('convert', '只转换图片（占位图写入已有的 EXIF 存储）')
+    convert.add_argument('--queue', default=queue_path(), help='共享任务队列文件（默认 WORK_QUEUE）')
+    worker = add('worker', '从共享队列领取转换任务，输出写入共享的输出目录')
+    worker.add_argument('--queue', default=queue_path(), help='共享任务队列文件（默认 WORK_QUEUE）')
+    worker.add_argument('--once', action='store_true', help='队列中没有待处理的任务时退出（默认一直等待新任务）')
+    upload = add('upload', '只上传输出目录', directory=False)
+    upload.add_argument('--full', action='store_true', help='全量上传')
+    upload.add_argument('--no-webhook', action='store_true', help='上传后不触发 webhook')
+    add('sync-local', '只把前端记录的删除、移动同步到本地图库', directory=False)
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # 兼容旧用法：第一个参数是目录而不是子命令
+    if not argv or argv[0] not in COMMANDS and not argv[0].startswith('-'):
+        directory = argv[0].strip() if argv and argv[0].strip() else ''
+        run_once = os.getenv('RUN_ONCE') == '1' or bool(directory)
+        argv = ['run' if run_once else 'watch'] + ([directory] if directory else [])
+    args = build_parser().parse_args(argv)
+    full_upload = getattr(args, 'full', False) or os.getenv('FULL_UPLOAD') == '1'
+    resume = getattr(args, 'resume', False) or os.getenv('RESUME') == '1'
+
+    if args.command in ('run', 'watch', 'scan', 'exif', 'convert', 'worker') and not args.directory:
+        print("缺少目录路径：请设置 watch_dir 或传入目录参数")
+        sys.exit(1)
+    if args.command == 'worker' and not args.queue:
+        print("缺少任务队列：请设置 WORK_QUEUE 或传入 --queue")
+        sys.exit(1)
+
+    if args.command == 'run':
+        run_job(args.directory, full_upload, resume, args.queue)
+    elif args.command == 'watch':
+        watch(args.directory, full_upload, resume, args.queue)
+    elif args.command == 'scan':
+        processor = ImageProcessor(args.directory, output_dir=args.output, clean_output=False)
+        print(processor.scan().summary())
+        print(processor.dedupe().summary())
+    elif args.command == 'exif':
+        processor = ImageProcessor(args.directory, output_dir=args.output, clean_output=False)
+        processor.save_exif_to_json()
+    elif args.command == 'convert':
+        processor = ImageProcessor(args.directory, output_dir=args.output, clean_output=False,
+                                   work_queue=WorkQueue(args.queue) if args.queue else None)
+        processor.reset_output(images_only=True)
+        processor.convert_images()
+    elif args.command == 'worker':
+        queue = WorkQueue(args.queue)
+        until = (lambda: not {'pending', 'leased'} & queue.counts().keys()) if args.once else None
+        work_from_queue(queue, args.directory, args.output, until=until)
+    elif args.command == 'upload':
+        upload_output(args.output, full_upload=full_upload, webhook=not args.no_webhook)
+    elif args.command == 'sync-local':
+        sync_local()
 
-    if run_once:
-        run_job()
-    else:
-        while True:
-            try:
-                if 'run.txt' in os.listdir(directory_to_process):
-                    run_job()
-                    # 删除 run.txt 表示上传完（若已不存在或无权限则忽略）
-                    try:
-                        os.remove(os.path.join(directory_to_process, 'run.txt'))
-                    except Exception:
-                        pass
-                    break
-            except Exception:
-                pass
-            time.sleep(1)
-            print('.', end='', flush=True)
-        
+
+if __name__ == '__main__':
+    main()
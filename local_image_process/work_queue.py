@@ -0,0 +1,216 @@
+"""
+多机共享的转换任务队列（SQLite）
+协调端（run / convert）扫描图库后把待转换的图片写入队列，自己和任意多个 worker（其他机器或同机的其他容器）
+从队列领取任务，转换结果直接写入共享的输出目录；协调端收齐全部结果后照常合并占位图、上传。
+
+领取任务时加租约，处理期间后台线程定期续约；worker 崩溃或断网后租约过期，任务由其他 worker 重新领取。
+反复让 worker 失联的任务超过最大领取次数后记为失败。任务只记录相对路径，各机器可以把图库和输出目录挂载在不同位置。
+
+队列文件需放在各节点都能访问、且支持文件锁的位置（NAS 上的 NFSv4 / SMB，或同机容器共享的卷）；
+SQLite 使用回滚日志模式（WAL 依赖共享内存，不能跨机器）。租约按各节点的系统时钟判断，节点间需要时间同步。
+
+环境变量：
+  WORK_QUEUE          队列文件路径；设置后 run / convert 通过队列分发转换任务（等同 --queue）
+  QUEUE_LEASE         租约时长（秒，默认 120，处理期间每三分之一租约续约一次）
+  QUEUE_MAX_ATTEMPTS  同一任务最多被领取的次数（默认 3）
+  QUEUE_BATCH         每次领取的任务数（默认为并发转换子进程数的 2 倍）
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source TEXT NOT NULL,
+        key TEXT NOT NULL,
+        sig TEXT,
+        cost INTEGER NOT NULL DEFAULT 0,
+        rank INTEGER NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        owner TEXT,
+        lease_until REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        seq INTEGER,
+        result TEXT,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_tasks_claim ON tasks(state, rank);
+    CREATE INDEX IF NOT EXISTS idx_tasks_seq ON tasks(seq);
+    CREATE TABLE IF NOT EXISTS meta (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    );
+"""
+
+
+def queue_path() -> str | None:
+    return os.getenv('WORK_QUEUE') or None
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class QueueTask:
+    def __init__(self, task_id: int, source: str, key: str, sig: str | None, cost: int):
+        self.id = task_id
+        self.source = source
+        self.key = key
+        self.sig = sig
+        self.cost = cost
+
+
+class WorkQueue:
+    def __init__(self, path: str, lease_seconds: float | None = None, max_attempts: int | None = None):
+        self.path = path
+        self.lease_seconds = lease_seconds or float(os.getenv('QUEUE_LEASE', '120'))
+        self.max_attempts = max_attempts or int(os.getenv('QUEUE_MAX_ATTEMPTS', '3'))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 续约线程与领取 / 提交在不同线程，连接不跨线程共享
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=DELETE")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        # 立即取得写锁，多个节点同时领取时不会领到同一个任务
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def start_job(self, tasks: list[tuple[str, str, str | None, int]], settings: dict):
+        """清空队列并按顺序写入本次任务 [(源文件相对路径, 输出 key, 签名, 估算内存)]"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM tasks")
+            conn.executemany(
+                "INSERT INTO tasks (source, key, sig, cost, rank) VALUES (?, ?, ?, ?, ?)",
+                [(source, key, sig, cost, rank) for rank, (source, key, sig, cost) in enumerate(tasks)],
+            )
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('settings', ?)", (json.dumps(settings),))
+
+    def claim(self, worker_id: str, limit: int) -> tuple[list[QueueTask], dict]:
+        """领取最多 limit 个待处理或租约已过期的任务，连同这些任务所属任务批次的设置"""
+        now = time.time()
+        with self._transaction() as conn:
+            # 多次领取都没能完成（worker 反复失联）的任务不再发放
+            expired = conn.execute(
+                "SELECT id FROM tasks WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            ).fetchall()
+            for (task_id,) in expired:
+                self._finish(conn, task_id, 'failed', None,
+                             json.dumps({'reason': 'crashed', 'detail': f"领取 {self.max_attempts} 次均未完成"}))
+            rows = conn.execute(
+                "SELECT id, source, key, sig, cost FROM tasks "
+                "WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) ORDER BY rank LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                [(worker_id, now + self.lease_seconds, row[0]) for row in rows],
+            )
+            # 与领取在同一事务中读取，协调端随后开始新的任务批次也不会拿错设置
+            settings = conn.execute("SELECT value FROM meta WHERE name = 'settings'").fetchone()
+        return [QueueTask(*row) for row in rows], json.loads(settings[0]) if settings else {}
+
+    def renew(self, worker_id: str, task_ids: list[int]):
+        if not task_ids:
+            return
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE tasks SET lease_until = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                [(time.time() + self.lease_seconds, task_id, worker_id) for task_id in task_ids],
+            )
+
+    @staticmethod
+    def _finish(conn, task_id: int, state: str, result: str | None, error: str | None, worker_id: str | None = None):
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM tasks").fetchone()[0]
+        query = "UPDATE tasks SET state = ?, seq = ?, result = ?, error = ?, lease_until = NULL WHERE id = ?"
+        params = [state, seq, result, error, task_id]
+        if worker_id is not None:
+            # 租约已被他人接手时放弃本次结果，以接手者为准
+            query += " AND owner = ? AND state = 'leased'"
+            params.append(worker_id)
+        return conn.execute(query, params).rowcount
+
+    def complete(self, worker_id: str, task_id: int, result) -> bool:
+        with self._transaction() as conn:
+            return self._finish(conn, task_id, 'done', json.dumps(result), None, worker_id) > 0
+
+    def fail(self, worker_id: str, task_id: int, reason: str, detail: str) -> bool:
+        with self._transaction() as conn:
+            error = json.dumps({'reason': reason, 'detail': detail}, ensure_ascii=False)
+            return self._finish(conn, task_id, 'failed', None, error, worker_id) > 0
+
+    def finished_since(self, seq: int) -> list[tuple]:
+        """seq 之后结束的任务 [(seq, 源文件相对路径, state, 结果, 错误)]，按结束顺序"""
+        rows = self._conn().execute(
+            "SELECT seq, source, state, result, error FROM tasks WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+        return [
+            (row[0], row[1], row[2], json.loads(row[3]) if row[3] else None, json.loads(row[4]) if row[4] else None)
+            for row in rows
+        ]
+
+    def counts(self) -> dict[str, int]:
+        return dict(self._conn().execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+
+class LeaseKeeper:
+    """后台定期为正在处理的任务续约"""
+
+    def __init__(self, queue: WorkQueue, worker_id: str):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.held: set[int] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def hold(self, task_ids):
+        with self._lock:
+            self.held.update(task_ids)
+
+    def release(self, task_id: int):
+        with self._lock:
+            self.held.discard(task_id)
+
+    def _run(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            with self._lock:
+                task_ids = list(self.held)
+            try:
+                self.queue.renew(self.worker_id, task_ids)
+            except sqlite3.Error as e:
+                print(f"任务续约失败: {e}")
+        self.queue.close()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,143 @@
+"""
+按相册分片的 EXIF 元数据
+上传端从 EXIF 存储为每个相册生成一个分片（{key: 记录}），文件名带内容哈希，预先压缩为 gzip（安装了 brotli 时另有 .br），
+再生成一个很小的索引 _meta/exif/index.json 记录每个相册当前分片的哈希。
+消费方（webhook 同步）只下载索引，再按哈希比对只下载变化了的相册；分片内容不变则文件名不变，CDN 可以长期缓存。
+索引的文件名不变，CDN 可能返回过期的旧索引（引用已被清理的分片），因此先经存储接口查询索引的 hash，
+变化时再带版本参数下载；分片按内容寻址，直接经 CDN 下载。
+
+存储中的布局：
+  _meta/exif/index.json              {"version": 1, "albums": {相册: {"hash", "count", "encodings"}}}
+  _meta/exif/<hash>.json.gz / .br    相册分片
+"""
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from json_stream import dumps_compact
+
+SHARD_PREFIX = '_meta/exif/'
+INDEX_KEY = SHARD_PREFIX + 'index.json'
+INDEX_VERSION = 1
+# 不再被索引引用的旧分片保留一段时间，CDN 或客户端缓存的旧索引仍能取到分片
+SHARD_RETENTION = 24 * 3600
+MIME_TYPES = {'gz': 'application/gzip', 'br': 'application/x-brotli'}
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，没有时只生成 gzip
+    brotli = None
+
+
+def encodings() -> list[str]:
+    return ['br', 'gz'] if brotli is not None else ['gz']
+
+
+def shard_key(digest: str, encoding: str) -> str:
+    return f"{SHARD_PREFIX}{digest}.json.{encoding}"
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    # mtime=0 使相同内容的压缩结果逐字节一致
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _decompress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.decompress(data)
+    return gzip.decompress(data)
+
+
+def build_shards(store, out_dir: str, only=None, base: dict | None = None) -> dict:
+    """从 ExifStore 生成相册分片到 out_dir，返回索引（同时写出 out_dir/index.json）
+
+    only 为已发布的相册时只为这些相册生成分片，其余相册沿用 base 索引（存储中原有的索引）的条目：
+    分相册发布时，图片还没上传的相册不会提前出现在索引里
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    albums = {}
+    if only is not None:
+        only = set(only)
+        albums = {album: entry for album, entry in ((base or {}).get('albums') or {}).items() if album not in only}
+    for album, rows in store.iter_raw_by_album():
+        if only is not None and album not in only:
+            continue
+        body = '{' + ','.join(f"{dumps_compact(key)}:{raw}" for key, raw in rows) + '}'
+        data = body.encode('utf-8')
+        digest = hashlib.blake2b(data, digest_size=8).hexdigest()
+        for encoding in encodings():
+            path = os.path.join(out_dir, f"{digest}.json.{encoding}")
+            if not os.path.exists(path):
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(_compress(data, encoding))
+                os.replace(tmp_path, path)
+        albums[album] = {'hash': digest, 'count': len(rows), 'encodings': encodings()}
+    index = {'version': INDEX_VERSION, 'albums': albums}
+    tmp_path = os.path.join(out_dir, 'index.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(dumps_compact(index))
+    os.replace(tmp_path, os.path.join(out_dir, 'index.json'))
+    return index
+
+
+def publish_shards(backend, out_dir: str, index: dict) -> int:
+    """上传存储中还没有的分片和新索引，清理超过保留期且不再被引用的旧分片，返回上传的分片数"""
+    existing = {item['key']: item for item in backend.iter_items(SHARD_PREFIX)}
+    referenced = set()
+    pending = []
+    for entry in index['albums'].values():
+        for encoding in entry['encodings']:
+            key = shard_key(entry['hash'], encoding)
+            referenced.add(key)
+            if key not in existing:
+                pending.append((key, os.path.join(out_dir, f"{entry['hash']}.json.{encoding}")))
+    for key, local_path in pending:
+        # 按压缩格式标注类型；未设置 Content-Encoding，客户端取到的就是压缩后的字节
+        backend.put_file(key, local_path, mime_type=MIME_TYPES[key.rsplit('.', 1)[1]])
+    # 分片全部就位后再更新索引，消费方看到的索引引用的分片一定存在
+    backend.put_file(INDEX_KEY, os.path.join(out_dir, 'index.json'), mime_type='application/json')
+
+    cutoff = (time.time() - SHARD_RETENTION) * 1e7
+    stale = [
+        key for key, item in existing.items()
+        if key != INDEX_KEY and key not in referenced and (item.get('putTime') or 0) < cutoff
+    ]
+    if stale:
+        backend.delete_many(stale)
+    return len(pending)
+
+
+def fetch_index(backend, etag: str | None = None):
+    """按存储中的版本（hash）下载索引，返回 (索引, 版本)；版本与 etag 相同时索引为 None"""
+    item = backend.stat(INDEX_KEY)
+    if item is None:
+        raise FileNotFoundError(f"存储中没有分片索引: {INDEX_KEY}")
+    version = item.get('hash') or str(item.get('putTime'))
+    if etag and etag == version:
+        return None, version
+    index = json.loads(backend.get(INDEX_KEY, version=version))
+    if index.get('version') != INDEX_VERSION:
+        raise ValueError(f"不支持的索引版本: {index.get('version')}")
+    return index, version
+
+
+def load_remote_index(backend) -> dict | None:
+    """下载存储中当前的索引；没有索引或读取失败时返回 None"""
+    try:
+        index, _ = fetch_index(backend)
+    except Exception:
+        return None
+    return index
+
+
+def fetch_shard(backend, entry: dict) -> dict:
+    """下载一个相册分片，优先使用本地能解压的最小编码"""
+    available = [encoding for encoding in encodings() if encoding in entry.get('encodings', [])]
+    encoding = available[0] if available else 'gz'
+    data = _decompress(backend.get(shard_key(entry['hash'], encoding)), encoding)
+    return json.loads(data)
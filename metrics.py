@@ -0,0 +1,216 @@
+"""
+计时与计数指标
+流水线各阶段（读取、解码、方向校正、水印、编码、EXIF 解析、逆地理编码、上传）记录耗时直方图和计数，
+每次运行结束写出汇总 JSON；server.py 的 /metrics 以 Prometheus 文本格式输出
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# 直方图桶上界（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 属于本地计算的阶段，用于判断一次运行是否受 CPU 限制
+CPU_STAGES = ('decode', 'transpose', 'placeholder', 'watermark', 'encode')
+
+DEFAULT_SUMMARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'pipeline_metrics.json')
+
+
+def summary_path() -> str:
+    return os.getenv('PIPELINE_METRICS_PATH') or DEFAULT_SUMMARY_PATH
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class Metrics:
+    """线程安全的计数器与直方图集合"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.histograms: dict[tuple[str, tuple], dict] = {}
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(BUCKETS)}
+            hist['count'] += 1
+            hist['sum'] += seconds
+            hist['max'] = max(hist['max'], seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    hist['buckets'][i] += 1
+                    break
+
+    @contextmanager
+    def timer(self, name: str = 'stage_seconds', **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                'histograms': [
+                    {'name': name, 'labels': dict(labels), **hist, 'buckets': list(hist['buckets'])}
+                    for (name, labels), hist in sorted(self.histograms.items())
+                ],
+            }
+
+    def merge(self, data: dict):
+        """把 snapshot() 的结果（如子进程的指标）累加进来"""
+        with self._lock:
+            for item in data.get('counters') or []:
+                key = (item['name'], _labels_key(item.get('labels') or {}))
+                self.counters[key] = self.counters.get(key, 0.0) + item['value']
+            for item in data.get('histograms') or []:
+                key = (item['name'], _labels_key(item.get('labels') or {}))
+                hist = self.histograms.get(key)
+                if hist is None:
+                    hist = self.histograms[key] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(BUCKETS)}
+                hist['count'] += item['count']
+                hist['sum'] += item['sum']
+                hist['max'] = max(hist['max'], item.get('max', 0.0))
+                hist['buckets'] = [a + b for a, b in zip(hist['buckets'], item['buckets'])]
+
+    @classmethod
+    def from_snapshot(cls, data: dict) -> 'Metrics':
+        restored = cls()
+        for item in data.get('counters') or []:
+            restored.counters[(item['name'], _labels_key(item.get('labels') or {}))] = item['value']
+        for item in data.get('histograms') or []:
+            restored.histograms[(item['name'], _labels_key(item.get('labels') or {}))] = {
+                'count': item['count'], 'sum': item['sum'], 'max': item.get('max', 0.0),
+                'buckets': list(item['buckets']),
+            }
+        return restored
+
+    def to_prometheus(self, prefix: str = 'moment_') -> str:
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                full_name = prefix + name
+                if full_name not in typed:
+                    lines.append(f"# TYPE {full_name} counter")
+                    typed.add(full_name)
+                lines.append(f"{full_name}{_format_labels(labels)} {value:g}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                full_name = prefix + name
+                if full_name not in typed:
+                    lines.append(f"# TYPE {full_name} histogram")
+                    typed.add(full_name)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, hist['buckets']):
+                    cumulative += count
+                    lines.append(f"{full_name}_bucket{_format_labels(labels, (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{full_name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {hist['count']}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {hist['sum']:.6f}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {hist['count']}")
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+# 进程内默认指标集合
+metrics = Metrics()
+
+
+def build_run_summary(registry: Metrics, started_at: float, finished_at: float, cpu_seconds: float) -> dict:
+    """汇总一次运行：各阶段耗时，以及本地计算 / 读取 / 上传哪个占主导"""
+    wall_seconds = max(finished_at - started_at, 1e-9)
+    snapshot = registry.snapshot()
+    stages = {}
+    for hist in snapshot['histograms']:
+        if hist['name'] != 'stage_seconds':
+            continue
+        stage = hist['labels'].get('stage', '')
+        stages[stage] = {
+            'count': hist['count'],
+            'seconds': round(hist['sum'], 4),
+            'avg_ms': round(hist['sum'] / hist['count'] * 1000, 2) if hist['count'] else None,
+            'max_ms': round(hist['max'] * 1000, 2),
+        }
+    # 本地计算（解码/编码等）、读取原图（NAS）、上传（上行带宽）三者谁占主导
+    candidates = {
+        'cpu': sum(stages.get(s, {}).get('seconds', 0.0) for s in CPU_STAGES),
+        'nas': stages.get('read', {}).get('seconds', 0.0),
+        'uplink': stages.get('upload', {}).get('seconds', 0.0),
+    }
+    return {
+        'started_at': started_at,
+        'finished_at': finished_at,
+        'wall_seconds': round(wall_seconds, 3),
+        'process_cpu_seconds': round(cpu_seconds, 3),
+        'stages': stages,
+        'bound_by': max(candidates, key=candidates.get) if any(candidates.values()) else None,
+        'metrics': snapshot,
+    }
+
+
+def write_run_summary(summary: dict, path: str | None = None) -> str:
+    path = path or summary_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_run_summary(path: str | None = None) -> dict | None:
+    path = path or summary_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def run_summary_to_prometheus(summary: dict | None, prefix: str = 'moment_pipeline_') -> str:
+    """把最近一次流水线运行的汇总渲染为 Prometheus 文本"""
+    if not summary:
+        return ''
+    lines = [
+        f"# TYPE {prefix}last_run_timestamp_seconds gauge",
+        f"{prefix}last_run_timestamp_seconds {summary.get('finished_at', 0):.0f}",
+        f"# TYPE {prefix}last_run_wall_seconds gauge",
+        f"{prefix}last_run_wall_seconds {summary.get('wall_seconds', 0)}",
+        f"# TYPE {prefix}last_run_cpu_seconds gauge",
+        f"{prefix}last_run_cpu_seconds {summary.get('process_cpu_seconds', 0)}",
+    ]
+    text = '\n'.join(lines) + '\n'
+    return text + Metrics.from_snapshot(summary.get('metrics') or {}).to_prometheus(prefix)
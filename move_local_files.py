@@ -5,17 +5,85 @@
 import os
 import json
 import shutil
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
+from json_stream import JsonObjectWriter, iter_json_object
+
 load_dotenv()
 
 MOVED_PHOTOS_FILE = 'Momentography/data/moved_photos.json'
 WATCH_DIR = os.getenv('WATCH_DIR', '')
-
-
-def move_local_files():
-    """移动本地文件到新的相册目录"""
+EXIF_KEY = 'gallery/exif_data.json'
+
+
+def _gallery_key(url):
+    """https://domain.com/gallery/album/filename.webp -> gallery/album/filename.webp"""
+    if not url or '/gallery/' not in url:
+        return None
+    return 'gallery/' + url.split('/gallery/', 1)[1]
+
+
+def _rename_remote_exif_keys(backend, renames):
+    """把远程 exif_data.json 中的键按 {旧键: 新键} 改名后写回"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        remote_file = os.path.join(tmp_dir, 'exif_data.remote.json')
+        renamed_file = os.path.join(tmp_dir, 'exif_data.json')
+        # 通过存储接口读取而不是公开链接下载，避免读到 CDN 缓存的旧内容后把它写回
+        with open(remote_file, 'wb') as f:
+            f.write(backend.get(EXIF_KEY))
+        count = 0
+        with JsonObjectWriter(renamed_file) as writer:
+            for key, value in iter_json_object(remote_file):
+                if key in renames:
+                    key = renames[key]
+                    count += 1
+                writer.write(key, value)
+        if count:
+            backend.put_file(EXIF_KEY, renamed_file, mime_type='application/json')
+        return count
+
+
+def move_remote_objects(moved_photos, backend=None):
+    """把移动记录同步为存储上的服务端批量 move，并同步改名 exif_data.json 中的键
+
+    移动成功后，下一次上传时新路径已存在，不会重新上传，旧路径也不需要再删除；
+    移动失败的记录保持原有流程（上传新路径、删除旧路径）
+    """
+    pairs = []
+    for record in moved_photos:
+        src = _gallery_key(record.get('oldUrl'))
+        dst = _gallery_key(record.get('newUrl'))
+        if src and dst and src != dst:
+            pairs.append((src, dst))
+    if not pairs:
+        return []
+
+    if backend is None:
+        from listing_snapshot import SnapshotBackend
+        from storage import storage_from_env
+
+        backend = SnapshotBackend(storage_from_env())
+
+    moved = backend.move_many(pairs)
+    print(f"云端移动完成：成功 {len(moved)} 个，失败 {len(pairs) - len(moved)} 个")
+    if moved:
+        prefix_len = len('gallery/')
+        renames = {src[prefix_len:]: dst[prefix_len:] for src, dst in moved}
+        try:
+            count = _rename_remote_exif_keys(backend, renames)
+            print(f"exif_data.json 已改名 {count} 个键")
+        except Exception as e:
+            print(f"exif_data.json 键改名失败: {e}")
+    return moved
+
+
+def move_local_files(backend=None):
+    """移动本地文件到新的相册目录，再对本地移动成功的记录在存储上做对应的服务端移动
+
+    先移动本地：本地移动失败时云端保持原样，下次上传不会按旧的本地路径撤销云端的移动
+    """
     if not os.path.exists(MOVED_PHOTOS_FILE):
         print("没有待移动的文件记录")
         return
@@ -30,6 +98,7 @@ def move_local_files():
 
     moved_count = 0
     failed_count = 0
+    locally_moved = []
 
     for record in moved_photos:
         filename = record.get('filename', '')
@@ -83,6 +152,7 @@ def move_local_files():
                             shutil.move(old_file_path, new_file_path)
                             print(f"已移动: {old_file_path} -> {new_file_path}")
                             moved_count += 1
+                            locally_moved.append(record)
                             found = True
                         except Exception as e:
                             print(f"移动失败 {old_file_path}: {e}")
@@ -100,6 +170,11 @@ def move_local_files():
             print(f"本地目录不存在或未配置: {WATCH_DIR}")
             failed_count += 1
 
+    try:
+        move_remote_objects(locally_moved, backend)
+    except Exception as e:
+        print(f"云端移动失败，将在下次上传时重新上传: {e}")
+
     # 清空移动记录
     with open(MOVED_PHOTOS_FILE, 'w', encoding='utf-8') as f:
         json.dump([], f)
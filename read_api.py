@@ -0,0 +1,186 @@
+"""
+相册 / 照片只读接口的内存快照
+webhook 同步后的 albums.json 与 EXIF 存储整体读入内存，预先序列化相册列表和每个相册的照片列表，
+计算强 ETag 并按需压缩（gzip，安装了 brotli 时优先 br）；单张照片的 EXIF 在首次请求时生成并缓存。
+重建完成后一次性替换整个快照，请求看到的要么是旧快照要么是新快照。
+
+gunicorn 的每个 worker 各有一份快照：webhook 所在的 worker 导入后立即重建，
+其他 worker 在请求时比较数据文件的 mtime / 大小，发现变化再重建。
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+import config
+from exif_store import ExifStore
+from json_stream import dumps_compact, iter_json_object
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，没有时只用 gzip
+    brotli = None
+
+# 小于该字节数的响应不压缩
+MIN_COMPRESS_SIZE = 512
+
+_WEBP_SUFFIX = re.compile(r'\.(jpeg|jpg)$', re.IGNORECASE)
+
+
+def photo_id(key: str) -> str:
+    """EXIF 键与网站的图片 ID 一致：原图扩展名换成 .webp"""
+    return _WEBP_SUFFIX.sub('.webp', key)
+
+
+def image_id_of(url: str, album_id: str) -> str:
+    """图片链接对应的 ID：对象 key 去掉 gallery/ 前缀（与 EXIF 键相同），嵌套相册保留子目录
+
+    链接由 public_url(key) 生成，key 为 gallery/<相册>/[子相册/...]<文件名>，
+    从路径中第一个等于顶层相册名的段开始截取
+    """
+    path = url.split('://', 1)[1].split('/', 1)[-1] if '://' in url else url.lstrip('/')
+    parts = path.split('/')
+    if album_id in parts[:-1]:
+        return '/'.join(parts[parts.index(album_id):])
+    return f"{album_id}/{parts[-1]}"
+
+
+class Resource:
+    """一个预先序列化的 JSON 响应体，带强 ETag，压缩结果按编码缓存"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self._encoded: dict[str, bytes] = {}
+
+    @classmethod
+    def from_json(cls, value) -> 'Resource':
+        return cls(dumps_compact(value).encode('utf-8'))
+
+    def encoded(self, encoding: str) -> bytes:
+        data = self._encoded.get(encoding)
+        if data is None:
+            if encoding == 'br':
+                data = brotli.compress(self.body, quality=5)
+            else:
+                # mtime=0 使相同内容的压缩结果逐字节一致
+                data = gzip.compress(self.body, compresslevel=6, mtime=0)
+            self._encoded[encoding] = data
+        return data
+
+    def etag_for(self, encoding: str | None) -> str:
+        """各编码的表示各有自己的强 ETag"""
+        return self.etag + {'br': '-br', 'gzip': '-gz'}.get(encoding, '')
+
+
+def choose_encoding(accept_encoding: str, size: int) -> str | None:
+    if size < MIN_COMPRESS_SIZE:
+        return None
+    accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def not_modified(resource: Resource, if_none_match: str | None, encoding: str | None = None) -> bool:
+    """只与本次实际返回的表示（按 encoding）的 ETag 比较，持有 gzip 表示的客户端不会在 br / 未压缩响应上得到 304"""
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix('W/').strip('"') for tag in if_none_match.split(',')}
+    return '*' in tags or resource.etag_for(encoding) in tags
+
+
+class ReadSnapshot:
+    """某一时刻的相册与 EXIF 数据"""
+
+    def __init__(self, albums: dict, exif_raw: dict[str, str]):
+        # 图片 ID -> EXIF 原始 JSON 文本
+        self.exif_raw = exif_raw
+        summaries = []
+        self.album_resources: dict[str, Resource] = {}
+        for album_id, info in albums.items():
+            images = info.get('images') or []
+            meta = {k: v for k, v in info.items() if k != 'images'}
+            photos = []
+            for url in images:
+                image_id = image_id_of(url, album_id)
+                raw = exif_raw.get(image_id)
+                record = json.loads(raw) if raw else {}
+                photos.append({
+                    'id': image_id,
+                    'url': url,
+                    'date': record.get('DateTime'),
+                    'location': record.get('Location'),
+                    'placeholder': record.get('Placeholder'),
+                    'dominantColor': record.get('DominantColor'),
+                })
+            summaries.append({**meta, 'id': album_id, 'cover': images[0] if images else None, 'count': len(images)})
+            self.album_resources[album_id] = Resource.from_json({**meta, 'id': album_id, 'photos': photos})
+        summaries.sort(key=lambda album: str(album.get('date') or ''), reverse=True)
+        self.albums_resource = Resource.from_json({'albums': summaries})
+        self._photo_resources: dict[str, Resource] = {}
+
+    @classmethod
+    def load(cls) -> 'ReadSnapshot':
+        albums = dict(iter_json_object(config.albums_json_path)) if os.path.exists(config.albums_json_path) else {}
+        exif_raw = {}
+        if os.path.exists(config.exif_db_path):
+            with ExifStore(config.exif_db_path, readonly=True) as store:
+                exif_raw = {photo_id(key): raw for key, raw in store.conn.execute("SELECT key, raw FROM exif")}
+        return cls(albums, exif_raw)
+
+    def photo_exif(self, image_id: str) -> Resource | None:
+        resource = self._photo_resources.get(image_id)
+        if resource is None:
+            raw = self.exif_raw.get(image_id)
+            if raw is None:
+                return None
+            resource = self._photo_resources[image_id] = Resource(raw.encode('utf-8'))
+        return resource
+
+
+def _data_signature() -> tuple:
+    # 同步只在内容变化时重写 albums.json / exif_data.json，两者的 mtime 与大小足以判断数据是否更新
+    signature = []
+    for path in (config.albums_json_path, config.exif_json_path):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class SnapshotCache:
+    """持有当前快照；数据文件变化时重建并整体替换"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (数据文件签名, 快照)，作为一个元组整体替换
+        self._state: tuple[tuple, ReadSnapshot] | None = None
+
+    def _rebuild(self) -> ReadSnapshot:
+        # 先记签名再读数据：读取期间数据又变化时，下次请求会再重建一次
+        signature = _data_signature()
+        snapshot = ReadSnapshot.load()
+        self._state = (signature, snapshot)
+        return snapshot
+
+    def refresh(self) -> ReadSnapshot:
+        with self._lock:
+            return self._rebuild()
+
+    def current(self) -> ReadSnapshot:
+        state = self._state
+        if state is not None and state[0] == _data_signature():
+            return state[1]
+        with self._lock:
+            # 等锁期间其他线程可能已经重建
+            state = self._state
+            if state is not None and state[0] == _data_signature():
+                return state[1]
+            return self._rebuild()
@@ -1,76 +1,178 @@
 import os
 import json
-import requests
 import yaml
 from datetime import date
 import config
-from qiniu import Auth, BucketManager
+from json_stream import JsonObjectWriter, dumps_compact, iter_json_object, load_raw_values
+from exif_store import ExifStore, album_of
+import geo_index
+from metadata_shards import fetch_index, fetch_shard
+from storage import QiniuStorage, StorageBackend, storage_from_env
 
-def get_exif_json(domain):
-    exif_url = f"https://{domain}/gallery/exif_data.json"
-    response = requests.get(exif_url, timeout=30)
-    response.raise_for_status()
-    exif_data_dict = response.json()
+def _load_sync_state(state_file):
+    """读取上次同步时记录的 ETag / Last-Modified"""
+    if not os.path.exists(state_file):
+        return {}
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    # 检查本地是否存在 exif_data.json 文件
+
+def _save_sync_state(state_file, state):
+    tmp_file = f"{state_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+
+def _update_exif_store(local_exif_file, upserts, removed, total):
+    """把本次变化增量应用到 EXIF 存储；存储缺失或条数对不上时整体重建"""
+    store_exists = os.path.exists(config.exif_db_path)
+    with ExifStore(config.exif_db_path) as store:
+        if store_exists:
+            for key in removed:
+                store.delete(key)
+            for key, value in upserts.items():
+                store.upsert(key, value)
+            if store.count() == total:
+                print(f"EXIF 存储已增量更新：写入 {len(upserts)} 条，删除 {len(removed)} 条。")
+                return
+        count = store.import_json(local_exif_file)
+        print(f"EXIF 存储已重建，共 {count} 条。")
+
+
+def _sync_exif_shards(backend: StorageBackend):
+    """按分片索引只下载有变化的相册，返回本地数据是否变化；存储中没有索引时返回 None"""
     local_exif_file = config.exif_json_path
-    local_exif_data_dict = {}
+    state_file = f"{local_exif_file}.shards.json"
+    state = _load_sync_state(state_file) if os.path.exists(local_exif_file) else {}
 
-    if os.path.exists(local_exif_file):
-        with open(local_exif_file, 'r', encoding='utf-8') as json_file:
-            local_exif_data_dict = json.load(json_file)  # 读取本地数据
+    try:
+        index, version = fetch_index(backend, etag=state.get('etag'))
+    except Exception as e:
+        print(f"获取元数据分片索引失败，改为同步完整的 exif_data.json: {e}")
+        return None
+    if index is None:
+        print("元数据分片索引远程未变化，跳过同步。")
+        return False
 
-    # 更新本地数据
-    for key in list(local_exif_data_dict.keys()):
-        if key not in exif_data_dict:
-            # 如果远程没有该键，而本地有，则删除本地的键
-            del local_exif_data_dict[key]
-            print(f"删除本地的键: {key}")
+    albums = index['albums']
+    known = state.get('albums') or {}
+    changed_albums = [album for album, entry in albums.items() if known.get(album) != entry['hash']]
+    local_raw_values = load_raw_values(local_exif_file)
 
-    for key in exif_data_dict:
-        if key not in local_exif_data_dict:
-            # 如果本地没有该键，则将远程的键添加到本地
-            local_exif_data_dict[key] = exif_data_dict[key]
-            print(f"添加远程的键: {key}")
+    # 未变化相册沿用本地记录，索引中已没有的相册整体删除，变化的相册以分片为准
+    new_raw_values = {
+        key: raw for key, raw in local_raw_values.items()
+        if album_of(key) in albums and album_of(key) not in changed_albums
+    }
+    upserts = {}
+    for album in changed_albums:
+        for key, value in fetch_shard(backend, albums[album]).items():
+            raw_value = dumps_compact(value)
+            if local_raw_values.get(key) != raw_value:
+                upserts[key] = value
+            new_raw_values[key] = raw_value
+    removed = local_raw_values.keys() - new_raw_values.keys()
 
-    # 将更新后的数据写回到本地的 exif_data.json 文件
-    with open(local_exif_file, 'w', encoding='utf-8') as json_file:
-        json.dump(local_exif_data_dict, json_file, ensure_ascii=False, indent=4)
+    with JsonObjectWriter(local_exif_file, skip_unchanged=True) as writer:
+        for key in sorted(new_raw_values):
+            writer.write_raw(key, new_raw_values[key])
 
-    print("exif_data.json 文件已更新并保存到本地。")
+    changed = writer.changed or bool(upserts or removed)
+    if changed or not os.path.exists(config.exif_db_path):
+        _update_exif_store(local_exif_file, upserts, removed, len(new_raw_values))
 
+    _save_sync_state(state_file, {
+        'etag': version,
+        'albums': {album: entry['hash'] for album, entry in albums.items()},
+    })
+    print(f"按分片同步 EXIF：下载 {len(changed_albums)}/{len(albums)} 个相册，"
+          f"写入 {len(upserts)} 条，删除 {len(removed)} 条。")
+    return changed
 
-def update_albums_json_data(auth, bucket_name, domain, folder='gallery'):
-    # 存储相册信息的字典
-    albums = {}
 
-    prefix = folder.rstrip('/') + '/'
-    bucket_manager = BucketManager(auth)
-    marker = None
-    while True:
-        ret, eof, info = bucket_manager.list(bucket_name, prefix=prefix, marker=marker)
-        for item in ret.get('items', []):
-            key = item.get('key', '')
-            if key.endswith('.webp'):
-                # 生成图片链接
-                image_url = f"https://{domain}/{key}"
-                # 获取相册名称（假设相册名称是文件路径的一部分）
-                album_name = key.split('/')[1]
-                if album_name not in albums:
-                    albums[album_name] = {'images': []}
-                albums[album_name]['images'].append(image_url)
-            elif key.endswith('.yaml'):
-                yaml_url = f"https://{domain}/{key}"
-                resp = requests.get(yaml_url, timeout=30)
-                resp.raise_for_status()
-                album_info = yaml.safe_load(resp.text)
-                album_name = key.split('/')[1]
-                if album_name not in albums:
-                    albums[album_name] = {'images': []}
-                albums[album_name].update(album_info)
-        if eof:
-            break
-        marker = ret.get('marker')
+def get_exif_json(domain=None, backend: StorageBackend | None = None):
+    """同步远程 EXIF 数据到本地，返回本地数据是否发生变化
+
+    优先读取按相册分片的元数据（只下载变化的相册），存储中没有分片索引时下载完整的 exif_data.json
+    """
+    backend = backend or storage_from_env()
+    changed = _sync_exif_shards(backend)
+    if changed is not None:
+        return changed
+
+    local_exif_file = config.exif_json_path
+    remote_tmp_file = f"{local_exif_file}.remote"
+    state_file = f"{local_exif_file}.sync.json"
+
+    # 条件请求：本地文件存在时带上上次的 ETag / Last-Modified，远程未变化时只需一次 304
+    state = _load_sync_state(state_file) if os.path.exists(local_exif_file) else {}
+
+    # 远程文件直接流式落盘，不整体解析到内存
+    result = backend.download(
+        'gallery/exif_data.json', remote_tmp_file,
+        etag=state.get('etag'), last_modified=state.get('last_modified'),
+    )
+    if result.not_modified:
+        print("exif_data.json 远程未变化，跳过同步。")
+        return False
+    new_state = {'etag': result.etag, 'last_modified': result.last_modified}
+
+    try:
+        # 本地数据只保留紧凑序列化后的字符串，用于按键比对内容
+        local_raw_values = load_raw_values(local_exif_file)
+        remote_keys = set()
+        upserts = {}
+        added = modified = 0
+
+        # 以远程为准逐条写回：新增、修改都应用远程值，远程没有的键被删除
+        with JsonObjectWriter(local_exif_file, skip_unchanged=True) as writer:
+            for key, value in iter_json_object(remote_tmp_file):
+                remote_keys.add(key)
+                raw_value = dumps_compact(value)
+                local_raw_value = local_raw_values.get(key)
+                if local_raw_value is None:
+                    added += 1
+                    upserts[key] = value
+                    print(f"添加远程的键: {key}")
+                elif local_raw_value != raw_value:
+                    modified += 1
+                    upserts[key] = value
+                    print(f"更新远程修改的键: {key}")
+                writer.write_raw(key, raw_value)
+
+        removed = local_raw_values.keys() - remote_keys
+        for key in removed:
+            print(f"删除本地的键: {key}")
+    finally:
+        try:
+            os.remove(remote_tmp_file)
+        except OSError:
+            pass
+
+    changed = writer.changed or bool(upserts or removed)
+    if changed or not os.path.exists(config.exif_db_path):
+        # 同步刷新带索引的 EXIF 存储，查询和导入走存储而不是整份 JSON
+        _update_exif_store(local_exif_file, upserts, removed, len(remote_keys))
+
+    _save_sync_state(state_file, new_state)
+    if changed:
+        print(f"exif_data.json 文件已更新并保存到本地：新增 {added} 条，修改 {modified} 条，删除 {len(removed)} 条。")
+    else:
+        print("exif_data.json 内容无变化，未重写本地文件。")
+    return changed
+
+
+def update_albums_json_data(auth=None, bucket_name=None, domain=None, folder='gallery', backend: StorageBackend | None = None):
+    """同步 albums.json 与 exif_data.json，返回本地数据是否发生变化
+
+    未传 backend 时：给了 auth 则使用七牛，否则按 STORAGE_BACKEND 环境变量选择
+    """
+    if backend is None:
+        backend = QiniuStorage(None, None, bucket_name, domain, auth=auth) if auth else storage_from_env()
 
     # 将日期对象转换为字符串
     def convert_dates(obj):
@@ -82,17 +184,67 @@ def update_albums_json_data(auth, bucket_name, domain, folder='gallery'):
             return obj.isoformat()  # 转换为ISO格式的字符串
         return obj
 
-    # 转换相册信息中的日期
-    albums = convert_dates(albums)
+    prefix = folder.rstrip('/') + '/'
+    # 相册描述 yaml 按列举条目的 hash / putTime 缓存解析结果，未变化的不再下载
+    yaml_cache_file = f"{config.albums_json_path}.yaml.json"
+    yaml_cache = _load_sync_state(yaml_cache_file)
+    new_yaml_cache = {}
+    # 列举结果按 key 字典序返回，同一相册的文件是连续的，
+    # 因此只需缓存当前相册，切换相册时即可写出，不必把所有相册留在内存中
+    current_album = None
+    current_info = None
+
+    with JsonObjectWriter(config.albums_json_path, skip_unchanged=True) as writer:
+        for item in backend.iter_items(prefix):
+            key = item.get('key', '')
+            if not key.endswith(('.webp', '.yaml')):
+                continue
+            # 获取相册名称（假设相册名称是文件路径的一部分）
+            album_name = key.split('/')[1]
+            if album_name != current_album:
+                if current_album is not None:
+                    writer.write(current_album, convert_dates(current_info))
+                current_album = album_name
+                current_info = {'images': []}
+            if key.endswith('.webp'):
+                # 生成图片链接
+                current_info['images'].append(backend.public_url(key))
+            else:
+                version = [item.get('hash'), item.get('putTime')]
+                cached = yaml_cache.get(key)
+                if cached and cached['version'] == version and version[0] is not None:
+                    album_info = cached['info']
+                else:
+                    album_info = convert_dates(yaml.safe_load(backend.get(key).decode('utf-8')) or {})
+                new_yaml_cache[key] = {'version': version, 'info': album_info}
+                current_info.update(album_info)
+
+        if current_album is not None:
+            writer.write(current_album, convert_dates(current_info))
 
-    # 将信息保存到JSON文件中
-    with open(config.albums_json_path, 'w', encoding='utf-8') as json_file:
-        json.dump(albums, json_file, ensure_ascii=False, indent=4)
+    if new_yaml_cache != yaml_cache:
+        _save_sync_state(yaml_cache_file, new_yaml_cache)
+    fetched = sum(1 for key, entry in new_yaml_cache.items() if yaml_cache.get(key) != entry)
+    if fetched:
+        print(f"下载了 {fetched}/{len(new_yaml_cache)} 个相册描述。")
 
-    print("相册信息已保存到 albums.json 文件中。")
+    if writer.changed:
+        print("相册信息已保存到 albums.json 文件中。")
+    else:
+        print("albums.json 内容无变化，未重写本地文件。")
 
-    # 从七牛下载 exif_data.json 保存到本地
-    get_exif_json(domain)
+    # 从对象存储下载 exif_data.json 保存到本地
+    exif_changed = get_exif_json(backend=backend)
+
+    # EXIF 变化后重建地图聚合索引，随 EXIF 存储一起导入数据库
+    if os.path.exists(config.exif_db_path) and (exif_changed or not geo_index.is_built(config.exif_db_path)):
+        try:
+            count = geo_index.rebuild(config.exif_db_path)
+            print(f"地图聚合索引已重建：{count} 张带坐标的照片。")
+            exif_changed = True
+        except Exception as e:
+            print(f"重建地图聚合索引失败: {e}")
+    return writer.changed or exif_changed
 
 
 
@@ -103,14 +255,9 @@ if __name__ == "__main__":
     # 加载 .env 文件中的环境变量
     load_dotenv()
 
-    # 读取密钥
-    qiniu_access_key = os.getenv('QINIU_ACCESS_KEY')
-    qiniu_secret_key = os.getenv('QINIU_SECRET_KEY')
-    qiniu_bucket = os.getenv('QINIU_BUCKET')
-    qiniu_domain = os.getenv('QINIU_DOMAIN')
-
-    # 七牛云配置
-    auth = Auth(qiniu_access_key, qiniu_secret_key)
-    update_albums_json_data(auth, qiniu_bucket, qiniu_domain)
-    
-    
+    # 按 STORAGE_BACKEND 选择七牛或本地目录，列举读快照
+    from listing_snapshot import SnapshotBackend, server_snapshot_path
+
+    backend = SnapshotBackend(storage_from_env(), path=server_snapshot_path())
+    backend.pull()
+    update_albums_json_data(backend=backend)
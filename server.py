@@ -1,18 +1,32 @@
 import os
 import subprocess
 
-from qiniu import Auth
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from dotenv import load_dotenv
 
+import config
+from exif_search import SearchQuery, search
+from exif_store import ExifStore
+from listing_snapshot import SnapshotBackend, server_snapshot_path
+from metrics import Metrics, load_run_summary, run_summary_to_prometheus
+from read_api import SnapshotCache, choose_encoding, not_modified
 from read_oss import update_albums_json_data
+from storage import StorageError, storage_from_env
 
 # 在应用启动时加载环境变量
 load_dotenv()
 
 
+def _mark_import_pending():
+    os.makedirs(os.path.dirname(config.import_pending_path), exist_ok=True)
+    with open(config.import_pending_path, "w", encoding="utf-8"):
+        pass
+
+
 def create_app() -> Flask:
     app = Flask(__name__)
+    server_metrics = Metrics()
+    read_cache = SnapshotCache()
 
     def import_json_to_db():
         repo_root = os.path.dirname(os.path.abspath(__file__))
@@ -34,24 +48,41 @@ def create_app() -> Flask:
     # 当 OSS 更新时，更新相册数据和 EXIF 数据到本地 JSON 文件
     @app.route("/webhook", methods=["POST"])
     def webhook():
+        with server_metrics.timer(stage="webhook"):
+            body, status = handle_webhook()
+        server_metrics.inc("webhook_requests_total", status=status)
+        return body, status
+
+    def handle_webhook():
         print("收到 webhook 请求，开始更新相册和 EXIF 数据。")
+        payload = request.get_json(silent=True) or {}
+        if payload.get("partial"):
+            # 分相册发布：上传端已发布列举快照，同样按快照增量更新
+            print(f"部分发布的相册: {', '.join(payload.get('albums') or [])}")
 
         # 加载 .env 文件中的环境变量
         load_dotenv()
 
-        # 读取密钥
-        qiniu_access_key = os.getenv("QINIU_ACCESS_KEY")
-        qiniu_secret_key = os.getenv("QINIU_SECRET_KEY")
-        qiniu_bucket = os.getenv("QINIU_BUCKET")
-        qiniu_domain = os.getenv("QINIU_DOMAIN")
-
-        if not all([qiniu_access_key, qiniu_secret_key, qiniu_bucket, qiniu_domain]):
-            return "Missing Qiniu config", 500
-
-        # 七牛云配置
-        auth = Auth(qiniu_access_key, qiniu_secret_key)
-        update_albums_json_data(auth, qiniu_bucket, qiniu_domain)  # albums.json & exif_data.json
-
+        # 按 STORAGE_BACKEND 选择七牛或本地目录
+        try:
+            backend = storage_from_env()
+        except StorageError as exc:
+            print(f"存储配置错误: {exc}")
+            return "Missing storage config", 500
+
+        # 相册列举读上传端发布的快照，不必每次完整列举 gallery/
+        backend = SnapshotBackend(backend, path=server_snapshot_path())
+        backend.pull()
+        changed = update_albums_json_data(backend=backend)  # albums.json & exif_data.json
+        if not changed and not os.path.exists(config.import_pending_path):
+            print("相册和 EXIF 数据均无变化，跳过数据库导入。")
+            return "Webhook received, no changes", 200
+        if not changed:
+            print("上次数据库导入未完成，重新导入。")
+
+        # 同步状态（ETag、分片哈希）此时已经保存，导入成功前留下标记：
+        # 导入失败后即使远程没有再变化，下一次 webhook 也会重试导入
+        _mark_import_pending()
         try:
             stdout, stderr = import_json_to_db()
             if stdout:
@@ -61,9 +92,70 @@ def create_app() -> Flask:
         except Exception as exc:
             print(f"导入数据库失败: {exc}")
             return "Webhook received, but DB import failed", 500
+        os.remove(config.import_pending_path)
+
+        # 重建只读接口的内存快照（其他 worker 在下次请求时发现数据变化后重建）
+        try:
+            read_cache.refresh()
+        except Exception as exc:
+            print(f"重建只读快照失败: {exc}")
 
         return "Webhook received and DB updated", 200
 
+    @app.route("/metrics", methods=["GET"])
+    def metrics_endpoint():
+        """Prometheus 文本格式：服务端指标 + 最近一次流水线运行的汇总"""
+        body = server_metrics.to_prometheus("moment_server_") + run_summary_to_prometheus(load_run_summary())
+        return Response(body, mimetype="text/plain; version=0.0.4")
+
+    def serve_resource(resource, route):
+        """返回预先序列化的响应：If-None-Match 命中时 304，否则按 Accept-Encoding 压缩"""
+        if resource is None:
+            server_metrics.inc("read_requests_total", route=route, status=404)
+            return jsonify({"error": "Not found"}), 404
+        headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"), len(resource.body))
+        headers["ETag"] = f'"{resource.etag_for(encoding)}"'
+        if not_modified(resource, request.headers.get("If-None-Match"), encoding):
+            server_metrics.inc("read_requests_total", route=route, status=304)
+            return Response(status=304, headers=headers)
+        body = resource.body
+        if encoding:
+            body = resource.encoded(encoding)
+            headers["Content-Encoding"] = encoding
+        server_metrics.inc("read_requests_total", route=route, status=200)
+        return Response(body, mimetype="application/json", headers=headers)
+
+    @app.route("/api/albums", methods=["GET"])
+    def list_albums():
+        """相册列表（不含图片）"""
+        return serve_resource(read_cache.current().albums_resource, "albums")
+
+    @app.route("/api/albums/<album_id>", methods=["GET"])
+    def get_album(album_id):
+        """单个相册及其照片（URL、拍摄时间、地点、占位图）"""
+        return serve_resource(read_cache.current().album_resources.get(album_id), "album")
+
+    @app.route("/api/photos/<path:image_id>/exif", methods=["GET"])
+    def get_photo_exif(image_id):
+        """单张照片的完整 EXIF 记录"""
+        return serve_resource(read_cache.current().photo_exif(image_id), "photo_exif")
+
+    @app.route("/api/search", methods=["GET"])
+    def search_exif():
+        """按相机 / 镜头 / 相册多选和 ISO、焦距、光圈、快门、拍摄时间范围筛选 EXIF，分页返回并附带分面计数"""
+        try:
+            query = SearchQuery.from_args(request.args)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        if not os.path.exists(config.exif_db_path):
+            return jsonify({"error": "EXIF 存储不存在"}), 404
+        with server_metrics.timer(stage="search"):
+            with ExifStore(config.exif_db_path, readonly=True) as store:
+                result = search(store, query)
+        server_metrics.inc("search_requests_total")
+        return jsonify(result)
+
     @app.route("/healthz", methods=["GET"])
     def healthz():
         return "ok", 200
@@ -0,0 +1,351 @@
+"""
+对象存储后端
+统一的 列举 / 上传 / 批量删除 / 下载 / 查询 接口，提供七牛实现和本地目录实现；
+本地实现可用于离线运行流水线和基准测试，也可让单机部署完全不走网络
+"""
+import bisect
+import mimetypes
+import os
+import shutil
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+# 七牛 batch 接口单次最多 1000 个操作
+BATCH_SIZE = 1000
+
+
+class StorageError(Exception):
+    pass
+
+
+class FetchResult:
+    """download 的结果；not_modified 为 True 时本地文件未被改动"""
+
+    def __init__(self, not_modified: bool, etag: str | None = None, last_modified: str | None = None):
+        self.not_modified = not_modified
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class StorageBackend(ABC):
+    """列举结果的条目格式与七牛一致：{'key', 'hash', 'fsize', 'putTime'}"""
+
+    @abstractmethod
+    def list_page(self, prefix: str, marker: str | None = None, limit: int = 1000) -> tuple[list[dict], str | None]:
+        """分页列举，返回 (条目, 下一页 marker)；marker 为 None 表示已到末尾"""
+        ...
+
+    @abstractmethod
+    def put_file(self, key: str, local_path: str, mime_type: str | None = None) -> dict | None:
+        """上传单个文件，返回值中的 hash（如有）会被列举快照记录"""
+        ...
+
+    @abstractmethod
+    def delete_many(self, keys: list[str]) -> int:
+        """批量删除，返回成功删除的数量"""
+        ...
+
+    @abstractmethod
+    def move_many(self, pairs: list[tuple[str, str]]) -> list[tuple[str, str]]:
+        """服务端批量移动 [(源 key, 目标 key)]，目标已存在时覆盖，返回移动成功的部分"""
+        ...
+
+    @abstractmethod
+    def get(self, key: str, version: str | None = None) -> bytes:
+        """读取对象内容；version 为对象当前的 hash 时绕过 CDN 上可能过期的缓存"""
+        ...
+
+    @abstractmethod
+    def download(self, key: str, local_path: str, etag: str | None = None,
+                 last_modified: str | None = None) -> FetchResult:
+        """条件下载到本地文件，远程未变化时返回 not_modified"""
+        ...
+
+    @abstractmethod
+    def stat(self, key: str) -> dict | None:
+        ...
+
+    @abstractmethod
+    def public_url(self, key: str) -> str:
+        ...
+
+    def iter_items(self, prefix: str, limit: int = 1000):
+        marker = None
+        while True:
+            items, marker = self.list_page(prefix, marker=marker, limit=limit)
+            yield from items
+            if not marker:
+                return
+
+    def put_files(self, items: list[tuple[str, str]], workers: int = 4, on_done=None) -> list[tuple[str, str, Exception]]:
+        """并发上传 [(key, local_path)]，返回失败列表 [(key, local_path, error)]
+
+        on_done(key, local_path, error) 在每个文件完成后于调用线程中回调，error 为 None 表示成功
+        """
+        def upload(item):
+            key, local_path = item
+            mime_type, _ = mimetypes.guess_type(local_path)
+            try:
+                with metrics.timer(stage='upload'):
+                    self.put_file(key, local_path, mime_type=mime_type)
+            except Exception as e:
+                metrics.inc('upload_files_total', result='failed')
+                return key, local_path, e
+            metrics.inc('upload_files_total', result='success')
+            metrics.inc('upload_bytes_total', os.path.getsize(local_path))
+            return key, local_path, None
+
+        failures = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for key, local_path, error in pool.map(upload, items):
+                if error is not None:
+                    failures.append((key, local_path, error))
+                if on_done:
+                    on_done(key, local_path, error)
+        return failures
+
+
+class QiniuStorage(StorageBackend):
+    def __init__(self, access_key: str, secret_key: str, bucket: str, domain: str, auth=None):
+        from qiniu import Auth, BucketManager
+
+        self.auth = auth or Auth(access_key, secret_key)
+        self.bucket = bucket
+        self.domain = domain
+        self.bucket_manager = BucketManager(self.auth)
+
+    def list_page(self, prefix, marker=None, limit=1000):
+        ret, eof, info = self.bucket_manager.list(self.bucket, prefix=prefix, marker=marker, limit=limit)
+        if ret is None:
+            raise StorageError(f"列举失败: {info}")
+        items = [
+            {'key': item.get('key'), 'hash': item.get('hash'), 'fsize': item.get('fsize'), 'putTime': item.get('putTime')}
+            for item in ret.get('items') or []
+        ]
+        return items, None if eof else ret.get('marker')
+
+    def put_file(self, key, local_path, mime_type=None):
+        from qiniu import put_file
+
+        token = self.auth.upload_token(self.bucket, key)
+        ret, info = put_file(token, key, local_path, mime_type=mime_type)
+        if info.status_code != 200:
+            raise StorageError(f"上传失败 {key}: {info}")
+        return ret
+
+    def delete_many(self, keys):
+        from qiniu import build_batch_delete
+
+        deleted = 0
+        keys = list(keys)
+        for start in range(0, len(keys), BATCH_SIZE):
+            chunk = keys[start:start + BATCH_SIZE]
+            ret, info = self.bucket_manager.batch(build_batch_delete(self.bucket, chunk))
+            if ret is None:
+                raise StorageError(f"批量删除失败: {info}")
+            # 612 表示文件已不存在，同样视为删除成功
+            deleted += sum(1 for item in ret if item.get('code') in (200, 612))
+        return deleted
+
+    def move_many(self, pairs):
+        from qiniu import build_batch_move
+
+        moved = []
+        # batch 接口以 {源: 目标} 传入，同一源只保留第一次移动（之后的移动源已不存在），
+        # 这样每批的操作与返回结果一一对应
+        unique = {}
+        for src, dst in pairs:
+            unique.setdefault(src, dst)
+        pairs = list(unique.items())
+        for start in range(0, len(pairs), BATCH_SIZE):
+            chunk = pairs[start:start + BATCH_SIZE]
+            ops = build_batch_move(self.bucket, dict(chunk), self.bucket, force='true')
+            ret, info = self.bucket_manager.batch(ops)
+            if ret is None:
+                raise StorageError(f"批量移动失败: {info}")
+            moved.extend(pair for pair, item in zip(chunk, ret) if item.get('code') == 200)
+        return moved
+
+    def get(self, key, version=None):
+        import requests
+
+        # 带上版本参数，CDN 按新的 URL 回源，不会返回缓存的旧内容
+        params = {'v': version} if version else None
+        resp = requests.get(self.public_url(key), params=params, timeout=30)
+        resp.raise_for_status()
+        return resp.content
+
+    def download(self, key, local_path, etag=None, last_modified=None):
+        import requests
+
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        with requests.get(self.public_url(key), headers=headers, timeout=30, stream=True) as response:
+            if response.status_code == 304:
+                return FetchResult(True, etag, last_modified)
+            response.raise_for_status()
+            os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+            with open(local_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+            return FetchResult(False, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+    def stat(self, key):
+        ret, info = self.bucket_manager.stat(self.bucket, key)
+        if ret is None:
+            if info.status_code == 612:
+                return None
+            raise StorageError(f"查询失败 {key}: {info}")
+        return {'key': key, 'hash': ret.get('hash'), 'fsize': ret.get('fsize'), 'putTime': ret.get('putTime')}
+
+    def public_url(self, key):
+        return f"https://{self.domain}/{key}"
+
+
+class LocalStorage(StorageBackend):
+    """把本地目录当作对象存储，key 即相对路径
+
+    hash 使用 "大小-修改时间" 指纹而不是内容摘要，列举时不需要读文件内容
+    """
+
+    def __init__(self, root: str, base_url: str | None = None):
+        self.root = os.path.abspath(root)
+        self.base_url = (base_url or '').rstrip('/')
+        # 前缀 -> 分页列举中的有序 key 列表
+        self._listing: dict[str, list[str]] = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, *key.split('/')))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            raise StorageError(f"非法的 key: {key}")
+        return path
+
+    @staticmethod
+    def _item(key: str, st: os.stat_result) -> dict:
+        return {
+            'key': key,
+            'hash': f"{st.st_size:x}-{st.st_mtime_ns:x}",
+            'fsize': st.st_size,
+            # 与七牛一致，单位为 100 纳秒
+            'putTime': st.st_mtime_ns // 100,
+        }
+
+    def _iter_keys(self, prefix: str):
+        # 只遍历前缀所在目录，按 key 字典序产出
+        base_dir = prefix.rsplit('/', 1)[0] if '/' in prefix else ''
+        start = self._path(base_dir) if base_dir else self.root
+        if not os.path.isdir(start):
+            return
+        keys = []
+        for dirpath, _, files in os.walk(start):
+            for name in files:
+                if name.endswith('.uploading'):
+                    continue
+                rel = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, '/')
+                if rel.startswith(prefix):
+                    keys.append(rel)
+        yield from sorted(keys)
+
+    def list_page(self, prefix, marker=None, limit=1000):
+        # 第一页遍历目录并缓存排好序的 key，后续页在缓存中二分定位 marker，完整列举只遍历一次
+        keys = self._listing.get(prefix) if marker else None
+        if keys is None:
+            keys = self._listing[prefix] = list(self._iter_keys(prefix))
+        start = bisect.bisect_right(keys, marker) if marker else 0
+        items = []
+        for index in range(start, len(keys)):
+            key = keys[index]
+            try:
+                items.append(self._item(key, os.stat(self._path(key))))
+            except FileNotFoundError:
+                continue
+            if len(items) >= limit:
+                if index + 1 < len(keys):
+                    return items, key
+                break
+        self._listing.pop(prefix, None)
+        return items, None
+
+    def put_file(self, key, local_path, mime_type=None):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_path = f"{target}.uploading"
+        shutil.copyfile(local_path, tmp_path)
+        os.replace(tmp_path, target)
+        return self._item(key, os.stat(target))
+
+    def delete_many(self, keys):
+        deleted = 0
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+                deleted += 1
+            except FileNotFoundError:
+                deleted += 1
+        return deleted
+
+    def move_many(self, pairs):
+        moved = []
+        for src, dst in pairs:
+            target = self._path(dst)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.replace(self._path(src), target)
+            except FileNotFoundError:
+                continue
+            moved.append((src, dst))
+        return moved
+
+    def get(self, key, version=None):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError as e:
+            raise StorageError(f"文件不存在: {key}") from e
+
+    def download(self, key, local_path, etag=None, last_modified=None):
+        source = self._path(key)
+        if not os.path.exists(source):
+            raise StorageError(f"文件不存在: {key}")
+        current = self._item(key, os.stat(source))['hash']
+        if etag and etag == current:
+            return FetchResult(True, etag)
+        os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+        shutil.copyfile(source, local_path)
+        return FetchResult(False, current)
+
+    def stat(self, key):
+        try:
+            return self._item(key, os.stat(self._path(key)))
+        except FileNotFoundError:
+            return None
+
+    def public_url(self, key):
+        if self.base_url:
+            return f"{self.base_url}/{key}"
+        return f"/{key}"
+
+
+def storage_from_env(auth=None) -> StorageBackend:
+    """按环境变量创建后端：STORAGE_BACKEND=qiniu（默认）| local"""
+    kind = (os.getenv('STORAGE_BACKEND') or 'qiniu').lower()
+    if kind == 'local':
+        root = os.getenv('LOCAL_STORAGE_DIR')
+        if not root:
+            raise StorageError("STORAGE_BACKEND=local 需要设置 LOCAL_STORAGE_DIR")
+        return LocalStorage(root, os.getenv('LOCAL_STORAGE_BASE_URL'))
+    if kind != 'qiniu':
+        raise StorageError(f"未知的存储后端: {kind}")
+    access_key = os.getenv('QINIU_ACCESS_KEY')
+    secret_key = os.getenv('QINIU_SECRET_KEY')
+    bucket = os.getenv('QINIU_BUCKET')
+    domain = os.getenv('QINIU_DOMAIN')
+    if not all([access_key or auth, secret_key or auth, bucket, domain]):
+        raise StorageError("缺少七牛配置")
+    return QiniuStorage(access_key, secret_key, bucket, domain, auth=auth)
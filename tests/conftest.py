@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 与脚本直接运行时一致：仓库根目录和 local_image_process 都在导入路径中
+sys.path.insert(0, os.path.join(ROOT, 'local_image_process'))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,48 @@
+import os
+
+from PIL import Image
+
+from upload_oss import ImageProcessor
+from work_queue import WorkQueue
+
+
+def test_queue_collects_sources_sharing_an_output_key(tmp_path, monkeypatch):
+    """同名的 jpg 与 png 映射到同一个输出 key，两个任务都要收到结果，协调端才会退出"""
+    monkeypatch.setenv('ISOLATE_WORKERS', '0')
+    library = tmp_path / 'lib'
+    (library / 'album').mkdir(parents=True)
+    Image.new('RGB', (32, 24), 'red').save(library / 'album' / 'a.jpg')
+    Image.new('RGB', (32, 24), 'blue').save(library / 'album' / 'a.png')
+    output_dir = str(tmp_path / 'out')
+
+    processor = ImageProcessor(str(library), output_dir=output_dir, apply_watermark=False, clean_output=False,
+                               work_queue=WorkQueue(str(tmp_path / 'queue.db')))
+    tasks = []
+    for name in ('a.jpg', 'a.png'):
+        file_path = str(library / 'album' / name)
+        output_file = processor.output_file_for(file_path)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        tasks.append((file_path, output_file, 'album/a.webp', None))
+
+    done = []
+    processor._convert_via_queue(tasks, lambda task, placeholder, error: done.append((task[0], error)))
+
+    assert sorted(os.path.basename(path) for path, _ in done) == ['a.jpg', 'a.png']
+    assert all(error is None for _, error in done)
+
+
+def test_dedupe_off_still_merges_sources_sharing_an_output_key(tmp_path, monkeypatch):
+    """关闭去重时同名的 jpg 与 png 也只保留一个，EXIF 与转换取自同一个源文件"""
+    monkeypatch.setenv('DEDUPE', 'off')
+    monkeypatch.setenv('QUARANTINE_PATH', str(tmp_path / 'quarantine.json'))
+    monkeypatch.setenv('ISOLATE_WORKERS', '0')
+    library = tmp_path / 'lib'
+    (library / 'album').mkdir(parents=True)
+    Image.new('RGB', (32, 24), 'red').save(library / 'album' / 'a.jpg')
+    Image.new('RGB', (32, 24), 'blue').save(library / 'album' / 'a.png')
+
+    processor = ImageProcessor(str(library), output_dir=str(tmp_path / 'out'), apply_watermark=False)
+    images = processor.images()
+
+    assert len(images) == 1
+    assert [kept for _, kept, reason in processor.dedupe().duplicates if reason == 'same_name'] == [images[0][0]]
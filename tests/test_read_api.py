@@ -0,0 +1,38 @@
+import json
+
+from read_api import ReadSnapshot, Resource, not_modified
+
+
+def test_nested_album_photos_keep_their_exif():
+    """嵌套相册的图片 ID 取自对象 key（含子目录），与 EXIF 键一致"""
+    albums = {
+        '旅行': {
+            'title': '旅行',
+            'images': [
+                'https://cdn.example.com/gallery/旅行/日本/a.webp',
+                'https://cdn.example.com/gallery/旅行/b.webp',
+            ],
+        },
+    }
+    exif_raw = {
+        '旅行/日本/a.webp': json.dumps({'DateTime': '2024:05:01 10:00:00'}),
+        '旅行/b.webp': json.dumps({'DateTime': '2024:05:02 10:00:00'}),
+    }
+    snapshot = ReadSnapshot(albums, exif_raw)
+
+    photos = json.loads(snapshot.album_resources['旅行'].body)['photos']
+    assert [(photo['id'], photo['date']) for photo in photos] == [
+        ('旅行/日本/a.webp', '2024:05:01 10:00:00'),
+        ('旅行/b.webp', '2024:05:02 10:00:00'),
+    ]
+    assert snapshot.photo_exif('旅行/日本/a.webp') is not None
+
+
+def test_not_modified_only_matches_the_served_encoding():
+    resource = Resource(b'{"albums": []}' * 100)
+    gzip_tag = f'"{resource.etag_for("gzip")}"'
+
+    assert not_modified(resource, gzip_tag, 'gzip')
+    assert not not_modified(resource, gzip_tag, 'br')
+    assert not not_modified(resource, gzip_tag, None)
+    assert not_modified(resource, f'W/"{resource.etag}"', None)
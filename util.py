@@ -7,8 +7,9 @@ import datetime
 from fractions import Fraction  
 import json
 import os
-import numpy as np
+import random
 import config
+from exif_store import ExifStore
 
 root_path = os.path.dirname(os.path.abspath(__file__))
 
@@ -17,19 +18,25 @@ def  get_exif_data(image_url):
     # 本地 JSON 文件的路径
     json_file_path = config.exif_json_path # 替换为实际的本地 JSON 文件路径
     try:
-        with open(json_file_path, 'r', encoding='utf-8') as json_file:
-            exif_data = json.load(json_file)  # 解析 JSON 数据
-
         # 根据 image_url 获取对应的 EXIF 数据
         position = '/'.join(image_url.split('/')[-2:]).split('.')[0]  # 只提取文件名，不添加扩展名
-        
-        # 假设 JSON 数据的结构是一个字典，键是图片 URL，值是对应的 EXIF 数据
-        parsed_exif = {}
-        image_idx = None
-        for key,value in exif_data.items():
-            if key.startswith(position):
-                parsed_exif = value
-                image_idx = key
+
+        if os.path.exists(config.exif_db_path):
+            # 优先使用带索引的 EXIF 存储，按主键查询，无需每次解析整份 JSON
+            with ExifStore(config.exif_db_path, readonly=True) as store:
+                image_idx, parsed_exif = store.find(position)
+            parsed_exif = parsed_exif or {}
+        else:
+            with open(json_file_path, 'r', encoding='utf-8') as json_file:
+                exif_data = json.load(json_file)  # 解析 JSON 数据
+
+            # 假设 JSON 数据的结构是一个字典，键是图片 URL，值是对应的 EXIF 数据
+            parsed_exif = {}
+            image_idx = None
+            for key,value in exif_data.items():
+                if key.startswith(position):
+                    parsed_exif = value
+                    image_idx = key
 
             
         # print("匹配的图片",position,"匹配到的EXIF数据",parsed_exif)
@@ -52,7 +59,7 @@ def  get_exif_data(image_url):
             "Longitude": parsed_exif.get("Longitude", None),
             "Latitude": parsed_exif.get("Latitude", None),
             "star": parsed_exif.get("star", 0),
-            "likes": parsed_exif.get("likes", np.random.randint(90, 401)),
+            "likes": parsed_exif.get("likes", random.randint(90, 400)),
             'image_idx': image_idx
         }
         # print(image_info)